@@ -0,0 +1,213 @@
+import json
+import logging
+import re
+import threading
+from collections import defaultdict
+from math import ceil
+from time import perf_counter
+from urllib.parse import urlparse
+
+from filesync.job_context import PerJob
+from filesync.tracing import tracer
+
+# path segments that are followed by names rather than fixed words
+PLACEHOLDERS = {
+    'orgs': ['{org}'],
+    'repos': ['{owner}', '{repo}'],
+    'users': ['{user}'],
+}
+
+# path segments after which the rest of the path is a single value, since
+# file paths and branch names can contain slashes
+GREEDY_PLACEHOLDERS = {
+    'branches': '{branch}',
+    'compare': '{basehead}',
+    'contents': '{path}',
+    'ref': '{ref}',
+    'refs': '{ref}',
+}
+
+SHA = re.compile(r'^[0-9a-f]{40}$')
+
+# how many of the busiest repos to list in the summary
+SUMMARY_SIZE = 10
+
+NO_PHASE = '(none)'
+
+
+def endpoint_template(url):
+    # "/repos/mezmo/foo/contents/a/b.yml?ref=x" -> "/repos/{owner}/{repo}/
+    # contents/{path}", so calls for different repos add up
+    parts = [part for part in urlparse(url).path.split('/') if part]
+    if parts[:2] == ['api', 'v3']:
+        # GitHub Enterprise serves the API under a prefix
+        parts = parts[2:]
+    template = list()
+    while parts:
+        part = parts.pop(0)
+        if part.isdigit():
+            template.append('{number}')
+        elif SHA.match(part):
+            template.append('{sha}')
+        else:
+            template.append(part)
+        if part in GREEDY_PLACEHOLDERS and parts:
+            template.append(GREEDY_PLACEHOLDERS[part])
+            break
+        for placeholder in PLACEHOLDERS.get(part, []):
+            if not parts:
+                break
+            parts.pop(0)
+            template.append(placeholder)
+    return '/' + '/'.join(template)
+
+
+def percentile(values, fraction):
+    # nearest-rank, which is plenty for a handful of latencies
+    ordered = sorted(values)
+    return ordered[max(0, ceil(fraction * len(ordered)) - 1)]
+
+
+class ApiCall(object):
+    __slots__ = ['verb', 'endpoint', 'phase', 'repo', 'status', 'latency',
+                 'size', 'cost']
+
+    def __init__(self, verb, endpoint, phase, repo, status, latency, size,
+                 cost):
+        self.verb = verb
+        self.endpoint = endpoint
+        self.phase = phase
+        self.repo = repo
+        self.status = status
+        self.latency = latency
+        self.size = size
+        self.cost = cost
+
+    @property
+    def is_conditional_hit(self):
+        # GitHub doesn't count a 304 against the rate limit
+        return self.status == 304
+
+
+class ApiStats(object):
+    # counts every GitHub API request PyGithub makes, labeled with the
+    # filesync phase and repo (from the current trace span) that made it
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.reset()
+
+    def aggregate(self, calls, key):
+        groups = defaultdict(list)
+        for call in calls:
+            groups[key(call)].append(call)
+        rows = list()
+        for name, group in groups.items():
+            latencies = [call.latency for call in group]
+            rows.append({
+                'name': name,
+                'calls': len(group),
+                'bytes': sum(call.size for call in group),
+                'conditional_hits': sum(call.is_conditional_hit
+                                        for call in group),
+                'rate_limit_cost': sum(call.cost for call in group),
+                'p50': percentile(latencies, 0.5),
+                'p95': percentile(latencies, 0.95),
+                'max': max(latencies),
+            })
+        return sorted(rows, key=lambda row: row['calls'], reverse=True)
+
+    def instrument(self, github, recorder=None):
+        # every request, paginated or not, goes through the requester's
+        # __requestRaw; shadow it on this one instance so nothing else
+        # (including other Github objects) is affected. calls are recorded
+        # with recorder, e.g. api_stats itself so that a session a server
+        # shares between jobs counts each call for the job that made it
+        recorder = recorder or self
+        requester = github._Github__requester
+        if getattr(requester, '_filesync_api_stats', None) is recorder:
+            return
+        request_raw = requester._Requester__requestRaw
+
+        def counted_request_raw(cnx, verb, url, *args, **kwargs):
+            started = perf_counter()
+            status, headers, output = request_raw(cnx, verb, url, *args,
+                                                  **kwargs)
+            recorder.record(verb, url, status, headers, output,
+                            perf_counter() - started)
+            return status, headers, output
+
+        requester._Requester__requestRaw = counted_request_raw
+        requester._filesync_api_stats = recorder
+
+    def log_summary(self, summary):
+        if not summary['calls']:
+            return
+        self.logger.info(f'{summary["calls"]} GitHub API calls, '
+                         f'{summary["rate_limit_cost"]} rate limit points')
+        for endpoint in summary['endpoints'][:5]:
+            self.logger.info(f'{endpoint["calls"]:>10} {endpoint["name"]} '
+                             f'(p95 {endpoint["p95"]:.2f}s)')
+
+    def rate_limit_cost(self, status, headers):
+        # GitHub reports how much of each resource's limit (core, search,
+        # graphql) has been used this window; the cost of a call is how much
+        # that went up. a smaller number means a new window started
+        resource = headers.get('x-ratelimit-resource', 'core')
+        used = headers.get('x-ratelimit-used')
+        remaining = headers.get('x-ratelimit-remaining')
+        if remaining is not None:
+            self.rate_limit_remaining[resource] = int(remaining)
+        if used is None or status == 304:
+            return 0
+        used = int(used)
+        last_used = self.rate_limits.get(resource)
+        self.rate_limits[resource] = used
+        if last_used is None:
+            return 1
+        return used - last_used if used >= last_used else used
+
+    def record(self, verb, url, status, headers, output, latency):
+        span = tracer.current
+        phase = span.name if span is not None else NO_PHASE
+        repo = span.attributes.get('repo') if span is not None else None
+        size = len(output) if isinstance(output, (bytes, str)) else 0
+        with self.lock:
+            cost = self.rate_limit_cost(status, headers)
+            if repo is not None:
+                self.repo_calls[repo] += 1
+            self.calls.append(ApiCall(
+                verb, endpoint_template(url), phase, repo, status, latency,
+                size, cost))
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.calls = list()
+        self.repo_calls = defaultdict(int)
+        self.rate_limits = dict()
+        self.rate_limit_remaining = dict()
+
+    def summary(self):
+        calls = list(self.calls)
+        repos = [call for call in calls if call.repo is not None]
+        return {
+            'calls': len(calls),
+            'bytes': sum(call.size for call in calls),
+            'conditional_hits': sum(call.is_conditional_hit
+                                    for call in calls),
+            'rate_limit_cost': sum(call.cost for call in calls),
+            'endpoints': self.aggregate(
+                calls, lambda call: f'{call.verb} {call.endpoint}'),
+            'phases': self.aggregate(calls, lambda call: call.phase),
+            'phase_endpoints': self.aggregate(
+                calls,
+                lambda call: f'{call.phase}: {call.verb} {call.endpoint}'),
+            'busiest_repos': self.aggregate(
+                repos, lambda call: call.repo)[:SUMMARY_SIZE],
+        }
+
+    def write_report(self, path):
+        with open(path, 'w') as fout:
+            json.dump(self.summary(), fout, indent=2)
+
+
+api_stats = PerJob(ApiStats)
@@ -6,45 +6,123 @@ import click
 import click_config_file
 
 from filesync import __version__
-from filesync.filesync import FileSync
 from filesync.config.click_yaml_provider import click_yaml_provider
 
 
 DEFAULT_CLONE_ROOT = os.path.join(gettempdir(), 'filesync_clones')
 
 
+def duration_option(ctx, param, value):
+    if value is None:
+        return None
+    from filesync.schedule import parse_duration
+
+    try:
+        return parse_duration(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
 @click.group()
 @click.pass_context
 @click.argument('template')
+@click.option('--api-report',
+              type=click.Path(file_okay=True, dir_okay=False, writable=True),
+              help='write how many GitHub API calls each endpoint, phase and '
+                   'repo made to this JSON file')
 @click.option('--autoclean/--no-autoclean', default=True,
               help='remove clones from disk after running')
 @click.option('--clone-root', '-r', default=DEFAULT_CLONE_ROOT,
               help='path to clone repos')
 @click.option('--dry-run', '-d', default=False, is_flag=True,
               help="don't push changes to cloned repos")
+@click.option('--git-trace', default=False, is_flag=True,
+              help="time every git command with git's trace2 events and add "
+                   'the totals to the timings report')
 @click.option('--interactive', '-i', default=False, is_flag=True,
               help='run in interactive mode to be asked onboarding questions')
 @click.option('--log-level', '-l')
 @click.option('--logging-config',
               type=click.Path(exists=True, file_okay=True, dir_okay=False),
               help='path to logging_config.yaml')
+@click.option('--memory-report',
+              type=click.Path(file_okay=True, dir_okay=False, writable=True),
+              help='track memory use per phase and write it to this JSON '
+                   'file')
+@click.option('--metrics-file',
+              type=click.Path(file_okay=True, dir_okay=False, writable=True),
+              help='write run metrics to this Prometheus textfile (e.g. in '
+                   "node_exporter's textfile directory)")
+@click.option('--otlp-endpoint',
+              help='also send the timings to this OTLP/HTTP traces endpoint, '
+                   'e.g. http://localhost:4318/v1/traces')
+@click.option('--profile', type=click.Choice(['run', 'repo']),
+              help='profile the whole run, or each step of each repo')
+@click.option('--profile-dir',
+              help='where to write profiles (default: profiles in '
+                   'state-dir)')
+@click.option('--profiler', type=click.Choice(['cprofile', 'sampling']),
+              default='cprofile', show_default=True,
+              help='cprofile writes .pstats files; sampling writes '
+                   'speedscope files and includes time spent waiting')
+@click.option('--retries', type=int,
+              help='how many times to retry git and GitHub API calls that '
+                   'fail for network reasons (default: 3)')
+@click.option('--retry-backoff', type=float,
+              help='seconds to wait before the first retry; each one after '
+                   'waits twice as long (default: 2)')
+@click.option('--server',
+              type=click.Path(exists=True, file_okay=True, dir_okay=False),
+              help="send the command to the filesync-serve server listening "
+                   'on this socket instead of running it here')
+@click.option('--state-dir',
+              help='path to keep state between runs (default: filesync_state '
+                   'in the system temp dir)')
 @click.option('--template-branch', '-b',
               help='branch of the template to sync from')
 @click.option('--template-config', '-t', default='filesync.yaml',
               help='path inside the template repo where its config is stored')
+@click.option('--timings-report',
+              type=click.Path(file_okay=True, dir_okay=False, writable=True),
+              help='write how long each phase of each repo took to this JSON '
+                   'file')
 @click.option('--token-variable-name', '-e', default='GITHUB_TOKEN',
               help='name of the environment variable storing the GitHub token')
 @click_config_file.configuration_option(provider=click_yaml_provider,
                                         implicit=False)
 @click.version_option(version=__version__)
-def main(ctx, template, autoclean, clone_root, dry_run, template_branch,
-         template_config, token_variable_name, log_level, logging_config,
-         interactive):
+def main(ctx, template, api_report, autoclean, clone_root, dry_run,
+         git_trace, memory_report, metrics_file, otlp_endpoint, profile,
+         profile_dir, profiler, retries, retry_backoff, server, state_dir,
+         template_branch, template_config, timings_report,
+         token_variable_name, log_level, logging_config, interactive):
+
+    if server:
+        from filesync.client import RemoteFileSync
 
-    ctx.obj = FileSync(template=template, autoclean=autoclean,
-                       clone_root=clone_root, dry_run=dry_run,
+        # the server's own settings decide where to clone, where state lives
+        # and which token to use; only the job's template settings travel
+        ctx.obj = RemoteFileSync(server, template=template,
+                                 template_branch=template_branch,
+                                 template_config=template_config,
+                                 dry_run=dry_run, log_level=log_level)
+        return
+
+    # importing FileSync pulls in most of filesync's dependencies, so wait
+    # until click has dealt with --help, --version and bad arguments
+    from filesync.filesync import FileSync
+
+    ctx.obj = FileSync(template=template, api_report=api_report,
+                       autoclean=autoclean, clone_root=clone_root,
+                       dry_run=dry_run, git_trace=git_trace,
+                       memory_report=memory_report, metrics_file=metrics_file,
+                       otlp_endpoint=otlp_endpoint, profile=profile,
+                       profile_dir=profile_dir, profiler=profiler,
+                       retries=retries, retry_backoff=retry_backoff,
+                       state_dir=state_dir,
                        template_branch=template_branch,
                        template_config=template_config,
+                       timings_report=timings_report,
                        token_variable_name=token_variable_name,
                        log_level=log_level, logging_config=logging_config,
                        interactive=interactive)
@@ -56,27 +134,194 @@ def main(ctx, template, autoclean, clone_root, dry_run, template_branch,
               help='update this repo only; bypass repo list / scanning')
 @click.option('--cache', '-c',
               help="don't query the GitHub API; use a cached list of repos")
-def update(ctx, single_repo, cache):
+@click.option('--coalesce', default=False, is_flag=True,
+              help='take turns with other runs of this template and wait for '
+                   'it to settle, so rapid merges become a single run')
+@click.option('--incremental-render', default=False, is_flag=True,
+              help="only render the template files changed since each repo's "
+                   'template version, when that can be worked out')
+@click.option('--incremental-scan', default=False, is_flag=True,
+              help='only autoscan repos pushed to since the last scan')
+@click.option('--journal',
+              type=click.Path(file_okay=True, dir_okay=False, writable=True),
+              help='where to journal what happened to each repo (default: '
+                   'a new file in journals in state-dir)')
+@click.option('--quiet-period', default=120, show_default=True,
+              help='seconds to wait for the template to settle with '
+                   '--coalesce')
+@click.option('--resume',
+              type=click.Path(exists=True, file_okay=True, dir_okay=False),
+              help="carry on a run from its journal, skipping repos it's "
+                   'already done with the same template commit')
+@click.option('--retry-failed',
+              type=click.Path(exists=True, file_okay=True, dir_okay=False),
+              help='only update the repos that failed in this journal')
+@click.option('--time-budget', callback=duration_option,
+              help="stop starting repos once the next one wouldn't finish "
+                   'within this long (e.g. 45m), going by recent runs; the '
+                   'stalest repos go first')
+@click.option('--where', '-w', multiple=True,
+              help='only update repos whose answers match key=value or '
+                   'key!=value, according to the inventory')
+@click.option('--with-template', '-T', 'with_templates', multiple=True,
+              help='also render this template into each repo that has its '
+                   'answers file, in the same branch and PR; repeat for more')
+def update(ctx, single_repo, cache, coalesce, incremental_render,
+           incremental_scan, journal, quiet_period, resume, retry_failed,
+           time_budget, where, with_templates):
     filesync = ctx.obj
-    filesync.update(single_repo, cache)
+    if not coalesce:
+        quiet_period = None
+    if resume and retry_failed:
+        raise click.UsageError(
+            '--resume and --retry-failed can not be used together')
+    filesync.update(single_repo, cache, incremental=incremental_scan,
+                    where=where, quiet_period=quiet_period, journal=journal,
+                    resume=resume, retry_failed=retry_failed,
+                    with_templates=with_templates,
+                    incremental_render=incremental_render,
+                    time_budget=time_budget)
 
 
-@main.command(help='onboard a repo to be updated by a template')
+@main.command(help="index every managed repo's answers file")
 @click.pass_context
-@click.argument('onboarding_repo')
-def onboard(ctx, onboarding_repo):
+@click.option('--cached', default=False, is_flag=True,
+              help="don't query the GitHub API; use the last inventory")
+@click.option('--where', '-w', multiple=True,
+              help='list repos whose answers match key=value or key!=value')
+def inventory(ctx, cached, where):
+    filesync = ctx.obj
+    filesync.inventory(where, refresh=not cached)
+
+
+@main.command(help='compare managed files with what filesync last rendered '
+                   'into them, without cloning')
+@click.pass_context
+@click.argument('repos', nargs=-1)
+def drift(ctx, repos):
+    filesync = ctx.obj
+    filesync.drift(list(repos))
+
+
+@main.command(help='predict how long an update would take and what it would '
+                   'cost, without cloning')
+@click.pass_context
+@click.option('--cache', '-c',
+              help="don't query the GitHub API for repos; use a cached list "
+                   'of repos')
+@click.option('--cached', default=False, is_flag=True,
+              help="use the last inventory for each repo's template version")
+@click.option('--jobs', '-j', default=1, show_default=True,
+              help='how many repos to expect to run at once')
+@click.option('--where', '-w', multiple=True,
+              help='only count repos whose answers match key=value or '
+                   'key!=value, according to the inventory')
+@click.option('--window', default='1h', show_default=True,
+              callback=duration_option,
+              help='how long each run may take, for recommending a shard '
+                   'count')
+def estimate(ctx, cache, cached, jobs, where, window):
     filesync = ctx.obj
+    filesync.estimate(cache, where=where, jobs=jobs, window=window,
+                      cached=cached)
+
+
+@main.command(help='onboard a repo to be updated by a template, or every '
+                   'repo in a manifest with --from')
+@click.pass_context
+@click.argument('onboarding_repo', required=False)
+@click.option('--from', 'manifest',
+              type=click.Path(exists=True, file_okay=True, dir_okay=False),
+              help='yaml listing the repos to onboard, with their answers')
+@click.option('--jobs', '-j', default=4, show_default=True,
+              help='how many repos to onboard at once with --from')
+def onboard(ctx, onboarding_repo, manifest, jobs):
+    filesync = ctx.obj
+    if manifest:
+        if onboarding_repo:
+            raise click.UsageError("--from doesn't take a repo")
+        filesync.onboard_all(manifest, jobs)
+        return
+    if not onboarding_repo:
+        raise click.UsageError('ONBOARDING_REPO is required without --from')
     filesync.onboard(onboarding_repo)
 
 
-@main.command(help='fix an existing template PR')
+@main.command(help='fix an existing template PR, or all of them with --all')
 @click.pass_context
-@click.argument('repo')
-@click.argument('existing_branch')
-def fix(ctx, repo, existing_branch):
+@click.argument('repo', required=False)
+@click.argument('existing_branch', required=False)
+@click.option('--all', 'fix_all', default=False, is_flag=True,
+              help="fix every open PR of the template's, found by its branch "
+                   'prefix')
+@click.option('--jobs', '-j', default=4, show_default=True,
+              help='how many PRs to fix at once with --all')
+def fix(ctx, repo, existing_branch, fix_all, jobs):
     filesync = ctx.obj
+    if fix_all:
+        if repo or existing_branch:
+            raise click.UsageError("--all doesn't take a repo or branch")
+        filesync.fix_all(jobs)
+        return
+    if not repo or not existing_branch:
+        raise click.UsageError('REPO and EXISTING_BRANCH are required '
+                               'without --all')
     filesync.fix(repo, existing_branch)
 
 
+@main.command(help='run updates when GitHub sends push events for the '
+                   'template or for answers files')
+@click.pass_context
+@click.option('--host', default='127.0.0.1', show_default=True,
+              help='address to listen on')
+@click.option('--port', '-p', default=8080, show_default=True,
+              help='port to listen on')
+@click.option('--queue-size', default=100, show_default=True,
+              help='how many jobs may wait to run before events are turned '
+                   'away')
+@click.option('--quiet-period', default=120, show_default=True,
+              help='seconds to wait for the template to settle after a push '
+                   'to it')
+@click.option('--secret-variable-name', default='GITHUB_WEBHOOK_SECRET',
+              show_default=True,
+              help="name of the environment variable storing the webhook's "
+                   'secret')
+def webhook(ctx, host, port, queue_size, quiet_period, secret_variable_name):
+    filesync = ctx.obj
+    filesync.webhook(host, port, queue_size, quiet_period,
+                     secret_variable_name)
+
+
+@click.command(help='keep GitHub sessions and template clones warm and run '
+                    'jobs sent with filesync --server')
+@click.option('--clone-root', '-r', default=DEFAULT_CLONE_ROOT,
+              help='path to clone templates and repos')
+@click.option('--log-level', '-l', default='info', show_default=True)
+@click.option('--max-jobs', default=4, show_default=True,
+              help='how many jobs to run at once; others wait their turn')
+@click.option('--socket', '-s', 'socket_path', required=True,
+              type=click.Path(file_okay=True, dir_okay=False),
+              help='path of the Unix socket to listen on')
+@click.option('--state-dir',
+              help='path to keep state between runs (default: filesync_state '
+                   'in the system temp dir)')
+@click.option('--token-variable-name', '-e', default='GITHUB_TOKEN',
+              help='name of the environment variable storing the GitHub token')
+@click.version_option(version=__version__)
+def serve(clone_root, log_level, max_jobs, socket_path, state_dir,
+          token_variable_name):
+    import logging
+
+    from filesync.server import Server
+
+    logging.basicConfig(
+        level=log_level.upper(),
+        format='%(asctime)s %(levelname)-8s - %(name)s: %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+    Server(socket_path, clone_root, state_dir,
+           token_variable_name=token_variable_name,
+           max_jobs=max_jobs).serve_forever()
+
+
 if __name__ == '__main__':
     main()
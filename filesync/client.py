@@ -0,0 +1,73 @@
+import json
+import os.path
+import socket
+
+import click
+
+
+class RemoteFileSync(object):
+    # stands in for FileSync when the CLI is pointed at a server: the same
+    # commands, but sent to the server to run, with its logs streamed back
+    def __init__(self, socket_path, **options):
+        self.socket_path = socket_path
+        self.options = options
+
+    def drift(self, repos=None):
+        raise click.UsageError('drift has to be run without --server')
+
+    def estimate(self, cache=None, where=None, jobs=1, window=3600,
+                 cached=False):
+        raise click.UsageError('estimate has to be run without --server')
+
+    def fix(self, repo, branch):
+        self.run('fix', repo=repo, branch=branch)
+
+    def fix_all(self, jobs):
+        self.run('fix_all', jobs=jobs)
+
+    def inventory(self, where=None, refresh=True):
+        raise click.UsageError('inventory has to be run without --server')
+
+    def onboard(self, onboarding_repo):
+        self.run('onboard', onboarding_repo=onboarding_repo)
+
+    def onboard_all(self, manifest, jobs):
+        self.run('onboard_all', manifest_path=os.path.abspath(manifest),
+                 jobs=jobs)
+
+    def run(self, command, **args):
+        request = {'command': command, 'options': self.options, 'args': args}
+        returncode = 1
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+            try:
+                conn.connect(self.socket_path)
+            except OSError as error:
+                raise click.ClickException(
+                    f'unable to reach the server at {self.socket_path}: '
+                    f'{error}')
+            conn.sendall((json.dumps(request) + '\n').encode())
+            with conn.makefile('r') as replies:
+                for line in replies:
+                    reply = json.loads(line)
+                    if 'log' in reply:
+                        click.echo(reply['log'], err=True)
+                    if 'exit' in reply:
+                        returncode = reply['exit']
+        if returncode != 0:
+            raise SystemExit(returncode)
+
+    def update(self, single_repo=None, cache=None, incremental=False,
+               where=None, quiet_period=None, journal=None, resume=None,
+               retry_failed=None, with_templates=None,
+               incremental_render=False, time_budget=None):
+        # the server resolves paths from its own working directory
+        cache, journal, resume, retry_failed = [
+            os.path.abspath(path) if path is not None else None
+            for path in [cache, journal, resume, retry_failed]]
+        self.run('update', single_repo=single_repo, cache=cache,
+                 incremental=incremental, where=list(where or []),
+                 quiet_period=quiet_period, journal=journal, resume=resume,
+                 retry_failed=retry_failed,
+                 with_templates=list(with_templates or []),
+                 incremental_render=incremental_render,
+                 time_budget=time_budget)
@@ -6,3 +6,16 @@ branch: {branch}
 commit: {commit}
 
 Ref: REL-91'''
+
+# a repo rendered from several templates at once gets one commit covering
+# all of them, with a template/branch/commit section for each
+group_commit_template = '''ci: {operation} files from {templates}
+
+bringing common files in templates up to date
+{sections}
+
+Ref: REL-91'''
+
+group_section_template = '''template: {template}
+branch: {branch}
+commit: {commit}'''
@@ -1,5 +1,8 @@
 from filesync.config.base_config import BaseConfig
 
+# operations that log at the configured level; the rest default to errors only
+VERBOSE_OPERATIONS = ['updating', 'receiving']
+
 
 class LoggingConfig(BaseConfig):
     SAFE_DEFAULTS = {
@@ -19,6 +22,6 @@ class LoggingConfig(BaseConfig):
             return level
         if dry_run:
             return 'debug'
-        if operation != 'updating':
+        if operation not in VERBOSE_OPERATIONS:
             return 'error'
         return self.config.get('level', self.SAFE_DEFAULTS.get('level'))
@@ -0,0 +1,47 @@
+from pprint import pformat
+
+from filesync.config.base_config import BaseConfig
+from filesync.exceptions import UnrecognizedRepoConfigError
+
+
+class OnboardingManifest(BaseConfig):
+    # the repos to onboard in one go, with answers shared by all of them and
+    # any a repo needs differently:
+    #
+    # answers:
+    #   use_docker: true
+    # repos:
+    #   - service-a
+    #   - service-b:
+    #       answers:
+    #         use_docker: false
+    SAFE_DEFAULTS = {
+        'answers': {},
+        'repos': [],
+    }
+
+    def __init__(self, config_path):
+        super().__init__(config_path)
+
+        self.repos = self.configure_repos()
+
+    def configure_repos(self):
+        # like the template config, each repo is either a string or a dict
+        # with the repo's name as its only key; returns (name, answers) with
+        # the repo's answers merged over the shared ones
+        repos = list()
+        for repo in self.config.get('repos') or []:
+            if type(repo) == str:
+                name, overrides = repo, {}
+            elif type(repo) == dict and len(repo) == 1:
+                name = list(repo.keys())[0]
+                overrides = (repo[name] or {}).get('answers') or {}
+            else:
+                raise UnrecognizedRepoConfigError(
+                    'Something is misconfigured! '
+                    'Each repo should be a name, or have exactly one key.'
+                    f'\n{pformat(repo)}'
+                )
+            repos.append((name, {**(self.config.get('answers') or {}),
+                                 **overrides}))
+        return repos
@@ -12,6 +12,8 @@ class TemplateConfig(BaseConfig):
         'branch_separator': '/',
         'repos': [],
         'hooks': {},
+        'hook_mode': 'process',
+        'reuse_pr': False,
     }
 
     def __init__(self, config_path):
@@ -0,0 +1,104 @@
+import heapq
+from collections import defaultdict
+from math import ceil
+from statistics import mean, median
+
+from filesync.schedule import DEFAULT_DURATION
+
+# GitHub's rate limit for a token, in API calls per hour
+API_CALLS_PER_HOUR = 5000
+
+# GitHub's secondary limit on requests that create content (opening and
+# editing PRs), per hour
+CONTENT_WRITES_PER_HOUR = 500
+
+# what a repo is expected to cost when no run has recorded one, by whether
+# it's updated or found up to date and skipped
+DEFAULT_COSTS = {
+    'update': {'duration': DEFAULT_DURATION, 'api_calls': 12},
+    'skip': {'duration': 10, 'api_calls': 4},
+}
+
+UPDATE_OUTCOMES = ['pushed', 'unchanged', 'rendered', 'failed']
+
+# content writes an update may make: opening (or editing) its PR, and
+# without reuse-pr, closing the last update's PR and deleting its branch
+PR_WRITES = {'reuse': 1, 'replace': 3}
+
+
+def kind_of(outcome):
+    if outcome == 'skipped':
+        return 'skip'
+    if outcome in UPDATE_OUTCOMES:
+        return 'update'
+    return None
+
+
+def wall_time(durations, jobs):
+    # longest first, each onto whichever job frees up first
+    loads = [0.0] * max(1, jobs)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads)
+
+
+class History(object):
+    # what each repo cost in recent runs' journals, kept apart by whether
+    # it was updated or skipped, since a skip costs a fraction of an update
+    def __init__(self, entries):
+        self.by_repo = defaultdict(list)
+        self.by_kind = defaultdict(list)
+        for entry in entries:
+            kind = kind_of(entry.get('outcome'))
+            if kind is None or not entry.get('repo'):
+                continue
+            self.by_repo[(entry['repo'], kind)].append(entry)
+            self.by_kind[kind].append(entry)
+
+    def known(self, repo, kind):
+        return bool(self.by_repo[(repo, kind)])
+
+    def typical(self, repo, kind, field, summary=median):
+        # the repo's own history, then every repo's, then a guess
+        for entries in [self.by_repo[(repo, kind)], self.by_kind[kind]]:
+            values = [entry[field] for entry in entries
+                      if entry.get(field) is not None]
+            if values:
+                return summary(values)
+        return DEFAULT_COSTS[kind].get(field)
+
+
+class Estimate(object):
+    # what an update of these repos should cost, going by recent runs
+    def __init__(self, history, selected, skipped, jobs, reused=()):
+        self.jobs = jobs
+        repos = [(repo, 'update') for repo in selected] + \
+                [(repo, 'skip') for repo in skipped]
+        self.selected = len(selected)
+        self.skipped = len(skipped)
+        self.unknown = sum(not history.known(repo, kind)
+                           for repo, kind in repos)
+        self.wall_time = wall_time(
+            [history.typical(repo, kind, 'duration') for repo, kind in repos],
+            jobs)
+        self.api_calls = round(sum(
+            history.typical(repo, kind, 'api_calls', mean)
+            for repo, kind in repos))
+        # every repo that needs updating may open (or edit) a PR, and
+        # replace the last one unless it reuses it
+        self.pr_writes = sum(
+            PR_WRITES['reuse' if repo in reused else 'replace']
+            for repo in selected)
+        # clones stay on disk until the end of the run
+        usage = [history.typical(repo, kind, 'disk_usage', mean)
+                 for repo, kind in repos]
+        self.disk_usage = sum(size for size in usage if size is not None)
+        self.disk_unknown = sum(size is None for size in usage)
+
+    def shards(self, window):
+        # how many shards it takes for each to fit in the window, within
+        # the rate limits
+        hours = window / 3600
+        return max(1, ceil(self.wall_time / window),
+                   ceil(self.api_calls / (API_CALLS_PER_HOUR * hours)),
+                   ceil(self.pr_writes / (CONTENT_WRITES_PER_HOUR * hours)))
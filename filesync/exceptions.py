@@ -14,21 +14,41 @@ class GitConfigError(FilesyncException):
     pass
 
 
+class GraphQLError(FilesyncException):
+    pass
+
+
 class HookFailure(FilesyncException):
     pass
 
 
+class InventoryMissingError(FilesyncException):
+    pass
+
+
 class MissingRequiredConfigError(FilesyncException):
     pass
 
 
+class RunSupersededError(FilesyncException):
+    pass
+
+
 class TemplateConfigMissingError(FilesyncException):
     pass
 
 
+class TemplateRefError(FilesyncException):
+    pass
+
+
 class UnrecognizableBaseBranchError(FilesyncException):
     pass
 
 
+class UnrecognizedPredicateError(FilesyncException):
+    pass
+
+
 class UnrecognizedRepoConfigError(FilesyncException):
     pass
@@ -1,111 +1,456 @@
+import json
 import logging
 import os.path
+import subprocess
 from calendar import monthrange
-from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from contextvars import copy_context
+from datetime import datetime, timedelta, timezone
+from statistics import median
+from fnmatch import fnmatch
 from os import environ, makedirs
 from shutil import rmtree
 from sys import exit
+from tempfile import gettempdir
+from time import monotonic, sleep
 
-from github import Github, GithubException
 from sh import ErrorReturnCode, git
 
 from filesync import __version__
+from filesync.api_stats import api_stats
 from filesync.exceptions import *
+from filesync import graphql
+from filesync.graphql import search_pull_requests
+from filesync.git_trace import git_trace
+from filesync.estimate import API_CALLS_PER_HOUR, CONTENT_WRITES_PER_HOUR, \
+                              Estimate, History
 from filesync.log_or_print import log_or_print
+from filesync.manifest import Manifest, fetch_states
+from filesync.memory import memory_tracker
+from filesync.metrics import disk_usage, metrics
+from filesync.profiling import Profiler
 from filesync.config.filesync_config import FilesyncConfig
+from filesync.config.onboarding_manifest import OnboardingManifest
 from filesync.config.logging_config import LoggingConfig
+from filesync.hook_worker import HookWorkerPool
+from filesync.incremental import forget_affected
+from filesync.inventory import Inventory
+from filesync.journal import Journal
+from filesync.repo.repo_spec import RepoSpec
 from filesync.repo.repository import Repository
 from filesync.repo.template import Template
+from filesync.retry import retry_policy
+from filesync.run_lock import RunLock
+from filesync.scan_state import ScanState, as_utc
+from filesync.schedule import Schedule, format_duration
+from filesync.tracing import traced, tracer
+
+DEFAULT_STATE_DIR = os.path.join(gettempdir(), 'filesync_state')
+
+# how many repos a bulk fix or onboarding works on at once
+DEFAULT_JOBS = 4
+
+# how many of the latest journals a time-budgeted run projects from
+HISTORY_RUNS = 10
+
+# what a repo ends up as once it has the template head (or already did)
+SYNCED_OUTCOMES = ['pushed', 'unchanged', 'skipped']
+
+# the search API returns at most this many results for a query, however
+# many match
+SEARCH_LIMIT = 1000
+
+# before anything was pushed to GitHub
+SEARCH_EPOCH = datetime(2008, 1, 1, tzinfo=timezone.utc)
 
 
 class FileSync(object):
     def __init__(self, **kwargs):
         self.config = FilesyncConfig(**kwargs)
         self.template = None
+        # templates rendered into each repo after the main one, so a repo
+        # several templates manage gets one clone and one PR for all of them
+        self.companions = list()
         self.token = environ.get(self.config.token_variable_name)
+        self.run_lock = None
+        # whether the run brought every repo to the template head, so later
+        # coalesced runs for the same head have nothing left to do
+        self.synced_all = False
+        self.repos = list()
+        self.journal = None
+        self.template_sha = None
+        self.schedule = None
+        # a long-running server hands every job the same session, org
+        # handles, template snapshots and repo locks; a one-off run makes
+        # its own session and doesn't need the rest
+        self.github = None
+        self.organizations = dict()
+        self.template_cache = None
+        self.repo_locks = None
+        self.profiler = Profiler(
+            self.config.profile, self.config.profiler,
+            self.config.profile_dir or self.state_path('profiles'))
+
+    @property
+    def metric_labels(self):
+        return {'template': self.config.template,
+                'operation': self.config.operation}
+
+    @property
+    def trace_attributes(self):
+        return {'template': self.config.template}
+
+    def branch_prefixes(self):
+        # what the head branch of each of this template's PRs starts with;
+        # repos can have their own branch prefix and separator
+        settings = [self.template.config]
+        settings += [config for config in self.template.config.repos.values()
+                     if config]
+        prefixes = set()
+        for config in settings:
+            prefix = config.get('branch-prefix') or \
+                     config.get('branch_prefix') or \
+                     self.template.config.branch_prefix
+            separator = config.get('branch-separator') or \
+                        config.get('branch_separator') or \
+                        self.template.config.branch_separator
+            prefixes.add((f'{prefix}{separator}{self.template.name}',
+                          separator))
+        return prefixes
 
     def build_repo(self, repo, base_branch=None):
+        return self.repo_from_spec(self.build_repo_spec(repo, base_branch))
+
+    def build_repo_spec(self, repo, base_branch=None):
         name, org, kwargs = self.validate_repo(repo)
-        gh = self.github.get_organization(org).get_repo(name)
         if base_branch is not None:
             kwargs['base_branch'] = base_branch
-        return Repository(name, self.token, gh, self.config.clone_root,
-                          self.template, **kwargs)
+        # only the run's schedule needs this, not the repo itself
+        priority = kwargs.pop('priority', None)
+        spec = RepoSpec(name, org, kwargs, self.config.clone_root,
+                        listed_name=repo)
+        spec.priority = priority or 0
+        return spec
 
-    def build_repos(self, cache=None):
+    @traced('build_repo_specs')
+    def build_repo_specs(self, cache=None, incremental=False, where=None):
         self.logger.debug('initializing repos...')
-        repos = list()
+        specs = list()
         if cache is None:
-            repo_list = self.fetch_repo_list()
+            repo_list = self.fetch_repo_list(incremental)
         else:
             repo_list = self.read_repo_list_from_cache(cache)
 
+        if where:
+            repo_list = self.filter_repo_list(repo_list, where)
+
         if self.template is not None and self.template.config.shard is not None:
             repo_list = self.shard(repo_list)
 
         for repo in repo_list:
-            repos.append(self.build_repo(repo))
+            specs.append(self.build_repo_spec(repo))
         self.logger.debug('repo initialization complete')
-        return repos
+        return specs
 
-    def build_template(self, name):
+    def build_repos(self, specs):
+        # build each repo only when it's about to be worked on; once the
+        # caller moves on to the next one, the last one (and the PyGithub
+        # objects it cached) can be garbage collected
+        for spec in specs:
+            try:
+                repo = self.repo_from_spec(spec)
+            except Exception as error:
+                # e.g. the repo was deleted or moved since it was listed;
+                # that only fails this repo
+                self.logger.error(f'repo {spec.listed_name} failed with '
+                                  f'exception: {error}')
+                spec.outcome = 'failed'
+                spec.error = str(error)
+                spec.error_class = error.__class__.__name__
+                spec.duration = 0.0
+                if self.journal is not None:
+                    self.journal.record(spec, self.template_sha)
+                continue
+            yield spec, repo
+
+    def build_template(self, name, clone_root=None, fatal=True,
+                       companion=False):
         self.logger.debug(f'initializing template {name}...')
         org, name = self.split_org_and_name(name)
-        gh = self.github.get_organization(org).get_repo(name)
+        gh = self.organization(org).get_repo(name)
+        # --template-branch is for the main template; companions sync from
+        # whatever branch their own config says
+        base_branch = None if companion else self.config.template_branch
         try:
             template = Template(
-                name, self.token, gh, self.config.clone_root,
-                base_branch=self.config.template_branch,
+                name, self.token, gh, clone_root or self.config.clone_root,
+                base_branch=base_branch,
                 dry_run=self.config.dry_run,
                 template_config=self.config.template_config,
                 operation=self.config.operation,
                 interactive=self.config.interactive)
         except FilesyncException as error:
+            if not fatal:
+                raise
             self.die(error)
 
         self.logger.debug('template initialization ok')
         return template
 
+    def commits_behind(self, versions):
+        # how many template commits each version is behind the head, by
+        # the GitHub API's compare, so the template clone stays shallow
+        from github import GithubException
+
+        behind = dict()
+        for version in set(versions):
+            try:
+                behind[version] = self.template.github.compare(
+                    version, self.template.head).ahead_by
+            except GithubException as error:
+                self.logger.debug(f'unable to compare {version} with the '
+                                  f'template head: {error}')
+        return behind
+
+    def companions_for(self, repo):
+        # each companion's answers file for a repo, going by the repo's
+        # config in that template
+        companions = list()
+        for template in self.companions:
+            config = template.config.repos.get(repo) or {}
+            answers_file = config.get('answers-file') or \
+                config.get('answers_file') or template.config.answers_file
+            companions.append((template, answers_file))
+        return companions
+
     def create_clone_root(self):
         self.logger.debug(f'setting up clone-root: {self.config.clone_root}')
         makedirs(self.config.clone_root, exist_ok=True)
 
+    def current_versions(self, specs, cached=False):
+        # each repo's _template_version, read through GraphQL instead of
+        # cloning; cached uses the last inventory instead
+        inventory = Inventory(self.inventory_path())
+        if cached:
+            inventory.load()
+        else:
+            old_answers_files = self.template.config.old_answers_files or []
+            inventory.fetch(self.github, [
+                (spec.listed_name, spec.org, spec.name,
+                 [spec.kwargs['answers_file']] + old_answers_files)
+                for spec in specs])
+        return dict(zip(inventory.repos,
+                        inventory.column('_template_version')))
+
+    def defer(self, specs):
+        self.logger.info(f'deferring {len(specs)} repos to keep within the '
+                         f'time budget')
+        for spec in specs:
+            self.logger.debug(f'deferring {spec.listed_name}')
+            spec.outcome = 'deferred'
+            self.journal.record(spec, self.template_sha)
+
     def die(self, error):
         self.logger.critical(error)
+        self.write_metrics()
         self.maybe_clean()
+        forget_affected()
+        self.profiler.finish()
+        self.write_reports()
         exit(1)
 
-    def fetch_repo_list(self):
+    def drift(self, repos=None):
+        self.start('checking')
+        try:
+            results = list()
+            targets = list()
+            for repo in repos or self.fetch_repo_list():
+                manifest = Manifest(self.manifest_path(repo))
+                if not manifest.exists:
+                    results.append((repo, 'no-manifest', []))
+                    continue
+                name, org, _ = self.validate_repo(repo)
+                targets.append((repo, org, name, manifest.load()))
+            results += fetch_states(self.github, targets)
+
+            for repo, status, drifted in sorted(results):
+                log_or_print(self.logger, f'{status:>15} {repo}')
+                for path in drifted:
+                    log_or_print(self.logger, f'{"":>15}   {path}')
+            statuses = Counter(status for _, status, _ in results)
+            log_or_print(self.logger, ', '.join(
+                f'{count} {status}' for status, count in sorted(
+                    statuses.items())) or 'no repos')
+        except FilesyncException as error:
+            self.die(error)
+        except KeyboardInterrupt:
+            self.maybe_clean()
+            raise
+        self.stop()
+
+    @traced('fetch_repo_list')
+    def fetch_repo_list(self, incremental=False):
         repo_list = list(self.template.config.repos.keys())
 
         if not self.template.config.autoscan:
             return repo_list
 
-        gh_org = self.github.get_organization(self.template.config.org)
-        for repo in gh_org.get_repos():
-            if repo.fork:
-                self.logger.debug(f"skipping {repo.name}; it's a fork")
-                continue
-            if repo.archived:
-                self.logger.debug(f"skipping {repo.name}; it's archived")
-                continue
-            if repo.name == self.template.name:
-                self.logger.debug(f"skipping {repo.name}; it's the template!")
-                continue
-            if not self.has_answersfile(repo):
-                self.logger.debug(f"skipping {repo.name}; no answersfile")
-                continue
-            self.logger.debug(f'adding {repo.name} to repo list')
-            repo_list.append(repo.name)
+        scan_state = ScanState(self.state_path('autoscan',
+                                               f'{self.template.name}.json'),
+                               self.scan_fingerprint())
+        if not incremental:
+            scan_state.high_water_mark = None
+        elif scan_state.high_water_mark is None:
+            self.logger.info('no usable autoscan state; doing a full scan')
+
+        gh_org = self.organization(self.template.config.org)
+        if self.template.config.select:
+            # let the search API do the filtering; with a high water mark the
+            # pushed: qualifier already leaves out everything that's stale
+            candidates = self.search_repos(scan_state.high_water_mark)
+        elif scan_state.high_water_mark is None:
+            candidates = gh_org.get_repos()
+        else:
+            self.logger.info('scanning repos pushed since '
+                             f'{scan_state.high_water_mark.isoformat()}')
+            candidates = gh_org.get_repos(sort='pushed', direction='desc')
+
+        high_water_mark = scan_state.high_water_mark
+        found = set()
+        dropped = set()
+        for repo in candidates:
+            if scan_state.is_stale(repo):
+                self.logger.debug(f'stopping scan at {repo.name}; '
+                                  'not pushed since last scan')
+                break
+            metrics.count('repos_scanned')
+            pushed_at = as_utc(repo.pushed_at)
+            if pushed_at is not None and \
+               (high_water_mark is None or pushed_at > high_water_mark):
+                high_water_mark = pushed_at
+            if self.is_scannable(repo):
+                self.logger.debug(f'adding {repo.name} to repo list')
+                found.add(repo.name)
+            else:
+                dropped.add(repo.name)
+
+        if scan_state.high_water_mark is not None:
+            # anything not pushed since the last scan keeps its last result,
+            # unless it's gone in a way that doesn't count as a push
+            carried = set(scan_state.repos) - dropped - found
+            found.update(self.still_listed(carried))
+        if high_water_mark is not None:
+            scan_state.save(high_water_mark, found)
 
         # de-duplicate the list before returning
-        return list(set(repo_list))
+        return list(set(repo_list) | found)
+
+    def filter_repo_list(self, repo_list, where):
+        try:
+            inventory = Inventory(self.inventory_path()).load()
+            matching = set(inventory.where(where))
+        except FilesyncException as error:
+            self.die(error)
+        self.logger.info(f'filtering repos where {" and ".join(where)} '
+                         f'(inventory from {inventory.generated_at})')
+        indexed = set(inventory.repos)
+        filtered = list()
+        for repo in repo_list:
+            if repo in matching:
+                filtered.append(repo)
+            elif repo not in indexed:
+                # we know nothing about it, so it might be affected
+                self.logger.info(f'keeping {repo}; not in the inventory')
+                filtered.append(repo)
+            else:
+                self.logger.debug(f'skipping {repo}; no match in inventory')
+        return filtered
+
+    @traced('find_template_prs')
+    def find_template_prs(self):
+        # every open PR of this template, found with one search per org and
+        # branch prefix instead of looking through every repo
+        orgs = {self.template.config.org}
+        orgs.update(repo.split('/')[0] for repo in self.template.config.repos
+                    if '/' in repo)
+        targets = set()
+        for prefix, separator in sorted(self.branch_prefixes()):
+            for org in sorted(orgs):
+                search = f'is:pr is:open org:{org} head:{prefix}'
+                self.logger.info(f'searching for PRs: {search}')
+                for pr in search_pull_requests(self.github, search):
+                    branch = pr['headRefName']
+                    # head: matches on words, not exact prefixes
+                    if branch != prefix and \
+                       not branch.startswith(f'{prefix}{separator}'):
+                        continue
+                    repo = pr['repository']
+                    if self.is_excluded(repo['name']):
+                        continue
+                    targets.add((self.listed_name(repo['owner']['login'],
+                                                  repo['name']), branch))
+        return sorted(targets)
+
+    def estimate(self, cache=None, where=None, jobs=1, window=3600,
+                 cached=False):
+        self.start('estimating')
+        try:
+            specs = self.build_repo_specs(cache, where=where)
+            versions = self.current_versions(specs, cached)
+            head = self.template.head
+            # what needs_update would say, short of looking for update
+            # branches
+            selected = list()
+            skipped = list()
+            reused = set()
+            for spec in specs:
+                version = versions.get(spec.listed_name)
+                if version and head.startswith(version):
+                    skipped.append(spec.listed_name)
+                else:
+                    selected.append(spec.listed_name)
+                    if spec.kwargs.get('reuse_pr'):
+                        reused.add(spec.listed_name)
+            estimate = Estimate(History(self.journal_entries()), selected,
+                                skipped, jobs, reused)
+
+            log_or_print(self.logger, f'{len(specs)} repos; '
+                                      f'{len(selected)} behind {head}')
+            log_or_print(self.logger,
+                         f'wall time: {format_duration(estimate.wall_time)} '
+                         f'with {jobs} jobs ({estimate.unknown} repos have '
+                         'no history to go by)')
+            log_or_print(self.logger,
+                         f'API calls: {estimate.api_calls} (the limit is '
+                         f'{API_CALLS_PER_HOUR} an hour)')
+            log_or_print(self.logger,
+                         f'PR writes: up to {estimate.pr_writes} (the '
+                         f'secondary limit is {CONTENT_WRITES_PER_HOUR} an '
+                         'hour)')
+            log_or_print(self.logger,
+                         f'disk: {estimate.disk_usage / 2 ** 20:.0f} MiB in '
+                         f'clone-root ({estimate.disk_unknown} repos have '
+                         'no recorded size)')
+            log_or_print(self.logger,
+                         f'shards: {estimate.shards(window)} for each run '
+                         f'to fit in {format_duration(window)}')
+        except FilesyncException as error:
+            self.die(error)
+        except KeyboardInterrupt:
+            self.maybe_clean()
+            raise
+        self.stop()
 
     def fix(self, repo, branch):
         self.start('fixing')
         try:
+            listed_name = repo
             repo = self.build_repo(repo, base_branch=branch)
-            repo.fix()
+            with self.repo_lock(repo.name):
+                repo.fix()
+            self.save_manifest(listed_name, repo)
         except UnrecognizableBaseBranchError as error:
             self.die(error)
         except KeyboardInterrupt:
@@ -113,6 +458,31 @@ class FileSync(object):
             raise
         self.stop()
 
+    def fix_all(self, jobs=DEFAULT_JOBS):
+        self.start('fixing')
+        try:
+            targets = self.find_template_prs()
+            self.logger.info(f'fixing {len(targets)} PRs, {jobs} at a time')
+            specs = self.run_parallel(
+                lambda target: self.process_bulk_repo(
+                    target[0], 'fix', base_branch=target[1]),
+                targets, jobs)
+            self.report_results(specs)
+        except FilesyncException as error:
+            self.die(error)
+        except KeyboardInterrupt:
+            self.maybe_clean()
+            raise
+        self.stop()
+
+    def group_sha(self):
+        # what the journal records a run as having synced; a group is only
+        # the same as an earlier run when all of its templates are
+        if not self.companions:
+            return self.template.checked_out_head
+        return '+'.join(template.checked_out_head for template in
+                        [self.template] + self.companions)
+
     def has_answersfile(self, repo):
         # use the github API to try to get the answersfile
         #
@@ -123,26 +493,160 @@ class FileSync(object):
         #
         # if the API succeeds, it means the answersfile is present, so the
         # template should be synced to the repo
+        from github import GithubException
+
         potential_paths = [self.template.config.answers_file]
         if self.template.config.old_answers_files is not None:
             potential_paths += self.template.config.old_answers_files
 
-        for place in potential_paths:
-            try:
-                repo.get_contents(place)
+        with tracer.span('has_answersfile', repo=repo.name):
+            for place in potential_paths:
+                try:
+                    repo.get_contents(place)
+                    return True
+                except GithubException as err:
+                    if hasattr(err, 'status') and err.status == 404:
+                        next
+                    else:
+                        raise
+        return False
+
+    def has_batch_hook(self, hook_name):
+        return hook_name in (self.template.config.hooks or {})
+
+    def inventory(self, where=None, refresh=True):
+        self.start('inventorying')
+        try:
+            inventory = Inventory(self.inventory_path())
+            if refresh:
+                inventory.fetch(self.github, self.inventory_targets())
+                inventory.save()
+            else:
+                inventory.load()
+
+            log_or_print(self.logger, f'{len(inventory)} repos; '
+                                      f'template versions:')
+            versions = inventory.version_distribution()
+            for version, count in versions.most_common():
+                log_or_print(self.logger, f'{count:>6} {version}')
+            if where:
+                log_or_print(self.logger,
+                             f'repos where {" and ".join(where)}:')
+                for repo in inventory.where(where):
+                    log_or_print(self.logger, repo)
+        except FilesyncException as error:
+            self.die(error)
+        except KeyboardInterrupt:
+            self.maybe_clean()
+            raise
+        self.stop()
+
+    def inventory_path(self):
+        return self.state_path('inventory', f'{self.template.name}.json')
+
+    def inventory_targets(self):
+        targets = list()
+        for repo in self.fetch_repo_list():
+            name, org, kwargs = self.validate_repo(repo)
+            answers_paths = [kwargs['answers_file']]
+            answers_paths += self.template.config.old_answers_files or []
+            targets.append((repo, org, name, answers_paths))
+        return targets
+
+    def is_excluded(self, name):
+        for pattern in self.template.config.exclude or []:
+            if fnmatch(name, pattern):
                 return True
-            except GithubException as err:
-                if hasattr(err, 'status') and err.status == 404:
-                    next
-                else:
-                    raise
         return False
 
+    def still_listed(self, names):
+        # archiving, deleting or transferring a repo doesn't change when it
+        # was pushed, so an incremental scan checks on the repos it carries
+        # over, a batch per GraphQL query
+        org = self.template.config.org
+        listed = set()
+        for batch in graphql.batched(sorted(names)):
+            data = graphql.query(self.github, 'query { ' + ' '.join(
+                f'r{i}: repository(owner: {graphql.literal(org)}, '
+                f'name: {graphql.literal(name)}) '
+                '{ name isArchived owner { login } }'
+                for i, name in enumerate(batch)) + ' }')
+            for i, name in enumerate(batch):
+                result = data.get(f'r{i}')
+                if result is None:
+                    self.logger.info(f'dropping {name}; it no longer exists')
+                elif result['isArchived']:
+                    self.logger.info(f"dropping {name}; it's archived")
+                elif result['name'] != name or \
+                        result['owner']['login'].lower() != org.lower():
+                    self.logger.info(f'dropping {name}; it moved to '
+                                     f'{result["owner"]["login"]}/'
+                                     f'{result["name"]}')
+                else:
+                    listed.add(name)
+        return listed
+
+    def is_scannable(self, repo):
+        if self.is_excluded(repo.name):
+            self.logger.debug(f"skipping {repo.name}; it's excluded")
+            return False
+        if repo.fork:
+            self.logger.debug(f"skipping {repo.name}; it's a fork")
+            return False
+        if repo.archived:
+            self.logger.debug(f"skipping {repo.name}; it's archived")
+            return False
+        if repo.name == self.template.name:
+            self.logger.debug(f"skipping {repo.name}; it's the template!")
+            return False
+        if not self.has_answersfile(repo):
+            self.logger.debug(f"skipping {repo.name}; no answersfile")
+            return False
+        return True
+
+    def journal_entries(self):
+        entries = list()
+        for path in self.recent_journals():
+            entries += Journal(path).entries()
+        return entries
+
+    def journal_path(self):
+        started = f'{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}'
+        return self.state_path('journals',
+                               f'{self.template.name}-{started}.jsonl')
+
+    def listed_name(self, org, name):
+        # the name the template's config knows a repo by, so its repo config
+        # still applies; repos it doesn't list are known by their full name
+        full_name = f'{org}/{name}'
+        if full_name in self.template.config.repos:
+            return full_name
+        if name in self.template.config.repos or \
+           org == self.template.config.org:
+            return name
+        return full_name
+
+    def manifest_path(self, repo):
+        return self.state_path('manifests', self.template.name,
+                               f'{repo.replace("/", "__")}.json')
+
     def maybe_clean(self):
         if self.config.autoclean and os.path.exists(self.config.clone_root):
             self.logger.info(f'cleaning up {self.config.clone_root}')
             rmtree(self.config.clone_root)
 
+    def maybe_coalesce(self):
+        # only one run per template at a time, and only after the template
+        # has been quiet for a while, so a burst of merges becomes one run
+        if self.config.quiet_period is None:
+            return
+        lock_name = self.config.template.replace('/', '__')
+        self.run_lock = RunLock(self.state_path('locks'), lock_name)
+        self.run_lock.acquire()
+        self.logger.info(f'waiting {self.config.quiet_period}s for the '
+                         'template to settle...')
+        sleep(self.config.quiet_period)
+
     def maybe_log_dry_run(self):
         if not self.config.dry_run:
             return
@@ -158,7 +662,9 @@ class FileSync(object):
         self.start(f'onboarding')
         try:
             repo = self.build_repo(onboarding_repo)
-            repo.onboard()
+            with self.repo_lock(repo.name):
+                repo.onboard()
+            self.save_manifest(onboarding_repo, repo)
         except UnrecognizableBaseBranchError as error:
             self.die(error)
         except KeyboardInterrupt:
@@ -166,10 +672,334 @@ class FileSync(object):
             raise
         self.stop()
 
+    def maybe_write_metrics(self):
+        if self.config.metrics_file is not None:
+            metrics.maybe_write(self.config.metrics_file, self.metric_labels,
+                                self.repos, self.config.clone_root)
+
+    def new_run(self):
+        # a fresh FileSync with the same options, for the webhook receiver to
+        # run each job with. jobs clone next to the receiver's template, and
+        # only clean up after themselves
+        options = dict(self.config.config)
+        options['clone_root'] = os.path.join(self.config.clone_root, 'jobs')
+        return FileSync(**options)
+
+    def onboard_all(self, manifest_path, jobs=DEFAULT_JOBS):
+        self.start('onboarding')
+        try:
+            manifest = OnboardingManifest(manifest_path)
+            if self.config.interactive and jobs > 1:
+                # questions for several repos at once would be interleaved
+                self.logger.warning('onboarding one repo at a time, since '
+                                    'interactive mode asks questions')
+                jobs = 1
+            self.logger.info(f'onboarding {len(manifest.repos)} repos, '
+                             f'{jobs} at a time')
+            specs = self.run_parallel(
+                lambda repo: self.process_bulk_repo(
+                    repo[0], 'onboard', answers=repo[1]),
+                manifest.repos, jobs)
+            self.report_results(specs)
+        except FilesyncException as error:
+            self.die(error)
+        except KeyboardInterrupt:
+            self.maybe_clean()
+            raise
+        self.stop()
+
+    def organization(self, name):
+        # every repo in an org would otherwise fetch the org all over again
+        organization = self.organizations.get(name)
+        if organization is None:
+            organization = self.organizations[name] = \
+                self.github.get_organization(name)
+        return organization
+
+    def process_repo(self, repo, step):
+        # run one step of a repo's update; a failure only fails that repo
+        try:
+            with self.repo_lock(repo.name), \
+                 self.profiler.profile_repo(repo.name, step):
+                return step()
+        except RunSupersededError:
+            raise
+        except Exception as ex:
+            # including git and API errors that outlasted their retries, so
+            # they're journaled for --retry-failed like any other failure
+            repo.outcome = 'failed'
+            repo.error = str(ex)
+            repo.error_class = ex.__class__.__name__
+            if isinstance(ex, FilesyncException):
+                self.logger.error(f'repo {repo.name} failed with exception: '
+                                  f'{ex}')
+            else:
+                self.logger.exception(f'repo {repo.name} failed with '
+                                      f'exception: {ex}')
+            return False
+        finally:
+            self.maybe_write_metrics()
+
+    def process_bulk_repo(self, name, step_name, base_branch=None,
+                          answers=None):
+        # one repo of a bulk run. unlike a run through the repo list, any
+        # error only fails this repo, since other threads are mid-flight
+        started = monotonic()
+        spec = None
+        try:
+            spec = self.build_repo_spec(name, base_branch)
+            if answers:
+                spec.kwargs['answers'] = answers
+            repo = self.repo_from_spec(spec)
+            self.process_repo(repo, getattr(repo, step_name))
+            self.record(spec, repo)
+        except Exception as error:
+            self.logger.exception(f'repo {name} failed with exception: '
+                                  f'{error}')
+            if spec is None:
+                spec = RepoSpec(name, None, {}, self.config.clone_root)
+            spec.outcome = 'failed'
+            spec.error = str(error)
+            spec.error_class = error.__class__.__name__
+        spec.duration = monotonic() - started
+        return spec
+
+    @traced('prioritize')
+    def prioritize(self, specs):
+        # the template version each repo is on, and when it was last synced
+        versions = dict()
+        last_synced = dict()
+        for spec in specs:
+            manifest = Manifest(self.manifest_path(spec.listed_name))
+            if manifest.exists:
+                manifest.load()
+                versions[spec.listed_name] = manifest.template_version
+                # manifests from before rendered_at was recorded count as
+                # never synced
+                if manifest.rendered_at:
+                    last_synced[spec.listed_name] = \
+                        datetime.fromisoformat(manifest.rendered_at)
+        if os.path.exists(self.inventory_path()):
+            # the inventory has what's been merged, not just rendered
+            inventory = Inventory(self.inventory_path()).load()
+            for repo, version in zip(inventory.repos,
+                                     inventory.column('_template_version')):
+                if version is not None:
+                    versions[repo] = version
+        by_version = self.commits_behind(
+            version for version in versions.values() if version)
+        behind = {repo: by_version.get(version)
+                  for repo, version in versions.items()}
+        specs = self.schedule.order(specs, behind, last_synced)
+        self.logger.info('time budget of '
+                         f'{self.schedule.budget / 60:.0f}m; repos in order: '
+                         f'{", ".join(spec.listed_name for spec in specs)}')
+        return specs
+
+    def projected_durations(self):
+        # each repo's median duration over the template's latest runs
+        durations = dict()
+        for path in self.recent_journals():
+            for repo, times in Journal(path).durations().items():
+                durations.setdefault(repo, []).extend(times)
+        return {repo: median(times) for repo, times in durations.items()}
+
     def read_repo_list_from_cache(self, cache):
         with open(cache) as fin:
             return [i.strip('\n') for i in fin.readlines()]
 
+    def recent_journals(self):
+        # the template's latest journals, oldest first
+        directory = self.state_path('journals')
+        if not os.path.isdir(directory):
+            return []
+        prefix = f'{self.template.name}-'
+        return sorted((os.path.join(directory, name)
+                       for name in os.listdir(directory)
+                       if name.startswith(prefix)),
+                      key=os.path.getmtime)[-HISTORY_RUNS:]
+
+    def record(self, spec, repo, finished=True):
+        # keep what happened to the repo, and journal it once nothing more
+        # is going to happen to it in this run
+        spec.record(repo)
+        self.save_manifest(spec.listed_name, repo)
+        if finished and self.journal is not None:
+            # what it cost, for estimating later runs; the clone is only
+            # removed at the end of the run
+            spec.api_calls = api_stats.repo_calls.get(repo.name, 0)
+            if os.path.isdir(spec.clone_path):
+                spec.disk_usage = disk_usage(spec.clone_path)
+            self.journal.record(spec, self.template_sha)
+
+    def refresh_template(self):
+        # read the template's config again after it's changed
+        rmtree(self.template.clone_path, ignore_errors=True)
+        try:
+            self.template = self.build_template(self.config.template,
+                                                fatal=False)
+        except FilesyncException as error:
+            self.logger.error(f'keeping the old template config: {error}')
+
+    def report_results(self, specs):
+        for spec in sorted(specs, key=lambda spec: spec.listed_name):
+            detail = spec.pr_url or spec.error or ''
+            log_or_print(self.logger,
+                         f'{spec.outcome or "pending":>10} '
+                         f'{spec.duration:>8.1f}s {spec.listed_name} '
+                         f'{detail}'.rstrip())
+        outcomes = Counter(spec.outcome or 'pending' for spec in specs)
+        log_or_print(self.logger, ', '.join(
+            f'{count} {outcome}' for outcome, count in sorted(
+                outcomes.items())) or 'nothing to do')
+
+    def repo_from_spec(self, spec):
+        gh = self.organization(spec.org).get_repo(spec.name)
+        kwargs = dict(spec.kwargs)
+        if self.companions:
+            kwargs['companions'] = self.companions_for(spec.listed_name)
+        return Repository(spec.name, self.token, gh, self.config.clone_root,
+                          self.template, **kwargs)
+
+    def repo_lock(self, name):
+        # jobs running side by side in a server mustn't push to the same
+        # repo at the same time
+        if self.repo_locks is None:
+            return nullcontext()
+        return self.repo_locks[name]
+
+    def run_batch_hook(self, hook_name, repos, fatal=True):
+        # batch hooks run once per run, with a manifest of every repo instead
+        # of a single repo's details
+        if not self.has_batch_hook(hook_name):
+            return
+        hook = self.template.config.hooks[hook_name]
+        manifest_path = os.path.join(self.config.clone_root,
+                                     f'.filesync-{hook_name}.json')
+        manifest = [{
+            'repo': repo.name,
+            'clone_path': repo.clone_path,
+            'operation': repo.operation or self.config.operation,
+            'outcome': repo.outcome,
+            'error': repo.error,
+        } for repo in repos]
+        with open(manifest_path, 'w') as fout:
+            json.dump(manifest, fout, indent=2)
+
+        args = [os.path.join(self.template.clone_path, hook),
+                self.config.operation, self.config.clone_root, manifest_path]
+        self.logger.info(
+            f'running {hook_name} hook: {hook} {" ".join(args[1:])}')
+        res = subprocess.run(args, capture_output=True)
+        if res.returncode != 0:
+            error = HookFailure(
+                f'{hook_name} hook {hook} failed with exit code '
+                f'{res.returncode} stderr: "'
+                f'{res.stderr.decode("UTF-8").strip()}"')
+            if fatal:
+                self.die(error)
+            self.logger.error(error)
+
+    def run_parallel(self, work, items, jobs):
+        # work(item) returns the item's RepoSpec
+        self.repos = list()
+        executor = ThreadPoolExecutor(max_workers=jobs,
+                                      thread_name_prefix='filesync')
+        try:
+            # in a server, the workers log and count for the job that
+            # started them
+            futures = [executor.submit(copy_context().run, work, item)
+                       for item in items]
+            for future in as_completed(futures):
+                self.repos.append(future.result())
+        except KeyboardInterrupt:
+            # let the repos already being worked on finish, but don't start
+            # any more
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown()
+        return self.repos
+
+    def save_manifest(self, repo_name, repo):
+        # only once what was rendered is what the repo's branch has
+        if repo.manifest is None or \
+           repo.outcome not in ['pushed', 'unchanged']:
+            return
+        manifest = repo.manifest
+        manifest.path = self.manifest_path(repo_name)
+        if manifest.kept and manifest.exists:
+            manifest.merge(Manifest(manifest.path).load())
+        manifest.save()
+
+    def scan_fingerprint(self):
+        # autoscan results are only reusable while these settings stay put
+        return {
+            'org': self.template.config.org,
+            'answers_file': self.template.config.answers_file,
+            'old_answers_files': self.template.config.old_answers_files,
+            'select': self.template.config.select,
+            'exclude': self.template.config.exclude,
+        }
+
+    def scheduled(self, specs):
+        # with a time budget, stop handing out repos once the next one is
+        # projected to run past it; the rest are left for a later run
+        for i, spec in enumerate(specs):
+            if self.schedule is not None and \
+               not self.schedule.fits(spec.listed_name):
+                self.defer(specs[i:])
+                return
+            yield spec
+
+    def search_repos(self, pushed_since=None, pushed_until=None):
+        # a query matching more repos than the search API returns is split
+        # in two by when the repos were last pushed, until each part fits
+        query = self.search_query(pushed_since, pushed_until)
+        self.logger.info(f'searching for repos: {query}')
+        results = self.github.search_repositories(query)
+        if results.totalCount <= SEARCH_LIMIT:
+            yield from results
+            return
+        start = as_utc(pushed_since) or SEARCH_EPOCH
+        end = as_utc(pushed_until) or \
+            datetime.now(timezone.utc).replace(microsecond=0)
+        if end - start < timedelta(seconds=2):
+            self.logger.warning(
+                f'{results.totalCount} repos match {query}, but only '
+                f'{SEARCH_LIMIT} can be found; add to the select config to '
+                'narrow it down')
+            yield from results
+            return
+        self.logger.info(f'{results.totalCount} repos match; splitting the '
+                         'search by when they were pushed')
+        middle = (start + (end - start) / 2).replace(microsecond=0)
+        yield from self.search_repos(start, middle)
+        yield from self.search_repos(middle + timedelta(seconds=1), end)
+
+    def search_query(self, pushed_since=None, pushed_until=None):
+        # translate the template's select config into GitHub search
+        # qualifiers, so only matching repos ever come back from the API
+        select = self.template.config.select or {}
+        qualifiers = [f'org:{self.template.config.org}',
+                      'archived:false', 'fork:false']
+        topics = select.get('topics') or []
+        if type(topics) == str:
+            topics = [topics]
+        for topic in topics:
+            qualifiers.append(f'topic:{topic}')
+        if select.get('language') is not None:
+            qualifiers.append(f'language:{select["language"]}')
+        if pushed_until is not None:
+            qualifiers.append(
+                f'pushed:{as_utc(pushed_since):%Y-%m-%dT%H:%M:%SZ}..'
+                f'{as_utc(pushed_until):%Y-%m-%dT%H:%M:%SZ}')
+        elif pushed_since is not None:
+            qualifiers.append(
+                f'pushed:>={as_utc(pushed_since):%Y-%m-%dT%H:%M:%SZ}')
+        if select.get('query') is not None:
+            qualifiers.append(select['query'])
+        return ' '.join(qualifiers)
+
     def setup_logging(self, command):
         logging_config = LoggingConfig(
             self.config.logging_config, self.config.dry_run,
@@ -218,6 +1048,57 @@ class FileSync(object):
 
         return return_list
 
+    def state_path(self, *parts):
+        return os.path.join(self.config.state_dir or DEFAULT_STATE_DIR, *parts)
+
+    def skip_completed(self, specs):
+        completed = self.journal.completed(self.template_sha)
+        remaining = [spec for spec in specs
+                     if spec.listed_name not in completed]
+        self.logger.info(f'resuming; {len(specs) - len(remaining)} repos '
+                         f'were already done with {self.template_sha}')
+        return remaining
+
+    @traced('skip_in_sync')
+    def skip_in_sync(self, specs):
+        # repos whose manifest says they have the template head, the same
+        # answers and untouched managed files don't need cloning to find
+        # out they're up to date. a group's heads and a repo's own template
+        # ref aren't in the manifest, so those repos are cloned as usual
+        if self.companions:
+            return specs
+        targets = list()
+        for spec in specs:
+            if spec.kwargs.get('template_ref') is not None:
+                continue
+            manifest = Manifest(self.manifest_path(spec.listed_name))
+            if not manifest.exists:
+                continue
+            manifest.load()
+            if manifest.template_version and \
+               self.template.head.startswith(manifest.template_version):
+                targets.append((spec, spec.org, spec.name, manifest))
+        if not targets:
+            return specs
+
+        in_sync = list()
+        try:
+            for spec, status, _ in fetch_states(self.github, targets):
+                if status == 'clean':
+                    in_sync.append(spec)
+        except GraphQLError as error:
+            self.logger.warning(f'cloning every repo; unable to check '
+                                f'manifests: {error}')
+            return specs
+        for spec in in_sync:
+            self.logger.debug(f'SKIP: {spec.listed_name} matches its '
+                              'manifest')
+            spec.outcome = 'skipped'
+            self.journal.record(spec, self.template_sha)
+        self.logger.info(f'{len(in_sync)} repos already match their '
+                         'manifests')
+        return [spec for spec in specs if spec not in in_sync]
+
     def split_org_and_name(self, name):
         parts = name.split('/')
         if len(parts) >= 2:
@@ -232,7 +1113,11 @@ class FileSync(object):
             name = parts[0]
         return (org, name)
 
+    @traced('start')
     def start(self, command):
+        self.profiler.start_run()
+        if self.config.memory_report is not None:
+            memory_tracker.start()
         self.config.set('operation', command)
         self.logger = self.setup_logging(command)
         self.logger.info(f'Version: {__version__}')
@@ -246,27 +1131,135 @@ class FileSync(object):
             self.die(error)
 
         self.create_clone_root()
-        self.github = Github(self.token)
-        self.template = self.build_template(self.config.template)
+        retry_policy.configure(self.config.retries, self.config.retry_backoff)
+        if self.config.git_trace:
+            run_id = f'{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}'
+            git_trace.enable(self.state_path('git-trace', run_id))
+        if self.github is None:
+            # PyGithub is slow to import; commands that never get this far
+            # (--help, --version, bad arguments) shouldn't pay for it
+            from github import Github
+
+            self.github = Github(self.token,
+                                 retry=retry_policy.github_retry())
+        api_stats.instrument(self.github, api_stats)
+        self.maybe_coalesce()
+        if self.template_cache is not None:
+            self.template = self.template_cache.get(self, self.config.template)
+        else:
+            self.template = self.build_template(self.config.template)
+        if self.run_lock is not None:
+            self.template.pin_head()
+        if self.template.config.hook_mode == 'worker':
+            self.template.hook_workers = HookWorkerPool()
 
     def stop(self):
+        if self.template is not None and \
+           self.template.hook_workers is not None:
+            self.template.hook_workers.close()
+        # before cleaning up, so clone-root disk usage is still there to see
+        self.write_metrics()
         self.maybe_clean()
+        forget_affected()
+        if self.run_lock is not None:
+            if self.synced_all and self.template.superseded_by is None:
+                self.run_lock.mark_done(self.template.head)
+            self.run_lock.release()
+        self.profiler.finish()
+        self.write_reports()
         self.logger.info('finished!')
 
-    def update(self, single_repo=None, cache=None):
+    def update(self, single_repo=None, cache=None, incremental=False,
+               where=None, quiet_period=None, journal=None, resume=None,
+               retry_failed=None, with_templates=None,
+               incremental_render=False, time_budget=None,
+               answers_changed=False):
+        started = monotonic()
+        self.config.set('quiet_period', quiet_period)
+        self.config.set('journal', journal)
+        self.config.set('incremental_render', incremental_render)
+        self.config.set('answers_changed', answers_changed)
         self.start('updating')
         try:
-            if single_repo is not None:
-                update_repos = [self.build_repo(single_repo)]
+            # the template clones and org lookups are shared by the group
+            self.companions = [self.build_template(name, companion=True)
+                               for name in with_templates or []]
+            if self.companions:
+                self.logger.info('rendering ' + ', '.join(
+                    [self.template.name] +
+                    [template.name for template in self.companions]) +
+                    ' together')
+
+            if self.run_lock is not None and \
+               self.run_lock.last_done == self.template.head:
+                self.logger.info(f'template head {self.template.head} was '
+                                 'already synced by an earlier run')
+                self.stop()
+                return
+
+            # resuming or retrying carries on the same journal
+            journal_path = resume or retry_failed or self.config.journal or \
+                self.journal_path()
+            self.journal = Journal(journal_path)
+            self.template_sha = self.group_sha()
+            self.logger.info(f'journaling to {journal_path}')
+
+            if retry_failed is not None:
+                failed = self.journal.failed()
+                self.logger.info(f'retrying {len(failed)} failed repos')
+                specs = [self.build_repo_spec(repo) for repo in failed]
+            elif single_repo is not None:
+                specs = [self.build_repo_spec(single_repo)]
             else:
-                update_repos = self.build_repos(cache)
+                specs = self.build_repo_specs(cache, incremental, where)
+            if resume is not None:
+                specs = self.skip_completed(specs)
+            self.repos = specs
+            specs = self.skip_in_sync(specs)
+            if time_budget is not None:
+                # the budget includes getting this far
+                self.schedule = Schedule(time_budget,
+                                         self.projected_durations(), started)
+                specs = self.prioritize(specs)
 
-            for repo in update_repos:
-                try:
-                    repo.update()
-                except FilesyncException as ex:
-                    self.logger.error(
-                        f'repo {repo.name} failed with exception: {ex}')
+            self.run_batch_hook('pre-run', specs)
+            try:
+                if self.has_batch_hook('post-render-batch'):
+                    # render everything first, so the hook can work on all
+                    # of the rendered clones at once before anything is pushed
+                    rendered = list()
+                    for spec, repo in self.build_repos(self.scheduled(specs)):
+                        repo_started = monotonic()
+                        if self.process_repo(repo, repo.render):
+                            rendered.append((spec, repo))
+                            spec.duration = monotonic() - repo_started
+                            self.record(spec, repo, finished=False)
+                        else:
+                            spec.duration = monotonic() - repo_started
+                            self.record(spec, repo)
+                    self.run_batch_hook('post-render-batch', specs)
+                    for spec, repo in rendered:
+                        repo_started = monotonic()
+                        self.process_repo(repo, repo.publish)
+                        spec.duration += monotonic() - repo_started
+                        self.record(spec, repo)
+                else:
+                    for spec, repo in self.build_repos(self.scheduled(specs)):
+                        repo_started = monotonic()
+                        self.process_repo(repo, repo.update)
+                        spec.duration = monotonic() - repo_started
+                        self.record(spec, repo)
+            except RunSupersededError as ex:
+                self.logger.info(f'cancelling run: {ex}')
+            # a dry run, or a run over only some of the repos, leaves the
+            # rest for another run to sync. the CLI and the server pass an
+            # empty where for no filter
+            self.synced_all = \
+                not self.config.dry_run and single_repo is None and \
+                not where and retry_failed is None and \
+                self.template.config.shard is None and \
+                all(spec.outcome in SYNCED_OUTCOMES for spec in self.repos)
+            self.run_batch_hook('post-run', specs, fatal=False)
             self.stop()
         except KeyboardInterrupt:
             self.maybe_clean()
@@ -326,7 +1319,7 @@ class FileSync(object):
 
         # use the defaults for any repo config not provided
         for key in ['answers_file', 'branch_prefix', 'branch_separator',
-                    'dry_run', 'hooks']:
+                    'dry_run', 'hooks', 'reuse_pr']:
             kwargs.setdefault(key, self.template.config.get(key))
 
         # force dry-run if it's enabled globally
@@ -337,8 +1330,60 @@ class FileSync(object):
         if self.config.interactive:
             kwargs['interactive'] = True
 
+        if self.config.incremental_render:
+            kwargs['incremental_render'] = True
+
+        if self.config.answers_changed:
+            kwargs['answers_changed'] = True
+
         # this doesn't actually get passed to the Repository object,
         # so pull it out of kwargs
         org = kwargs.pop('org')
 
         return (name, org, kwargs)
+
+    def webhook(self, host, port, queue_size, quiet_period,
+                secret_variable_name):
+        from filesync.webhook import WebhookReceiver
+
+        self.start('receiving')
+        secret = environ.get(secret_variable_name)
+        if not secret:
+            self.die(MissingRequiredConfigError(
+                'No webhook secret found! Is secret-variable-name '
+                f'{secret_variable_name} correct?'))
+        receiver = WebhookReceiver(self, secret, host, port,
+                                   queue_size=queue_size,
+                                   quiet_period=quiet_period)
+        try:
+            receiver.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def write_metrics(self):
+        if self.config.metrics_file is not None:
+            self.logger.info(f'writing metrics to {self.config.metrics_file}')
+            metrics.write(self.config.metrics_file, self.metric_labels,
+                          self.repos, self.config.clone_root)
+
+    def write_reports(self):
+        api_stats.log_summary(api_stats.summary())
+        sections = dict()
+        if git_trace.enabled:
+            sections['git'] = git_trace.summary()
+            git_trace.log_summary(sections['git'])
+        if self.config.api_report is not None:
+            self.logger.info(
+                f'writing API call report to {self.config.api_report}')
+            api_stats.write_report(self.config.api_report)
+        if self.config.timings_report is not None:
+            self.logger.info(
+                f'writing timings report to {self.config.timings_report}')
+            tracer.write_report(self.config.timings_report, sections)
+        if self.config.memory_report is not None:
+            self.logger.info(
+                f'writing memory report to {self.config.memory_report}')
+            memory_tracker.write_report(self.config.memory_report)
+        if self.config.otlp_endpoint is not None:
+            tracer.send_otlp(self.config.otlp_endpoint)
@@ -0,0 +1,152 @@
+import json
+import logging
+import os
+import os.path
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import count
+from os import environ, makedirs
+
+from filesync.job_context import PerJob
+from filesync.metrics import disk_usage
+from filesync.tracing import tracer
+
+# how many of the most expensive repos and commands to list in the summary
+SUMMARY_SIZE = 10
+
+# commands that download a pack into the clone
+FETCHING_COMMANDS = ['clone', 'fetch', 'pull']
+
+
+def parse_events(path):
+    # read one command's trace2 event stream (git and every git it started
+    # append to the same file) into a handful of numbers
+    stats = {
+        'duration': None,
+        'exit_code': None,
+        'processes': list(),
+        'children': 0,
+        'negotiation_rounds': 0,
+        'objects_packed': 0,
+    }
+    try:
+        with open(path) as fin:
+            lines = fin.readlines()
+    except OSError:
+        return stats
+    root_sid = None
+    for line in lines:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # a process killed mid-write can leave half a line
+            continue
+        sid = event.get('sid', '')
+        if root_sid is None or len(sid) < len(root_sid):
+            # children's sids are their parent's sid plus "/<their own>"
+            root_sid = sid
+        kind = event.get('event')
+        if kind == 'cmd_name':
+            stats['processes'].append(event.get('name'))
+        elif kind == 'child_start':
+            stats['children'] += 1
+        elif kind == 'atexit' and sid == root_sid:
+            stats['duration'] = event.get('t_abs')
+            stats['exit_code'] = event.get('code')
+        elif kind == 'data':
+            key = event.get('key')
+            if key == 'total_rounds':
+                stats['negotiation_rounds'] += int(event.get('value', 0))
+            elif key == 'write_pack_file/wrote':
+                stats['objects_packed'] += int(event.get('value', 0))
+    return stats
+
+
+class GitTrace(object):
+    # points GIT_TRACE2_EVENT at a fresh file for every git command, then
+    # reads it back and labels the result with the current repo and phase
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.directory = None
+        self.reset()
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def aggregate(self, key):
+        groups = defaultdict(list)
+        for command in self.commands:
+            groups[key(command)].append(command)
+        rows = list()
+        for name, group in groups.items():
+            rows.append({
+                'name': name,
+                'commands': len(group),
+                'duration': sum(c['duration'] or 0 for c in group),
+                'children': sum(c['children'] for c in group),
+                'bytes_received': sum(c['bytes_received'] for c in group),
+                'negotiation_rounds': sum(c['negotiation_rounds']
+                                          for c in group),
+                'objects_packed': sum(c['objects_packed'] for c in group),
+            })
+        return sorted(rows, key=lambda row: row['duration'], reverse=True)
+
+    @contextmanager
+    def command(self, cmd, clone_path):
+        # yields the environment to run git with
+        path = os.path.join(self.directory, f'{next(self.ids)}.json')
+        pack_dir = os.path.join(clone_path, '.git', 'objects', 'pack')
+        fetching = cmd in FETCHING_COMMANDS
+        packed_before = disk_usage(pack_dir) if fetching else 0
+        span = tracer.current
+        try:
+            yield {**environ, 'GIT_TRACE2_EVENT': path}
+        finally:
+            stats = parse_events(path)
+            stats['command'] = cmd
+            stats['phase'] = span.name if span is not None else None
+            stats['repo'] = span.attributes.get('repo') if span else None
+            stats['bytes_received'] = max(
+                0, disk_usage(pack_dir) - packed_before) if fetching else 0
+            with self.lock:
+                self.commands.append(stats)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def enable(self, directory):
+        makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    def log_summary(self, summary):
+        if not summary['commands']:
+            return
+        self.logger.info(f'{summary["commands"]} git commands took '
+                         f'{summary["duration"]:.2f}s')
+        for command in summary['by_command'][:5]:
+            self.logger.info(f'{command["duration"]:>10.2f}s git '
+                             f'{command["name"]} ({command["commands"]} '
+                             'calls)')
+
+    def reset(self):
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.commands = list()
+
+    def summary(self):
+        return {
+            'commands': len(self.commands),
+            'duration': sum(c['duration'] or 0 for c in self.commands),
+            'by_command': self.aggregate(lambda c: c['command']),
+            'by_phase': self.aggregate(lambda c: c['phase']),
+            'by_repo': self.aggregate(lambda c: c['repo'])[:SUMMARY_SIZE],
+            'slowest': sorted(self.commands,
+                              key=lambda c: c['duration'] or 0,
+                              reverse=True)[:SUMMARY_SIZE],
+        }
+
+
+git_trace = PerJob(GitTrace)
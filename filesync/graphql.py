@@ -0,0 +1,77 @@
+import json
+import logging
+
+from filesync.exceptions import GraphQLError
+
+# how many repos to ask about in a single query; GitHub caps the number of
+# nodes a query may touch, and big batches make a single failure expensive
+BATCH_SIZE = 50
+
+logger = logging.getLogger('GraphQL')
+
+
+def batched(items, size=BATCH_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def literal(value):
+    # GraphQL string literals use the same escaping rules as JSON strings
+    return json.dumps(value)
+
+
+def query(github, text, variables=None):
+    # PyGithub doesn't expose a public way to run arbitrary queries, but its
+    # requester already handles auth, retries and the base URL for us
+    requester = github._Github__requester
+    payload = {'query': text}
+    if variables is not None:
+        payload['variables'] = variables
+    _, data = requester.requestJsonAndCheck('POST', '/graphql', input=payload)
+    errors = data.get('errors') or []
+    if data.get('data') is None:
+        raise GraphQLError(
+            'GraphQL query failed: '
+            f'{"; ".join(e.get("message", "") for e in errors)}')
+    for error in errors:
+        # partial failures (e.g. a repo that no longer exists) still return
+        # data for everything else
+        logger.debug(f'GraphQL error: {error.get("message")}')
+    return data['data']
+
+
+SEARCH_PULL_REQUESTS = '''
+query($search: String!, $cursor: String) {
+  search(query: $search, type: ISSUE, first: 100, after: $cursor) {
+    issueCount
+    pageInfo { hasNextPage endCursor }
+    nodes {
+      ... on PullRequest {
+        number
+        url
+        headRefName
+        repository { name owner { login } }
+      }
+    }
+  }
+}
+'''
+
+# the search API never returns more results than this for one query
+SEARCH_LIMIT = 1000
+
+
+def search_pull_requests(github, search):
+    pull_requests = list()
+    cursor = None
+    while True:
+        data = query(github, SEARCH_PULL_REQUESTS,
+                     {'search': search, 'cursor': cursor})['search']
+        if cursor is None and data['issueCount'] > SEARCH_LIMIT:
+            logger.warning(f'{data["issueCount"]} PRs match "{search}"; '
+                           f'only the first {SEARCH_LIMIT} can be listed')
+        # other kinds of result come back as empty nodes
+        pull_requests += [node for node in data['nodes'] if node]
+        if not data['pageInfo']['hasNextPage']:
+            return pull_requests
+        cursor = data['pageInfo']['endCursor']
@@ -0,0 +1,140 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from threading import Lock
+
+from filesync.exceptions import HookFailure
+
+WORKER_FLAG = '--worker'
+
+
+class HookWorker(object):
+    # a hook script started once with --worker, then sent one JSON line per
+    # hook call on stdin; it answers each with one JSON line on stdout
+    def __init__(self, path):
+        self.logger = logging.getLogger(f'{self.__class__.__name__}({path})')
+        self.path = path
+        self.lock = Lock()
+        self.process = None
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.logger.warning('worker did not exit; killing it')
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    def request(self, hook_name, operation, clone_root, repo, answers_file):
+        message = {
+            'hook': hook_name,
+            'operation': operation,
+            'clone_root': clone_root,
+            'repo': repo,
+            'answers_file': answers_file,
+        }
+        with self.lock:
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            try:
+                self.process.stdin.write(json.dumps(message) + '\n')
+                self.process.stdin.flush()
+                reply = self.process.stdout.readline()
+            except BrokenPipeError:
+                reply = ''
+            if not reply:
+                returncode = self.process.wait()
+                self.process = None
+                raise HookFailure(f'{hook_name} hook worker {self.path} '
+                                  f'exited with code {returncode}')
+            try:
+                parsed = json.loads(reply)
+            except json.JSONDecodeError:
+                parsed = None
+            if type(parsed) != dict:
+                # something else is writing to the worker's stdout, so the
+                # replies after this one can't be trusted either
+                self.process.kill()
+                self.process.wait()
+                self.process = None
+                raise HookFailure(f'{hook_name} hook worker {self.path} sent '
+                                  f'something that isn\'t a reply: '
+                                  f'{reply.strip()!r}')
+        return parsed.get('returncode', 1), parsed.get('stderr', '')
+
+    def start(self):
+        self.logger.debug('starting hook worker')
+        # stderr is left alone so a crashing worker's traceback ends up in
+        # the same place as filesync's own logs
+        self.process = subprocess.Popen(
+            [self.path, WORKER_FLAG], stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, text=True, bufsize=1)
+
+
+class HookWorkerPool(object):
+    # one worker per hook script, shared by every repo in the run
+    def __init__(self):
+        self.lock = Lock()
+        self.workers = dict()
+
+    def close(self):
+        with self.lock:
+            for worker in self.workers.values():
+                worker.close()
+            self.workers = dict()
+
+    def run(self, path, hook_name, operation, clone_root, repo,
+            answers_file):
+        with self.lock:
+            worker = self.workers.get(path)
+            if worker is None:
+                worker = self.workers[path] = HookWorker(path)
+        return worker.request(hook_name, operation, clone_root, repo,
+                              answers_file)
+
+
+def serve(handler, stdin=sys.stdin, stdout=None):
+    # the other end of the protocol, for hooks written in Python:
+    #
+    #   if sys.argv[1:] == ['--worker']:
+    #       serve(main)
+    #   else:
+    #       sys.exit(main(*sys.argv[1:]))
+    #
+    # handler is called as handler(operation, clone_root, repo, answers_file,
+    # hook=hook_name) and returns an exit code (None means 0). whatever it
+    # prints is sent back as its stderr (stdout belongs to the protocol), and
+    # anything it raises is a failure with the traceback added to stderr
+    if stdout is None:
+        # replies go out on a private copy of stdout, and stdout itself goes
+        # to stderr, so processes the handler starts (a linter, a formatter)
+        # can't write into the protocol
+        sys.stdout.flush()
+        stdout = os.fdopen(os.dup(1), 'w')
+        os.dup2(2, 1)
+    for line in stdin:
+        if not line.strip():
+            continue
+        message = json.loads(line)
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            try:
+                returncode = handler(
+                    message['operation'], message['clone_root'],
+                    message['repo'], message['answers_file'],
+                    hook=message['hook'])
+            except Exception:
+                traceback.print_exc()
+                returncode = 1
+        reply = {'returncode': returncode or 0, 'stderr': output.getvalue()}
+        stdout.write(json.dumps(reply) + '\n')
+        stdout.flush()
@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import os.path
+import re
+import threading
+
+import yaml
+
+ANSWERS_HASH_KEY = '_answers_hash'
+
+COPIER_CONFIGS = ['copier.yml', 'copier.yaml']
+
+DEFAULT_TEMPLATES_SUFFIX = '.jinja'
+
+# what copier leaves out of every render unless the template says otherwise
+DEFAULT_EXCLUDE = ['copier.yaml', 'copier.yml', '~*', '*.py[co]',
+                   '__pycache__', '.git', '.DS_Store', '.svn']
+
+# copier settings that decide how paths are rendered, which we'd have to
+# reproduce exactly to know where a template file ends up
+UNSUPPORTED_SETTINGS = ['_envops', '_jinja_extensions']
+
+# template files affected by the change between two commits; the same for
+# every repo on the same version, so only worked out once per pair in a run
+_affected = dict()
+_affected_lock = threading.Lock()
+
+
+def answers_hash(answers):
+    # copier's own keys (the ones starting with _) aren't answers
+    answers = {key: value for key, value in answers.items()
+               if not key.startswith('_')}
+    return hashlib.sha256(
+        json.dumps(answers, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def escape_pattern(path):
+    return re.sub(r'([*?\[\]!#\\])', r'\\\1', path)
+
+
+def template_settings(template):
+    # the template's copier config at the commit it's checked out at, and
+    # what it's called
+    for name in COPIER_CONFIGS:
+        path = os.path.join(template.clone_path, name)
+        if os.path.exists(path):
+            with open(path) as fin:
+                return name, yaml.safe_load(fin.read()) or {}
+    return None, {}
+
+
+def template_sources(root):
+    sources = set()
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if name != '.git']
+        for name in files:
+            sources.add(os.path.relpath(os.path.join(directory, name), root))
+    return sources
+
+
+def rendered_paths(template, answers, answers_file):
+    # every path copier renders for a repo's answers
+    _, settings = template_settings(template)
+    root = os.path.join(template.clone_path,
+                        settings.get('_subdirectory') or '')
+    renderer = PathRenderer(settings, answers, answers_file)
+    paths = set()
+    for source in template_sources(root):
+        path = renderer.render(source)
+        if path is not None:
+            paths.add(path)
+    return paths
+
+
+def affected_sources(template, since):
+    # returns the template files (relative to its subdirectory) a repo
+    # rendered from since could render differently now, and why we can't
+    # tell if we can't
+    key = (template.clone_path, template.checked_out_head, since)
+    with _affected_lock:
+        if key not in _affected:
+            _affected[key] = find_affected_sources(template, since)
+        return _affected[key]
+
+
+def forget_affected():
+    # the template heads a long-running server sees would otherwise pile up
+    with _affected_lock:
+        _affected.clear()
+
+
+def find_affected_sources(template, since):
+    commit = template.resolve_commit(since)
+    if commit is None:
+        return None, f"can't find {since} in the template"
+    changed = template.changed_files(commit)
+    if changed is None:
+        return None, f"can't diff the template against {since}"
+
+    config_name, settings = template_settings(template)
+    for setting in UNSUPPORTED_SETTINGS:
+        if setting in settings:
+            return None, f'the template sets {setting}'
+    if '_templates_suffix' not in settings and \
+       '_min_copier_version' in settings:
+        # older templates may be using copier's old .tmpl suffix
+        return None, 'the template relies on the default templates suffix'
+
+    questions = set()
+    if config_name in changed:
+        old_config = template.file_at(commit, config_name)
+        old_settings = yaml.safe_load(old_config or '') or {}
+        for key in set(old_settings) | set(settings):
+            if old_settings.get(key) == settings.get(key):
+                continue
+            if key.startswith('_'):
+                return None, f'{key} changed in {config_name}'
+            questions.add(key)
+
+    subdirectory = settings.get('_subdirectory') or ''
+    root = os.path.join(template.clone_path, subdirectory)
+    sources = template_sources(root)
+    affected = set()
+    for path in changed:
+        relpath = os.path.relpath(path, subdirectory or '.')
+        # files outside the subdirectory aren't rendered, and copier doesn't
+        # remove files a template stopped having either
+        if relpath in sources:
+            affected.add(relpath)
+
+    # anything that mentions a changed question, or a changed file it might
+    # include, import or extend, could render differently too
+    words = [re.compile(rf'\b{re.escape(question)}\b')
+             for question in questions]
+    while True:
+        found = set()
+        for source in sources - affected:
+            with open(os.path.join(root, source), errors='replace') as fin:
+                text = f'{source}\n{fin.read()}'
+            if any(pattern.search(text) for pattern in words) or \
+               any(path in text for path in affected):
+                found.add(source)
+        if not found:
+            break
+        affected |= found
+    return (affected, settings), None
+
+
+class PathRenderer(object):
+    # works out where copier puts a template file for a repo's answers
+    def __init__(self, settings, answers, answers_file):
+        # jinja comes along with copier
+        import pathspec
+        from jinja2 import StrictUndefined
+        from jinja2.sandbox import SandboxedEnvironment
+
+        self.env = SandboxedEnvironment(undefined=StrictUndefined)
+        self.context = {key: value for key, value in answers.items()
+                        if not key.startswith('_')}
+        self.context['_copier_conf'] = {'answers_file': answers_file}
+        self.suffix = settings.get('_templates_suffix',
+                                   DEFAULT_TEMPLATES_SUFFIX)
+        self.excluded = pathspec.PathSpec.from_lines(
+            'gitwildmatch', settings.get('_exclude', DEFAULT_EXCLUDE))
+
+    def render(self, source):
+        # returns None for files copier leaves out
+        parts = [self.env.from_string(part).render(**self.context)
+                 for part in source.split(os.sep)]
+        if self.suffix and source.endswith(self.suffix):
+            parts[-1] = parts[-1][:-len(self.suffix)]
+        if not all(parts):
+            # copier leaves the file out for this repo's answers
+            return None
+        path = '/'.join(parts)
+        # excluded files are partials, and the files using them are
+        # rendered too
+        if self.excluded.match_file(path):
+            return None
+        return path
+
+
+class RenderPlan(object):
+    # works out which files a new template commit can change in one repo, so
+    # copier only has to render those. reason says why it couldn't tell, and
+    # everything has to be rendered
+    def __init__(self, template, answers, answers_file):
+        self.template = template
+        self.answers = answers
+        self.answers_file = answers_file
+        self.paths = set()
+        self.reason = None
+
+    @property
+    def full(self):
+        return self.reason is not None
+
+    @property
+    def skip(self):
+        return not self.full and not self.paths
+
+    def exclude(self):
+        # copier exclude patterns that leave out everything but the planned
+        # paths, the directories they're in, and the answers file
+        if self.full:
+            return ()
+        files = self.paths | {self.answers_file}
+        directories = set()
+        for path in files:
+            parts = path.split('/')
+            for end in range(1, len(parts)):
+                directories.add('/'.join(parts[:end]))
+        # bringing a directory back brings back everything in it, so leave
+        # its contents out again straight after. a directory sorts before
+        # anything in it
+        patterns = ['*']
+        for path in sorted(files | directories):
+            patterns.append(f'!/{escape_pattern(path)}')
+            if path in directories:
+                patterns.append(f'/{escape_pattern(path)}/*')
+        return tuple(patterns)
+
+    def give_up(self, reason):
+        self.reason = reason
+        self.paths = set()
+        return self
+
+    def plan(self, since):
+        if since is None:
+            return self.give_up('no _template_version in the answers file')
+        if self.answers.get(ANSWERS_HASH_KEY) != answers_hash(self.answers):
+            return self.give_up('the answers changed since the last render')
+        found, reason = affected_sources(self.template, since)
+        if found is None:
+            return self.give_up(reason)
+        sources, settings = found
+
+        renderer = PathRenderer(settings, self.answers, self.answers_file)
+        for source in sorted(sources):
+            try:
+                path = renderer.render(source)
+            except Exception as error:
+                return self.give_up(f"can't render {source}: {error}")
+            if path is not None:
+                self.paths.add(path)
+        return self
@@ -0,0 +1,147 @@
+import base64
+import json
+import logging
+import os.path
+from collections import Counter
+from datetime import date, datetime, timezone
+from os import makedirs
+
+import yaml
+
+from filesync import graphql
+from filesync.exceptions import InventoryMissingError, \
+                                UnrecognizedPredicateError
+
+VERSION_KEY = '_template_version'
+
+
+def parse_predicate(predicate):
+    # turn "key=value" / "key!=value" into (key, negate, value); the value is
+    # parsed as yaml so "true" and "3" compare equal to what's in the answers
+    for operator in ['!=', '=']:
+        if operator in predicate:
+            key, value = predicate.split(operator, 1)
+            try:
+                value = yaml.safe_load(value)
+            except yaml.YAMLError as error:
+                raise UnrecognizedPredicateError(
+                    f'unreadable value in predicate "{predicate}": {error}')
+            return key.strip(), operator == '!=', plain(value)
+    raise UnrecognizedPredicateError(f'unrecognized predicate "{predicate}"; '
+                                     'expected key=value or key!=value')
+
+
+def plain(value):
+    # yaml reads some values into types json doesn't have, like dates; keep
+    # those the way they read back from the saved inventory, so a predicate
+    # matches the same whether the inventory was just fetched or loaded
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    if isinstance(value, dict):
+        return {str(key): plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [plain(item) for item in value]
+    return value
+
+
+class Inventory(object):
+    # answers files for every managed repo, stored column by column so that
+    # a query only has to walk the one or two columns it's interested in
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.generated_at = None
+        self.repos = list()
+        self.columns = dict()
+
+    def __len__(self):
+        return len(self.repos)
+
+    def add(self, repo, answers):
+        row = len(self.repos)
+        self.repos.append(repo)
+        answers = plain(answers or {})
+        for key in answers.keys():
+            # a key we haven't seen yet is missing from every earlier row
+            self.columns.setdefault(key, [None] * row)
+        for key, column in self.columns.items():
+            column.append(answers.get(key))
+
+    def column(self, key):
+        return self.columns.get(key, [None] * len(self.repos))
+
+    def fetch(self, github, repos):
+        # repos is a list of (repo, org, name, answers_paths); read all the
+        # answers files through GraphQL, a batch of repos per request
+        for batch in graphql.batched(repos):
+            data = graphql.query(github, self.fetch_query(batch))
+            for i, (repo, _, _, answers_paths) in enumerate(batch):
+                result = data.get(f'r{i}') or {}
+                self.add(repo, self.parse_answers(repo, result, answers_paths))
+        self.generated_at = datetime.now(timezone.utc).isoformat()
+        self.logger.debug(f'inventory has {len(self)} repos')
+
+    def fetch_query(self, batch):
+        parts = list()
+        for i, (_, org, name, answers_paths) in enumerate(batch):
+            blobs = ' '.join(
+                f'a{j}: object(expression: {graphql.literal(f"HEAD:{path}")})'
+                ' { ... on Blob { text } }'
+                for j, path in enumerate(answers_paths))
+            parts.append(
+                f'r{i}: repository(owner: {graphql.literal(org)}, '
+                f'name: {graphql.literal(name)}) {{ {blobs} }}')
+        return 'query { ' + ' '.join(parts) + ' }'
+
+    def load(self):
+        if not os.path.exists(self.path):
+            raise InventoryMissingError(
+                f'no inventory at {self.path}! '
+                'run the inventory command first')
+        with open(self.path) as fin:
+            index = json.load(fin)
+        self.generated_at = index.get('generated_at')
+        self.repos = index['repos']
+        self.columns = index['columns']
+        return self
+
+    def parse_answers(self, repo, result, answers_paths):
+        for i in range(len(answers_paths)):
+            blob = result.get(f'a{i}')
+            if blob is None or blob.get('text') is None:
+                continue
+            try:
+                answers = yaml.safe_load(blob['text'])
+            except yaml.YAMLError as error:
+                self.logger.warning(f'unreadable answers file in {repo}: '
+                                    f'{error}')
+                return None
+            if type(answers) == dict:
+                return answers
+        return None
+
+    def save(self):
+        makedirs(os.path.dirname(self.path), exist_ok=True)
+        index = {
+            'generated_at': self.generated_at,
+            'repos': self.repos,
+            'columns': self.columns,
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fout:
+            json.dump(index, fout)
+        os.replace(tmp_path, self.path)
+
+    def version_distribution(self):
+        return Counter(self.column(VERSION_KEY))
+
+    def where(self, predicates):
+        # every predicate has to match (they're ANDed together)
+        rows = range(len(self.repos))
+        for predicate in predicates:
+            key, negate, value = parse_predicate(predicate)
+            column = self.column(key)
+            rows = [i for i in rows if (column[i] == value) != negate]
+        return [self.repos[i] for i in rows]
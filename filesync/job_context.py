@@ -0,0 +1,43 @@
+import contextvars
+from contextlib import contextmanager
+
+# the run-wide state made for the server job the code is working for, or
+# None outside a server job. threads started for a job have to be handed a
+# copy of its context (see FileSync.run_parallel) to stay part of it
+_job_state = contextvars.ContextVar('filesync_job_state', default=None)
+
+
+@contextmanager
+def job_context():
+    # everything run inside gets its own spans, API calls, git commands and
+    # metrics, apart from any other job running at the same time
+    token = _job_state.set(dict())
+    try:
+        yield
+    finally:
+        _job_state.reset(token)
+
+
+class PerJob(object):
+    # stands in for one of the run-wide singletons (tracer, api_stats,
+    # git_trace, metrics), passing everything on to the current job's own
+    # instance. a one-off run only ever uses the one made at import
+    def __init__(self, factory):
+        object.__setattr__(self, '_factory', factory)
+        object.__setattr__(self, '_default', factory())
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+
+    def _target(self):
+        state = _job_state.get()
+        if state is None:
+            return self._default
+        instance = state.get(id(self))
+        if instance is None:
+            # the job's threads may get here at the same time
+            instance = state.setdefault(id(self), self._factory())
+        return instance
@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import os.path
+from datetime import datetime, timezone
+from os import makedirs
+
+# outcomes a resumed run doesn't need to repeat. "rendered" is left out: it's
+# where a dry run stops, but also where a real run was when it died
+COMPLETED_OUTCOMES = ['pushed', 'unchanged', 'skipped']
+
+
+class Journal(object):
+    # an append-only record of what happened to each repo in a run, one JSON
+    # line per repo, written as soon as the repo is done. a run that dies
+    # part way through can be resumed from it, or its failures retried
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+
+    def completed(self, template_sha):
+        # repos already done with this commit of the template
+        return {repo for repo, entry in self.latest().items()
+                if entry.get('template_sha') == template_sha and
+                entry.get('outcome') in COMPLETED_OUTCOMES}
+
+    def durations(self):
+        # how long each repo took, every time it's been journaled
+        durations = dict()
+        for entry in self.entries():
+            if entry.get('repo') and entry.get('duration') is not None:
+                durations.setdefault(entry['repo'], []).append(
+                    entry['duration'])
+        return durations
+
+    def entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = list()
+        with open(self.path) as fin:
+            for line in fin:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # a run killed mid-write can leave half a line
+                    self.logger.warning(f'skipping unreadable entry in '
+                                        f'{self.path}')
+        return entries
+
+    def failed(self):
+        return sorted(repo for repo, entry in self.latest().items()
+                      if entry.get('outcome') == 'failed')
+
+    def latest(self):
+        # a repo retried or resumed has more than one entry; the last wins
+        return {entry['repo']: entry for entry in self.entries()
+                if 'repo' in entry}
+
+    def record(self, spec, template_sha):
+        entry = {
+            'repo': spec.listed_name,
+            'template_sha': template_sha,
+            'outcome': spec.outcome,
+            'pr_url': spec.pr_url,
+            'error': spec.error,
+            'error_class': spec.error_class,
+            'duration': spec.duration,
+            'api_calls': spec.api_calls,
+            'disk_usage': spec.disk_usage,
+            'time': datetime.now(timezone.utc).isoformat(),
+        }
+        makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'a') as fout:
+            fout.write(json.dumps(entry) + '\n')
+            fout.flush()
+            # the point is to survive the run dying, so don't leave the
+            # entry sitting in a buffer
+            os.fsync(fout.fileno())
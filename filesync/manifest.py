@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import os.path
+from datetime import datetime, timezone
+from os import makedirs
+
+import yaml
+
+from filesync import graphql
+from filesync.incremental import answers_hash
+
+# GitHub charges a query by the nodes it touches, so batches are capped by
+# the number of files they ask about as well as by the number of repos
+PATHS_PER_QUERY = 500
+
+
+def blob_sha(path):
+    # the sha git (and so GitHub's API) gives a file with this content
+    with open(path, 'rb') as fin:
+        content = fin.read()
+    header = f'blob {len(content)}\0'.encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+class Manifest(object):
+    # what filesync last rendered into a repo: the blob sha of every file
+    # the template manages, and the template version and answers it was
+    # rendered with. that's enough to tell whether the repo still matches
+    # without cloning it
+    def __init__(self, path):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.answers_file = None
+        self.answers_hash = None
+        self.template_version = None
+        self.rendered_at = None
+        self.files = dict()
+        # files an incremental render left alone
+        self.kept = set()
+
+    @property
+    def exists(self):
+        return self.path is not None and os.path.exists(self.path)
+
+    def compare(self, answers_text, blobs):
+        # answers_text is the repo's answers file and blobs the current sha
+        # of each managed file (None when it's gone); returns the repo's
+        # status and the files that don't match
+        try:
+            answers = yaml.safe_load(answers_text or '')
+        except yaml.YAMLError:
+            answers = None
+        if type(answers) != dict:
+            return 'no-answers', []
+        if answers.get('_template_version') != self.template_version:
+            # the render hasn't been merged, or something else has been
+            return 'behind', []
+        if answers_hash(answers) != self.answers_hash:
+            return 'answers-changed', []
+        drifted = sorted(path for path, sha in self.files.items()
+                         if blobs.get(path) != sha)
+        if drifted:
+            return 'drifted', drifted
+        return 'clean', []
+
+    def load(self):
+        with open(self.path) as fin:
+            manifest = json.load(fin)
+        self.answers_file = manifest['answers_file']
+        self.answers_hash = manifest['answers_hash']
+        self.template_version = manifest['template_version']
+        self.rendered_at = manifest.get('rendered_at')
+        self.files = manifest['files']
+        return self
+
+    def merge(self, previous):
+        # files left out of an incremental render keep the sha they were
+        # last rendered with, so hand edits to them still show up as drift
+        for path in self.kept:
+            if path in previous.files:
+                self.files[path] = previous.files[path]
+
+    def save(self):
+        makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.rendered_at = datetime.now(timezone.utc).isoformat()
+        manifest = {
+            'answers_file': self.answers_file,
+            'answers_hash': self.answers_hash,
+            'template_version': self.template_version,
+            'rendered_at': self.rendered_at,
+            'files': self.files,
+        }
+        # write then rename so an interrupted run can't leave half a file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fout:
+            json.dump(manifest, fout, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def batched(targets):
+    # targets is a list of (key, org, name, manifest)
+    batch = list()
+    paths = 0
+    for target in targets:
+        size = len(target[3].files) + 1
+        if batch and (len(batch) >= graphql.BATCH_SIZE or
+                      paths + size > PATHS_PER_QUERY):
+            yield batch
+            batch = list()
+            paths = 0
+        batch.append(target)
+        paths += size
+    if batch:
+        yield batch
+
+
+def fetch_query(batch):
+    parts = list()
+    for i, (_, org, name, manifest) in enumerate(batch):
+        objects = [
+            'a: object(expression: '
+            f'{graphql.literal(f"HEAD:{manifest.answers_file}")})'
+            ' { ... on Blob { text } }']
+        for j, path in enumerate(sorted(manifest.files)):
+            objects.append(
+                f'f{j}: object(expression: '
+                f'{graphql.literal(f"HEAD:{path}")}) {{ oid }}')
+        parts.append(
+            f'r{i}: repository(owner: {graphql.literal(org)}, '
+            f'name: {graphql.literal(name)}) {{ {" ".join(objects)} }}')
+    return 'query { ' + ' '.join(parts) + ' }'
+
+
+def fetch_states(github, targets):
+    # compares each repo's default branch with its manifest, a batch of
+    # repos per GraphQL request; yields (key, status, drifted files)
+    for batch in batched(targets):
+        data = graphql.query(github, fetch_query(batch))
+        for i, (key, _, _, manifest) in enumerate(batch):
+            result = data.get(f'r{i}')
+            if result is None:
+                yield key, 'missing', []
+                continue
+            answers = result.get('a') or {}
+            blobs = dict()
+            for j, path in enumerate(sorted(manifest.files)):
+                blob = result.get(f'f{j}') or {}
+                blobs[path] = blob.get('oid')
+            yield (key,) + manifest.compare(answers.get('text'), blobs)
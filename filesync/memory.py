@@ -0,0 +1,98 @@
+import json
+import logging
+import resource
+import sys
+import threading
+import tracemalloc
+from collections import defaultdict
+
+from filesync.tracing import tracer
+
+# how many allocation sites to list in the report
+SUMMARY_SIZE = 20
+
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+
+class MemoryTracker(object):
+    # records how much memory python allocated and how far the process's
+    # peak RSS grew during each span, so it's clear which phase grows
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.started = dict()
+        self.phases = defaultdict(list)
+
+    def log_summary(self, summary):
+        self.logger.info(f'peak RSS {summary["peak_rss"] / 2**20:.1f}MiB, '
+                         'peak traced '
+                         f'{summary["peak_traced"] / 2**20:.1f}MiB')
+        for phase in summary['phases'][:5]:
+            self.logger.info(f'{phase["max_rss_growth"] / 2**20:>10.1f}MiB '
+                             f'{phase["name"]}')
+
+    def on_finish(self, span):
+        with self.lock:
+            started = self.started.pop(span.span_id, None)
+            if started is None:
+                return
+            traced, rss = started
+            self.phases[span.name].append({
+                'traced_growth': tracemalloc.get_traced_memory()[0] - traced,
+                'rss_growth': peak_rss() - rss,
+            })
+
+    def on_start(self, span):
+        with self.lock:
+            self.started[span.span_id] = (
+                tracemalloc.get_traced_memory()[0], peak_rss())
+
+    def start(self):
+        # tracemalloc slows python down noticeably, so it's only on when a
+        # report was asked for
+        tracemalloc.start()
+        tracer.start_listeners.append(self.on_start)
+        tracer.listeners.append(self.on_finish)
+        self.enabled = True
+
+    def summary(self):
+        phases = list()
+        for name, samples in self.phases.items():
+            phases.append({
+                'name': name,
+                'count': len(samples),
+                'traced_growth': sum(s['traced_growth'] for s in samples),
+                'max_traced_growth': max(s['traced_growth']
+                                         for s in samples),
+                'rss_growth': sum(s['rss_growth'] for s in samples),
+                'max_rss_growth': max(s['rss_growth'] for s in samples),
+            })
+        phases.sort(key=lambda phase: phase['rss_growth'], reverse=True)
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().statistics('lineno')
+        return {
+            'peak_rss': peak_rss(),
+            'traced': current,
+            'peak_traced': peak,
+            'phases': phases,
+            'top_allocations': [{
+                'site': str(stat.traceback),
+                'size': stat.size,
+                'count': stat.count,
+            } for stat in top[:SUMMARY_SIZE]],
+        }
+
+    def write_report(self, path):
+        summary = self.summary()
+        self.log_summary(summary)
+        with open(path, 'w') as fout:
+            json.dump(summary, fout, indent=2)
+
+
+memory_tracker = MemoryTracker()
@@ -0,0 +1,186 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+from time import monotonic, time
+
+from filesync.api_stats import api_stats
+from filesync.job_context import PerJob
+from filesync.tracing import tracer
+
+# upper bounds, in seconds, of the phase duration histogram buckets
+DURATION_BUCKETS = [0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600]
+
+# how often to rewrite the metrics file during a long run
+WRITE_INTERVAL = 60
+
+# every repo outcome, so a run with no failures still reports failed=0
+OUTCOMES = ['pending', 'skipped', 'unchanged', 'rendered', 'pushed',
+            'failed', 'deferred']
+
+
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                # a file removed while we were looking isn't using space
+                continue
+    return total
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+
+class Family(object):
+    # one metric family in the Prometheus text exposition format
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples = list()
+
+    def add(self, value, suffix='', **labels):
+        self.samples.append((suffix, labels, value))
+
+    def render(self, common_labels):
+        lines = [f'# HELP {self.name} {self.help_text}',
+                 f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples:
+            labels = {**common_labels, **labels}
+            label_text = ','.join(f'{key}="{escape(val)}"'
+                                  for key, val in labels.items())
+            lines.append(f'{self.name}{suffix}{{{label_text}}} {value}')
+        return lines
+
+
+class RunMetrics(object):
+    # counts things that happen during a run and writes them, with the
+    # run's spans and API stats, as a textfile for node_exporter to pick up
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.reset()
+
+    def collect(self, repos, clone_root, finished):
+        families = list()
+
+        run = Family('filesync_run_duration_seconds', 'gauge',
+                     'How long the run has taken so far')
+        run.add(round(monotonic() - self.started_at, 3))
+        families.append(run)
+
+        in_progress = Family('filesync_run_in_progress', 'gauge',
+                             '1 while the run is still going')
+        in_progress.add(0 if finished else 1)
+        families.append(in_progress)
+
+        updated = Family('filesync_last_update_timestamp_seconds', 'gauge',
+                         'When this file was written')
+        updated.add(round(time(), 3))
+        families.append(updated)
+
+        scanned = Family('filesync_repos_scanned', 'gauge',
+                         'Repos looked at while building the repo list')
+        scanned.add(self.counters['repos_scanned'])
+        families.append(scanned)
+
+        outcomes = Family('filesync_repos', 'gauge',
+                          'Repos in the run by outcome (pushed means '
+                          'updated)')
+        counts = defaultdict(int)
+        for repo in repos:
+            counts[repo.outcome or 'pending'] += 1
+        for outcome in OUTCOMES:
+            outcomes.add(counts[outcome], outcome=outcome)
+        families.append(outcomes)
+
+        pull_requests = Family('filesync_pull_requests', 'gauge',
+                               'Pull requests opened and closed')
+        for action in ['opened', 'closed']:
+            pull_requests.add(self.counters[f'pull_requests_{action}'],
+                              action=action)
+        families.append(pull_requests)
+
+        families.append(self.phase_durations())
+
+        api_requests = Family('filesync_api_requests', 'gauge',
+                              'GitHub API requests made')
+        api_requests.add(len(api_stats.calls))
+        families.append(api_requests)
+
+        rate_limit = Family('filesync_api_rate_limit_remaining', 'gauge',
+                            'GitHub API rate limit left, by resource')
+        for resource, remaining in sorted(
+                api_stats.rate_limit_remaining.items()):
+            rate_limit.add(remaining, resource=resource)
+        families.append(rate_limit)
+
+        cloned = Family('filesync_cloned_bytes', 'gauge',
+                        'Size of the clones made, measured after cloning')
+        cloned.add(self.counters['cloned_bytes'])
+        families.append(cloned)
+
+        clone_root_usage = Family('filesync_clone_root_bytes', 'gauge',
+                                  'Disk used by clone-root')
+        clone_root_usage.add(disk_usage(clone_root))
+        families.append(clone_root_usage)
+
+        return families
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def maybe_write(self, path, labels, repos, clone_root):
+        if self.written_at is not None and \
+           monotonic() - self.written_at < WRITE_INTERVAL:
+            return
+        self.write(path, labels, repos, clone_root, finished=False)
+
+    def phase_durations(self):
+        histogram = Family('filesync_phase_duration_seconds', 'histogram',
+                           'How long each phase took')
+        durations = defaultdict(list)
+        for span in list(tracer.spans):
+            durations[span.name].append(span.duration)
+        for phase, values in sorted(durations.items()):
+            for bound in DURATION_BUCKETS:
+                histogram.add(sum(1 for value in values if value <= bound),
+                              '_bucket', phase=phase, le=bound)
+            histogram.add(len(values), '_bucket', phase=phase, le='+Inf')
+            histogram.add(round(sum(values), 3), '_sum', phase=phase)
+            histogram.add(len(values), '_count', phase=phase)
+        return histogram
+
+    def render(self, labels, repos, clone_root, finished=True):
+        lines = list()
+        for family in self.collect(repos, clone_root, finished):
+            lines += family.render(labels)
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.started_at = monotonic()
+        self.written_at = None
+
+    def write(self, path, labels, repos, clone_root, finished=True):
+        self.written_at = monotonic()
+        text = self.render(labels, repos, clone_root, finished)
+        # the textfile collector may read at any moment, so never let it see
+        # a half-written file
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w') as fout:
+                fout.write(text)
+            os.replace(tmp_path, path)
+        except OSError as error:
+            # metrics are nice to have; never fail a run over them
+            self.logger.warning(f'unable to write metrics to {path}: {error}')
+
+
+metrics = PerJob(RunMetrics)
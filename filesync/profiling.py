@@ -0,0 +1,178 @@
+import cProfile
+import json
+import logging
+import os.path
+import pstats
+import re
+import signal
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from io import StringIO
+from os import makedirs
+
+# seconds between samples for the sampling profiler
+SAMPLE_INTERVAL = 0.005
+
+# how many functions to list in the merged summary
+SUMMARY_SIZE = 30
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def profile_name(*parts):
+    # repo and phase names end up in file names
+    return re.sub(r'[^\w.-]', '_', '-'.join(parts))
+
+
+class Sampler(object):
+    # a wall-clock sampling profiler: SIGALRM interrupts the main thread
+    # every interval and the interrupted stack is recorded. unlike cProfile
+    # it also sees time spent waiting, e.g. on git or a hook
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.frames = list()
+        self.frame_ids = dict()
+        self.samples = list()
+        self.previous_handler = None
+
+    def disable(self):
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.previous_handler)
+
+    def dump(self, path, name):
+        profile = {
+            '$schema': SPEEDSCOPE_SCHEMA,
+            'name': name,
+            'exporter': 'filesync',
+            'shared': {'frames': [
+                {'name': function, 'file': filename, 'line': line}
+                for function, filename, line in self.frames]},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': len(self.samples) * self.interval,
+                'samples': self.samples,
+                'weights': [self.interval] * len(self.samples),
+            }],
+        }
+        with open(path, 'w') as fout:
+            json.dump(profile, fout)
+
+    def enable(self):
+        # signals are only ever delivered to the main thread
+        self.previous_handler = signal.signal(signal.SIGALRM, self.sample)
+        signal.setitimer(signal.ITIMER_REAL, self.interval, self.interval)
+
+    def sample(self, signum, frame):
+        stack = list()
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            frame_id = self.frame_ids.get(key)
+            if frame_id is None:
+                frame_id = self.frame_ids[key] = len(self.frames)
+                self.frames.append(key)
+            stack.append(frame_id)
+            frame = frame.f_back
+        # speedscope wants the outermost frame first
+        stack.reverse()
+        self.samples.append(stack)
+
+
+class Profiler(object):
+    # profiles the whole run (mode "run") or each step of each repo (mode
+    # "repo"), writing one file per profile plus a merged summary of the
+    # hottest functions
+    def __init__(self, mode, kind, directory):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.mode = mode
+        self.kind = kind or 'cprofile'
+        self.directory = directory
+        self.profiles = list()
+        self.run_profile = None
+
+    def finish(self):
+        if self.run_profile is not None:
+            self.run_profile.disable()
+            self.save('run', self.run_profile)
+            self.run_profile = None
+        if not self.profiles:
+            return
+        path = os.path.join(self.directory, 'summary.txt')
+        with open(path, 'w') as fout:
+            fout.write(self.summary())
+        self.logger.info(f'wrote {len(self.profiles)} profiles and a '
+                         f'summary to {self.directory}')
+
+    def new_profile(self):
+        if self.kind == 'sampling':
+            return Sampler()
+        return cProfile.Profile()
+
+    @contextmanager
+    def profile(self, name):
+        profile = self.new_profile()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            self.save(name, profile)
+
+    def profile_repo(self, repo_name, step):
+        if self.mode != 'repo':
+            return nullcontext()
+        if threading.current_thread() is not threading.main_thread():
+            # repos worked on in parallel would show up in each other's
+            # profiles, and the sampler only works on the main thread
+            return nullcontext()
+        phase = getattr(step, '__name__', 'step')
+        return self.profile(profile_name('repo', repo_name, phase))
+
+    def sampled_summary(self):
+        # inclusive time counts a function once per sample it's anywhere in
+        # the stack; self time only when it's the innermost frame
+        inclusive = Counter()
+        own = Counter()
+        for sampler in self.profiles:
+            for stack in sampler.samples:
+                keys = [sampler.frames[i] for i in stack]
+                inclusive.update(set(keys))
+                if keys:
+                    own[keys[-1]] += 1
+        interval = self.profiles[0].interval
+        lines = [f'{"total s":>10} {"self s":>10}  function']
+        for key, samples in inclusive.most_common(SUMMARY_SIZE):
+            function, filename, line = key
+            lines.append(f'{samples * interval:>10.3f} '
+                         f'{own[key] * interval:>10.3f}  '
+                         f'{function} ({filename}:{line})')
+        return '\n'.join(lines) + '\n'
+
+    def save(self, name, profile):
+        makedirs(self.directory, exist_ok=True)
+        if self.kind == 'sampling':
+            profile.dump(os.path.join(
+                self.directory, f'{name}.speedscope.json'), name)
+        else:
+            profile.dump_stats(os.path.join(self.directory, f'{name}.pstats'))
+        self.profiles.append(profile)
+
+    def start_run(self):
+        if self.mode != 'run':
+            return
+        self.run_profile = self.new_profile()
+        self.run_profile.enable()
+
+    def summary(self):
+        if self.kind == 'sampling':
+            return self.sampled_summary()
+        output = StringIO()
+        stats = pstats.Stats(self.profiles[0], stream=output)
+        for profile in self.profiles[1:]:
+            stats.add(profile)
+        stats.sort_stats('cumulative').print_stats(SUMMARY_SIZE)
+        return output.getvalue()
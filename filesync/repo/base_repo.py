@@ -1,9 +1,14 @@
 import logging
 import os.path
+from shutil import rmtree
 
 from sh import ErrorReturnCode, git
 
 from filesync.exceptions import DirtyRepoError, UnrecognizableBaseBranchError
+from filesync.git_trace import git_trace
+from filesync.metrics import disk_usage, metrics
+from filesync.retry import retry_policy
+from filesync.tracing import traced
 
 
 class BaseRepo(object):
@@ -73,6 +78,11 @@ class BaseRepo(object):
             return 'master'
         raise UnrecognizableBaseBranchError("unable to determine base branch!")
 
+    @property
+    def trace_attributes(self):
+        return {'repo': self.name}
+
+    @traced('clone')
     def clone(self):
         if not self.is_cloned:
             self.logger.debug(f'cloning {self.name} to {self.clone_path}...')
@@ -80,6 +90,7 @@ class BaseRepo(object):
             # branches correctly
             self.git_cmd('clone', '--depth', '1',
                          self.clone_url, self.clone_path)
+            metrics.count('cloned_bytes', disk_usage(self.clone_path))
         if self.is_dirty:
             raise DirtyRepoError(
                 f"repo {self.name} is dirty! can't proceed")
@@ -87,10 +98,26 @@ class BaseRepo(object):
         self.logger.debug(f'cloning {self.name} complete')
 
     def git_cmd(self, cmd, *args):
-        if cmd == 'clone':
+        # sh gives commands a tty by default, which makes git page (and
+        # color) output we parse
+        kwargs = dict(_tty_out=False)
+        before_retry = None
+        if cmd != 'clone':
             # clone is special because _cwd doesn't exist yet
-            return git(cmd, *args)
-        return git(cmd, *args, _cwd=self.clone_path)
+            kwargs['_cwd'] = self.clone_path
+        else:
+            # a clone that failed part way leaves a directory git won't
+            # clone into
+            def before_retry():
+                rmtree(self.clone_path, ignore_errors=True)
+
+        def run():
+            if git_trace.enabled:
+                with git_trace.command(cmd, self.clone_path) as env:
+                    return git(cmd, *args, _env=env, **kwargs)
+            return git(cmd, *args, **kwargs)
+
+        return retry_policy.run_git(cmd, run, before_retry)
 
     def maybe_switch_branch(self):
         if self.active_branch == self.base_branch:
@@ -0,0 +1,37 @@
+import os.path
+
+
+class RepoSpec(object):
+    # everything we need to know about a repo before working on it, and what
+    # happened once we did. a run over thousands of repos keeps one of these
+    # per repo instead of a Repository and its PyGithub objects
+    __slots__ = ['name', 'org', 'kwargs', 'clone_path', 'listed_name',
+                 'operation', 'outcome', 'error', 'error_class', 'pr_url',
+                 'duration', 'priority', 'api_calls', 'disk_usage']
+
+    def __init__(self, name, org, kwargs, clone_root, listed_name=None):
+        self.name = name
+        self.org = org
+        self.kwargs = kwargs
+        self.clone_path = os.path.join(clone_root, name)
+        # the name the repo list gave, e.g. org/name, so a later run can ask
+        # for the same repo (with the same config) again
+        self.listed_name = listed_name or name
+        self.operation = None
+        self.outcome = None
+        self.error = None
+        self.error_class = None
+        self.pr_url = None
+        self.duration = None
+        # how far up a time-budgeted run's order the repo goes
+        self.priority = 0
+        # what the repo cost, for estimating later runs
+        self.api_calls = None
+        self.disk_usage = None
+
+    def record(self, repo):
+        self.operation = repo.operation
+        self.outcome = repo.outcome
+        self.error = repo.error
+        self.error_class = repo.error_class
+        self.pr_url = repo.pr_url
@@ -1,14 +1,26 @@
+import hashlib
 import logging
 import os.path
 import subprocess
+import threading
 
 import yaml
-from copier import copy
 
-from filesync.commit_template import commit_template
-from filesync.exceptions import HookFailure
+from filesync.commit_template import commit_template, \
+                                     group_commit_template, \
+                                     group_section_template
+from filesync.exceptions import HookFailure, RunSupersededError
+from filesync.incremental import ANSWERS_HASH_KEY, RenderPlan, \
+                                 answers_hash, rendered_paths
 from filesync.log_or_print import log_or_print
+from filesync.manifest import Manifest, blob_sha
+from filesync.metrics import metrics
 from filesync.repo.base_repo import BaseRepo
+from filesync.tracing import traced, tracer
+
+# copier changes the process's working directory while it runs a template's
+# tasks, so repos rendered in parallel take turns running it
+COPIER_LOCK = threading.Lock()
 
 
 def string_representer(dumper, data):
@@ -34,7 +46,13 @@ class Repository(BaseRepo):
                  branch_prefix='filesync',
                  branch_separator='/',
                  interactive=False,
-                 hooks=None):
+                 hooks=None,
+                 reuse_pr=False,
+                 answers=None,
+                 companions=None,
+                 template_ref=None,
+                 incremental_render=False,
+                 answers_changed=False):
 
         super().__init__(name, token, github, clone_root, base_branch, dry_run,
                          interactive)
@@ -43,33 +61,75 @@ class Repository(BaseRepo):
         self.branch_prefix = branch_prefix
         self.branch_separator = branch_separator
         self.hooks = hooks or {}
+        self.reuse_pr = reuse_pr
+        # answers to give copier instead of asking for them or taking the
+        # template's defaults
+        self.answers = answers or {}
+        # other templates to render into the same clone after this one, as
+        # (template, answers file) pairs; the ones this repo has no answers
+        # file for are dropped once it's cloned
+        self.companions = companions or []
+        # the template branch or tag this repo stays on, if not the one the
+        # run syncs from
+        self.template_ref = template_ref
+        # only render the template files changed since the repo's version
+        self.incremental_render = incremental_render
+        # the answers file changed on the base branch, so the repo needs
+        # rendering even if it's already at the template head
+        self.answers_changed = answers_changed
 
         self.operation = None
+        self.outcome = None
+        self.error = None
+        self.error_class = None
+        self.pr_url = None
+        # what was rendered, once it has been
+        self.manifest = None
+        self.render_plan = None
 
         self.answers_file_path = os.path.join(
             self.clone_path, self.answers_file)
 
     @property
     def commit_message(self):
-        return commit_template.format(operation=self.operation,
-                                      template=self.template.name,
-                                      branch=self.template.base_branch,
-                                      commit=self.template.head)
+        if not self.companions:
+            return commit_template.format(operation=self.operation,
+                                          template=self.template.name,
+                                          branch=self.template.base_branch,
+                                          commit=self.template.head)
+        sections = [group_section_template.format(
+            template=template.name, branch=template.base_branch,
+            commit=template.head) for template, _ in self.templates]
+        return group_commit_template.format(
+            operation=self.operation,
+            templates=', '.join(template.name
+                                for template, _ in self.templates),
+            sections='\n\n'.join(sections))
 
     @property
     def fixing(self):
         return self.operation == 'fixing'
 
+    @property
+    def group_head(self):
+        # stands in for the template head in the update branch's name; a
+        # group's branch has to change whenever any of its templates do
+        if not self.companions:
+            return self.template.head
+        heads = ' '.join(template.head for template, _ in self.templates)
+        return hashlib.sha1(heads.encode()).hexdigest()
+
+    @property
+    def group_name(self):
+        return '+'.join(template.name for template, _ in self.templates)
+
     @property
     def has_update_branch(self):
         return self.update_branch_name in self.branches
 
     @property
     def template_version(self):
-        with open(self.answers_file_path) as fin:
-            answers = yaml.safe_load(fin.read())
-        return answers.get('_template_version',
-                           '_template_version missing, force update')
+        return self.answers_version(self.answers_file)
 
     @property
     def onboarding(self):
@@ -77,39 +137,115 @@ class Repository(BaseRepo):
 
     @property
     def needs_update(self):
-        if self.has_update_branch:
+        if self.reuse_pr:
+            # the reused branch is pushed over, so it can take new answers
+            if not self.answers_changed and self.update_branch_is_current:
+                self.logger.debug(
+                    f'SKIP: update branch {self.update_branch_name} already '
+                    f'has template head {self.template.head}')
+                return False
+        elif self.has_update_branch:
             self.logger.debug(
                 f'SKIP: update branch exists: {self.update_branch_name}')
             return False
-        if self.template.head.startswith(self.template_version):
+        if self.answers_changed:
+            self.logger.info('the answers changed; rendering at template '
+                             f'version {self.template_version}')
+            return True
+        if self.template.head.startswith(self.template_version) and \
+           not self.outdated_companions():
             self.logger.info(
                 'SKIP: template version matches template head: '
                 f'{self.template_version}')
             return False
         return True
 
+    @property
+    def templates(self):
+        return [(self.template, self.answers_file)] + self.companions
+
+    @property
+    def trace_attributes(self):
+        return {'repo': self.name, 'template': self.template.name}
+
+    @property
+    def update_branch_is_current(self):
+        # a reused branch's name doesn't say which template commit it has,
+        # but the commit message filesync pushed to it does
+        if not self.has_update_branch:
+            return False
+        branch = self.github.get_branch(self.update_branch_name)
+        return all(f'commit: {template.head}' in branch.commit.commit.message
+                   for template, _ in self.templates)
+
     @property
     def update_branch_name(self):
         if self.fixing:
             return self.base_branch
 
+        if self.reuse_pr:
+            return self.branch_separator.join([
+                self.branch_prefix,
+                self.group_name
+            ])
+
         return self.branch_separator.join([
             self.branch_prefix,
-            self.template.name,
-            self.template.head
+            self.group_name,
+            self.group_head
         ])
 
     @property
     def updating(self):
         return self.operation == 'updating'
 
+    def answers_version(self, answers_file):
+        # the template commit an answers file says the repo was rendered from
+        with open(os.path.join(self.clone_path, answers_file)) as fin:
+            answers = yaml.safe_load(fin.read())
+        return answers.get('_template_version',
+                           '_template_version missing, force update')
+
+    @traced('build_manifest')
+    def build_manifest(self):
+        # the blob sha of every file the templates render, for checking the
+        # repo against later without cloning it
+        manifest = Manifest(None)
+        manifest.answers_file = self.answers_file
+        answers_files = [answers_file for _, answers_file in self.templates]
+        for template, answers_file in self.templates:
+            with open(os.path.join(self.clone_path, answers_file)) as fin:
+                answers = yaml.safe_load(fin.read()) or {}
+            if template is self.template:
+                manifest.template_version = answers.get('_template_version')
+                manifest.answers_hash = answers_hash(answers)
+            try:
+                paths = rendered_paths(template, answers, answers_file)
+            except Exception as error:
+                self.logger.warning("not recording the managed files; can't "
+                                    f'tell where {template.name} renders '
+                                    f'them: {error}')
+                return None
+            if template is self.template and self.render_plan is not None:
+                manifest.kept = paths - self.render_plan.paths
+            for path in paths:
+                full_path = os.path.join(self.clone_path, path)
+                # answers files are checked by what's in them
+                if path not in answers_files and os.path.isfile(full_path):
+                    manifest.files[path] = blob_sha(full_path)
+        return manifest
+
+    @traced('clean_stale_branches')
     def clean_stale_branches(self):
         # find stale branches, close the associated PRs, delete the branches
         start = self.branch_separator.join([
-            self.branch_prefix, self.template.name
+            self.branch_prefix, self.group_name
         ])
         self.logger.debug(f'clean old branches matching prefix {start}...')
         for branch in self.github.get_branches():
+            if self.reuse_pr and branch.name == self.update_branch_name:
+                # the branch we're about to reuse isn't stale
+                continue
             if branch.name.startswith(start):
                 for pr in branch.commit.get_pulls():
                     self.close_pr(pr)
@@ -121,7 +257,9 @@ class Repository(BaseRepo):
         if self.dry_run:
             return
         pr.edit(state='closed')
+        metrics.count('pull_requests_closed')
 
+    @traced('confirm_changes')
     def confirm_changes(self):
         # if the only thing that copier changed is the answers file,
         # don't bother opening a PR
@@ -130,7 +268,10 @@ class Repository(BaseRepo):
         if len(changes) == 0:
             self.logger.info('no changes detected')
             return False
-        if len(changes) == 1 and self.answers_file in changes[0]:
+        answers_files = [answers_file for _, answers_file in self.templates]
+        if len(changes) <= len(answers_files) and \
+           all(any(answers_file in change for answers_file in answers_files)
+               for change in changes):
             self.logger.info('only the answers file changed; nothing to do.')
             return False
         return True
@@ -141,25 +282,64 @@ class Repository(BaseRepo):
             return
         self.git_cmd('push', 'origin', '--delete', branch.name)
 
+    def find_pull_request(self, head, base):
+        pulls = self.github.get_pulls(
+            state='open', head=f'{self.github.owner.login}:{head}', base=base)
+        for pr in pulls:
+            return pr
+        return None
+
     def fix(self):
         self.update(operation='fixing')
 
-    def munge_answers(self):
+    def munge_answers(self, answers_file=None):
         # for some reason copier writes data to _commit that it can't actually
         # use to run updates. but it runs fine if it's missing entirely
         # so rename the field to something different so that we can still use
         # it but copier doesn't see it
-        with open(self.answers_file_path) as fin:
+        answers_file_path = os.path.join(
+            self.clone_path, answers_file or self.answers_file)
+        with open(answers_file_path) as fin:
             y = yaml.safe_load(fin.read())
         y['_template_version'] = y.pop('_commit')
         y.pop('_src_path')
+        # so an incremental render can tell the answers haven't changed. a
+        # hash left over from an earlier render could vouch for answers the
+        # files weren't rendered with
+        if self.incremental_render:
+            y[ANSWERS_HASH_KEY] = answers_hash(y)
+        else:
+            y.pop(ANSWERS_HASH_KEY, None)
 
         # support multi-line yaml w/the function at the top of this file
         yaml.add_representer(str, string_representer)
 
-        with open(self.answers_file_path, 'w') as fout:
+        with open(answers_file_path, 'w') as fout:
             yaml.dump(y, fout)
 
+    def outdated_companions(self):
+        # the other templates whose answers file is behind their head
+        outdated = list()
+        for template, answers_file in self.companions:
+            version = self.answers_version(answers_file)
+            if not template.head.startswith(version):
+                outdated.append(template.name)
+        return outdated
+
+    @traced('plan_render')
+    def plan_render(self):
+        with open(self.answers_file_path) as fin:
+            answers = yaml.safe_load(fin.read()) or {}
+        since = answers.get('_template_version')
+        plan = RenderPlan(self.template, answers, self.answers_file)
+        plan.plan(since)
+        if plan.full:
+            self.logger.info(f'rendering every file: {plan.reason}')
+        else:
+            self.logger.info(f'rendering {len(plan.paths)} files changed '
+                             f'since {since}')
+        return plan
+
     def post_clone_hook(self):
         self.run_hook('post-clone')
 
@@ -181,6 +361,7 @@ class Repository(BaseRepo):
     def onboard(self):
         self.update(operation='onboarding')
 
+    @traced('open_pull_request')
     def open_pull_request(self):
         if self.fixing:
             # pr should already exist; just find it
@@ -193,17 +374,53 @@ class Repository(BaseRepo):
             head = self.update_branch_name
             base = self.base_branch
 
-            self.logger.debug(f'open PR to merge {head} into {base}')
-            if self.dry_run:
-                return
-            pr = self.github.create_pull(
-                 title=title, body=body, head=head, base=base)
+            pr = None
+            if self.reuse_pr:
+                pr = self.find_pull_request(head, base)
+            if pr is not None:
+                self.logger.debug(f'update PR #{pr.number} in place')
+                if self.dry_run:
+                    return
+                pr.edit(title=title, body=body)
+            else:
+                self.logger.debug(f'open PR to merge {head} into {base}')
+                if self.dry_run:
+                    return
+                pr = self.github.create_pull(
+                     title=title, body=body, head=head, base=base)
+                metrics.count('pull_requests_opened')
+        self.pr_url = pr.html_url
         log_or_print(self.logger, pr.html_url)
 
+    @traced('publish')
+    def publish(self):
+        if self.template.is_superseded():
+            raise RunSupersededError(
+                f'template moved from {self.template.pinned_head} to '
+                f'{self.template.superseded_by}; leaving it to a newer run')
+
+        self.pre_push_hook()
+        if not self.fixing:
+            self.clean_stale_branches()
+        self.push_changes()
+        self.open_pull_request()
+        self.post_push_hook()
+        if not self.dry_run:
+            self.outcome = 'pushed'
+
+        self.logger.info(f'{self.name} complete')
+
+    @traced('push_changes')
     def push_changes(self):
         self.logger.debug(f'push changes with message\n{self.commit_message}')
         if self.dry_run:
             return
+        if self.reuse_pr and not self.fixing:
+            # the fresh render replaces whatever is on the reused branch
+            self.git_cmd('add', '-A')
+            self.git_cmd('commit', '-m', self.commit_message)
+            self.git_cmd('push', '--force', 'origin', self.update_branch_name)
+            return
         self.git_cmd('push', 'origin', self.update_branch_name)
         self.git_cmd('remote', 'set-branches', 'origin',
                      self.update_branch_name)
@@ -215,27 +432,84 @@ class Repository(BaseRepo):
         self.git_cmd('commit', '-m', self.commit_message)
         self.git_cmd('push')
 
-    def run_copier(self):
+    @traced('render')
+    def render(self, operation='updating'):
+        # everything up to (but not including) pushing; returns whether
+        # there's anything to publish
+        self.operation = operation
+        self.outcome = None
+
+        self.logger.info(f'{operation} {self.name}...')
+
+        # switching now means needs_update, the branch name and copier all
+        # go by the head of the repo's own ref
+        self.template = self.template.at_ref(self.template_ref)
+        self.pre_clone_hook()
+        self.clone()
+        self.post_clone_hook()
+        self.select_companions()
+
+        self.switch_to_update_branch()
+        self.pre_copier_hook()
+        if self.updating and not self.needs_update:
+            self.outcome = 'skipped'
+            return False
+        exclude = ()
+        if self.incremental_render and not self.onboarding:
+            plan = self.plan_render()
+            if plan.skip and not self.outdated_companions():
+                self.logger.info('SKIP: nothing the template changed is '
+                                 'rendered for this repo')
+                self.outcome = 'skipped'
+                return False
+            exclude = plan.exclude()
+            if not plan.full:
+                self.render_plan = plan
+        self.run_copier(exclude=exclude)
+        for template, answers_file in self.companions:
+            self.run_copier(template, answers_file)
+        self.post_copier_hook()
+        self.manifest = self.build_manifest()
+        if not self.confirm_changes():
+            self.outcome = 'unchanged'
+            return False
+        self.outcome = 'rendered'
+        return True
+
+    @traced('run_copier')
+    def run_copier(self, template=None, answers_file=None, exclude=()):
+        # renders this repo's template, or one of its companions; exclude
+        # leaves files out of the render
+        template = template or self.template
+        answers_file = answers_file or self.answers_file
+        # answers given up front are for this repo's own template
+        data = self.answers if template is self.template else {}
         force = not self.interactive
         if self.interactive:
             quiet = False
         else:
             quiet = not self.dry_run
 
-        self.template.clone()
+        template.clone()
         # this is a no-op if it's already been cloned
 
+        # copier brings jinja2, plumbum and pydantic along with it, so only
+        # import it once there's actually something to render
+        from copier import copy
+
         self.logger.debug(f'''running copier to apply template...
 
-copy({self.template.clone_path}, {self.clone_path},
-answers_file={self.answers_file}, force={force}, quiet={quiet},
-vcs_ref={self.template.vcs_ref})''')
+copy({template.clone_path}, {self.clone_path},
+answers_file={answers_file}, force={force}, quiet={quiet},
+vcs_ref={template.vcs_ref}, data={data}, exclude={exclude})''')
 
-        copy(self.template.clone_path, self.clone_path,
-             answers_file=self.answers_file,
-             force=force, quiet=quiet, vcs_ref=self.template.vcs_ref)
+        with COPIER_LOCK:
+            copy(template.clone_path, self.clone_path,
+                 answers_file=answers_file,
+                 force=force, quiet=quiet, vcs_ref=template.vcs_ref,
+                 data=data, exclude=exclude)
 
-        self.munge_answers()
+        self.munge_answers(answers_file)
         self.logger.debug('copier done')
 
     def run_hook(self, hook_name):
@@ -246,13 +520,31 @@ vcs_ref={self.template.vcs_ref})''')
                 self.operation, self.clone_root, self.name, self.answers_file]
         self.logger.info(
             f'running {hook_name} hook: {hook} {" ".join(args[1:])}')
-        res = subprocess.run(args, capture_output=True)
-        if res.returncode != 0:
+        with tracer.span(f'hook:{hook_name}', **self.trace_attributes):
+            if self.template.hook_workers is not None:
+                returncode, stderr = self.template.hook_workers.run(
+                    args[0], hook_name, *args[1:])
+            else:
+                res = subprocess.run(args, capture_output=True)
+                returncode = res.returncode
+                stderr = res.stderr.decode("UTF-8")
+        if returncode != 0:
             raise HookFailure(
                 f'{hook_name} hook {hook} failed with exit code '
-                f'{res.returncode} stderr: "'
-                f'{res.stderr.decode("UTF-8").strip()}"')
-
+                f'{returncode} stderr: "{stderr.strip()}"')
+
+    def select_companions(self):
+        # a template only applies to repos that have its answers file
+        selected = list()
+        for template, answers_file in self.companions:
+            if os.path.exists(os.path.join(self.clone_path, answers_file)):
+                selected.append((template, answers_file))
+            else:
+                self.logger.debug(f'not applying {template.name}; no '
+                                  f'{answers_file}')
+        self.companions = selected
+
+    @traced('switch_to_update_branch')
     def switch_to_update_branch(self):
         if self.fixing:
             # we're already on the update branch
@@ -261,29 +553,7 @@ vcs_ref={self.template.vcs_ref})''')
         self.logger.debug(f'switch to update branch {self.update_branch_name}')
         self.git_cmd('checkout', '-b', self.update_branch_name)
 
+    @traced('update')
     def update(self, operation='updating'):
-        self.operation = operation
-
-        self.logger.info(f'{operation} {self.name}...')
-
-        self.pre_clone_hook()
-        self.clone()
-        self.post_clone_hook()
-
-        self.switch_to_update_branch()
-        self.pre_copier_hook()
-        if self.updating and not self.needs_update:
-            return
-        self.run_copier()
-        self.post_copier_hook()
-        if not self.confirm_changes():
-            return
-
-        self.pre_push_hook()
-        if not self.fixing:
-            self.clean_stale_branches()
-        self.push_changes()
-        self.open_pull_request()
-        self.post_push_hook()
-
-        self.logger.info(f'{self.name} complete')
+        if self.render(operation):
+            self.publish()
@@ -1,9 +1,25 @@
+import logging
 import os.path
+import re
+import threading
+from copy import copy
+from shutil import rmtree
+from time import monotonic
+
+from sh import ErrorReturnCode
 
 from filesync.config.template_config import TemplateConfig
 from filesync.exceptions import MissingRequiredConfigError, \
-                                TemplateConfigMissingError
+                                TemplateConfigMissingError, TemplateRefError
 from filesync.repo.base_repo import BaseRepo
+from filesync.tracing import traced
+
+# how often (in seconds) a pinned template asks GitHub whether its branch has
+# moved on; every check is an API call, and pushes happen a lot faster
+SUPERSEDED_CHECK_INTERVAL = 60
+
+# the abbreviated sha at the end of "git describe" output, e.g. v1.2.0-3-gabc1234
+DESCRIBED_SHA = re.compile(r'-g([0-9a-f]{4,40})$')
 
 
 class Template(BaseRepo):
@@ -15,10 +31,147 @@ class Template(BaseRepo):
                          interactive)
 
         self.operation = operation
+        self.hook_workers = None
+        self.pinned_head = None
+        self.superseded_by = None
+        self._superseded_checked_at = None
+        # the branch or tag a worktree view follows; None for the clone itself
+        self.ref = None
+        # worktree views of other refs, shared with every copy of this
+        # template so each ref is only checked out once
+        self.ref_views = dict()
+        self.ref_lock = threading.Lock()
+        # files changed between an earlier commit and the checked out one
+        self.changes = dict()
+        self.changes_lock = threading.Lock()
         self.clone()
         self.vcs_ref = None
         self.load_template_config(template_config)
 
+    @property
+    def head(self):
+        if self.pinned_head is not None:
+            return self.pinned_head
+        return super().head
+
+    @property
+    def checked_out_head(self):
+        # the commit the clone is at, pinned or not
+        return self.pinned_head or self.git_cmd('rev-parse', 'HEAD').strip()
+
+    @property
+    def live_head(self):
+        # where the branch is on GitHub right now, pinned or not
+        return super().head
+
+    @property
+    def trace_attributes(self):
+        return {'template': self.name}
+
+    @traced('add_worktree')
+    def add_worktree(self, ref):
+        path = os.path.join(self.clone_root,
+                            f'{self.name}@{ref.replace("/", "_")}')
+        if os.path.exists(path):
+            # left over from a run that didn't clean up
+            rmtree(path)
+            self.git_cmd('worktree', 'prune')
+        try:
+            self.git_cmd('fetch', '--depth', '1', 'origin', ref)
+            head = self.git_cmd('rev-parse', 'FETCH_HEAD').strip()
+            self.git_cmd('worktree', 'add', '-B', ref, path, head)
+        except ErrorReturnCode as error:
+            raise TemplateRefError(
+                f"can't check out {self.name} at {ref}: "
+                f'{error.stderr.decode(errors="replace").strip()}')
+        view = copy(self)
+        view.logger = logging.getLogger(f'Template({self.name}@{ref})')
+        view.clone_path = path
+        view._base_branch = ref
+        view._branches = None
+        view.vcs_ref = ref
+        view.ref = ref
+        view.pinned_head = head
+        view.superseded_by = None
+        self.logger.info(f'checked out {ref} at {head} in {path}')
+        return view
+
+    def at_ref(self, ref):
+        # the template as of another branch or tag, for repos that have to
+        # stay on it. each ref is a worktree of this clone, made the first
+        # time a repo asks for it
+        if ref is None or ref == self.base_branch:
+            return self
+        with self.ref_lock:
+            view = self.ref_views.get(ref)
+            if view is None:
+                view = self.ref_views[ref] = self.add_worktree(ref)
+        return view
+
+    def changed_files(self, since):
+        # template files added, changed or removed since an earlier commit
+        # (a full sha), or None if that commit can't be fetched. diffing only
+        # needs the two commits' trees, so the clone can stay shallow
+        key = (self.checked_out_head, since)
+        with self.changes_lock:
+            if key not in self.changes:
+                self.changes[key] = self.diff_since(since)
+            return self.changes[key]
+
+    @traced('diff_template')
+    def diff_since(self, since):
+        try:
+            self.git_cmd('fetch', '--depth', '1', 'origin', since)
+            output = self.git_cmd('diff', '--name-only', '--no-renames',
+                                  since, self.checked_out_head)
+        except ErrorReturnCode as error:
+            self.logger.warning(
+                f"can't diff against {since}: "
+                f'{error.stderr.decode(errors="replace").strip()}')
+            return None
+        return [line for line in str(output).split('\n') if line]
+
+    def file_at(self, commit, path):
+        # a file's content as of an earlier commit, or None if it wasn't there
+        try:
+            return str(self.git_cmd('show', f'{commit}:{path}'))
+        except ErrorReturnCode:
+            return None
+
+    def resolve_commit(self, version):
+        # copier records versions with "git describe --tags --always": a tag,
+        # an abbreviated sha, or tag-N-g<sha>. a shallow fetch needs the full
+        # sha, which GitHub can tell us without fetching any history
+        from github import GithubException
+
+        match = DESCRIBED_SHA.search(version)
+        ref = match.group(1) if match else version
+        try:
+            return self.github.get_commit(ref).sha
+        except GithubException as error:
+            self.logger.warning(f"can't find {version} in {self.name}: "
+                                f'{error}')
+            return None
+
+    def is_superseded(self):
+        # True once the template branch has moved past the pinned commit,
+        # meaning a newer run will redo whatever this one would push. views
+        # of other refs aren't what the run was started for
+        if self.pinned_head is None or self.ref is not None:
+            return False
+        if self.superseded_by is not None:
+            return True
+        now = monotonic()
+        if self._superseded_checked_at is not None and \
+           now - self._superseded_checked_at < SUPERSEDED_CHECK_INTERVAL:
+            return False
+        self._superseded_checked_at = now
+        live_head = self.live_head
+        if live_head != self.pinned_head:
+            self.superseded_by = live_head
+            return True
+        return False
+
     def load_template_config(self, template_config):
         config_path = os.path.join(self.clone_path, template_config)
         if not os.path.exists(config_path):
@@ -34,6 +187,12 @@ class Template(BaseRepo):
         self.config.log_config()
         self.maybe_switch_branch()
 
+    def pin_head(self):
+        # use the commit that was actually cloned for the whole run, rather
+        # than asking GitHub (and maybe getting a newer answer) every time
+        self.pinned_head = self.git_cmd('rev-parse', 'HEAD').strip()
+        self.logger.info(f'pinned template head: {self.pinned_head}')
+
     def validate_template_config(self):
         self.logger.debug('validating template config...')
         if self.config.org is None:
@@ -0,0 +1,80 @@
+import logging
+import re
+from time import sleep
+
+from sh import ErrorReturnCode
+
+# git commands that talk to GitHub, and so can fail for reasons that go away
+NETWORK_COMMANDS = ['clone', 'fetch', 'pull', 'push', 'ls-remote']
+
+# what git says when the network, rather than the request, was the problem
+TRANSIENT_GIT_ERRORS = re.compile(
+    r'could not resolve host|connection (reset|refused|timed out)|'
+    r'operation timed out|early eof|the remote end hung up|'
+    r'rpc failed|http 5\d\d|error: 5\d\d|'
+    r'internal server error|service unavailable|bad gateway|'
+    r'temporarily unavailable|tls connection',
+    re.IGNORECASE)
+
+# API responses worth asking again for
+RETRY_STATUSES = [500, 502, 503, 504]
+
+DEFAULT_RETRIES = 3
+
+# seconds before the first retry
+DEFAULT_BACKOFF = 2
+
+
+class RetryPolicy(object):
+    # how many times to retry transient git and GitHub API failures, waiting
+    # backoff, 2 * backoff, 4 * backoff... seconds in between
+    def __init__(self):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.configure()
+
+    def configure(self, retries=None, backoff=None):
+        self.retries = DEFAULT_RETRIES if retries is None else retries
+        self.backoff = DEFAULT_BACKOFF if backoff is None else backoff
+
+    def delay(self, attempt):
+        return self.backoff * 2 ** attempt
+
+    def github_retry(self):
+        # PyGithub retries through urllib3; newer releases come with a Retry
+        # that also waits out secondary rate limits, so use it when we can
+        try:
+            from github import GithubRetry as Retry
+        except ImportError:
+            from urllib3.util.retry import Retry
+        return Retry(total=self.retries, backoff_factor=self.backoff,
+                     status_forcelist=RETRY_STATUSES)
+
+    def is_transient(self, cmd, error):
+        if cmd not in NETWORK_COMMANDS:
+            return False
+        stderr = getattr(error, 'stderr', b'') or b''
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode(errors='replace')
+        return TRANSIENT_GIT_ERRORS.search(stderr) is not None
+
+    def run_git(self, cmd, run, before_retry=None):
+        # run() runs the git command; before_retry() tidies up after a
+        # failed attempt
+        attempt = 0
+        while True:
+            try:
+                return run()
+            except ErrorReturnCode as error:
+                if attempt >= self.retries or \
+                   not self.is_transient(cmd, error):
+                    raise
+                delay = self.delay(attempt)
+                self.logger.warning(f'git {cmd} failed; retrying in {delay}s '
+                                    f'({attempt + 1}/{self.retries})')
+                sleep(delay)
+                attempt += 1
+                if before_retry is not None:
+                    before_retry()
+
+
+retry_policy = RetryPolicy()
@@ -0,0 +1,44 @@
+import fcntl
+import logging
+import os.path
+from os import makedirs
+
+
+class RunLock(object):
+    # one run per template at a time; whoever holds the lock also records
+    # the last template commit a run finished with, so runs that queued up
+    # behind it can tell when there's nothing left for them to do
+    def __init__(self, lock_dir, name):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        makedirs(lock_dir, exist_ok=True)
+        self.lock_path = os.path.join(lock_dir, f'{name}.lock')
+        self.done_path = os.path.join(lock_dir, f'{name}.done')
+        self.lock_file = None
+
+    def acquire(self):
+        self.lock_file = open(self.lock_path, 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.logger.info(f'waiting for another run to release '
+                             f'{self.lock_path}...')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        self.logger.debug(f'acquired {self.lock_path}')
+
+    @property
+    def last_done(self):
+        if not os.path.exists(self.done_path):
+            return None
+        with open(self.done_path) as fin:
+            return fin.read().strip() or None
+
+    def release(self):
+        if self.lock_file is None:
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+        self.lock_file = None
+
+    def mark_done(self, head):
+        with open(self.done_path, 'w') as fout:
+            fout.write(f'{head}\n')
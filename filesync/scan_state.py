@@ -0,0 +1,65 @@
+import json
+import logging
+import os.path
+from datetime import datetime, timezone
+from os import makedirs
+
+
+def as_utc(timestamp):
+    # PyGithub hands back naive datetimes (which are UTC) in older releases
+    # and aware ones in newer releases; compare everything as aware UTC
+    if timestamp is None:
+        return None
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+class ScanState(object):
+    # remembers the result of the last autoscan and how far it got, so the
+    # next scan only has to look at repos that were pushed to since then
+    def __init__(self, path, fingerprint):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.fingerprint = fingerprint
+        self.high_water_mark = None
+        self.repos = list()
+        self.load()
+
+    def is_stale(self, repo):
+        # True when the repo hasn't been pushed to since the last scan.
+        # repos are listed newest push first, so the first stale repo means
+        # every repo after it is stale too
+        if self.high_water_mark is None:
+            return False
+        pushed_at = as_utc(repo.pushed_at)
+        if pushed_at is None:
+            return False
+        return pushed_at < self.high_water_mark
+
+    def load(self):
+        if not os.path.exists(self.path):
+            self.logger.debug(f'no previous autoscan state at {self.path}')
+            return
+        with open(self.path) as fin:
+            state = json.load(fin)
+        if state.get('fingerprint') != self.fingerprint:
+            # the org or answers file config changed, so the last result
+            # doesn't describe the same set of repos anymore
+            self.logger.info('autoscan config changed; doing a full scan')
+            return
+        self.high_water_mark = datetime.fromisoformat(state['high_water_mark'])
+        self.repos = state.get('repos', [])
+
+    def save(self, high_water_mark, repos):
+        makedirs(os.path.dirname(self.path), exist_ok=True)
+        state = {
+            'fingerprint': self.fingerprint,
+            'high_water_mark': as_utc(high_water_mark).isoformat(),
+            'repos': sorted(repos),
+        }
+        # write then rename so an interrupted run can't leave half a file
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as fout:
+            json.dump(state, fout, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,64 @@
+import re
+from datetime import datetime, timezone
+from statistics import median
+from time import monotonic
+
+# what a repo with no recorded runs is expected to take, in seconds, when
+# no repo has any
+DEFAULT_DURATION = 60
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def parse_duration(text):
+    # "45m", "1h30m", "90s" or a plain number of seconds
+    text = str(text).strip()
+    if re.fullmatch(r'\d+(\.\d+)?', text):
+        return float(text)
+    parts = re.findall(r'(\d+(?:\.\d+)?)([hms])', text)
+    if not parts or ''.join(number + unit for number, unit in parts) != text:
+        raise ValueError(f'unrecognized duration "{text}"; expected '
+                         'something like 45m, 1h30m or 90s')
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def format_duration(seconds):
+    minutes = round(seconds / 60)
+    if minutes < 60:
+        return f'{minutes}m'
+    return f'{minutes // 60}h{minutes % 60:02d}m'
+
+
+class Schedule(object):
+    # orders a run's repos by how badly they need syncing, and says when
+    # starting another one would run past the time budget
+    def __init__(self, budget, durations, started=None):
+        self.budget = budget
+        # seconds each repo is expected to take, going by recent runs
+        self.durations = durations
+        self.default = median(durations.values()) if durations else \
+            DEFAULT_DURATION
+        self.started = monotonic() if started is None else started
+
+    @property
+    def elapsed(self):
+        return monotonic() - self.started
+
+    def fits(self, repo):
+        return self.elapsed + self.projected(repo) <= self.budget
+
+    def order(self, specs, behind, last_synced):
+        # explicit priority first, then the most template commits behind
+        # (unknown counts as furthest), then the longest since the last
+        # sync (never counts as longest)
+        never = datetime.min.replace(tzinfo=timezone.utc)
+
+        def key(spec):
+            commits = behind.get(spec.listed_name)
+            return (-(spec.priority or 0),
+                    -(float('inf') if commits is None else commits),
+                    last_synced.get(spec.listed_name) or never)
+        return sorted(specs, key=key)
+
+    def projected(self, repo):
+        return self.durations.get(repo, self.default)
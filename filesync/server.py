@@ -0,0 +1,254 @@
+import contextvars
+import json
+import logging
+import os
+import os.path
+import socketserver
+import threading
+from collections import defaultdict
+from copy import copy
+from itertools import count
+from os import environ, makedirs
+from shutil import rmtree
+
+from filesync.job_context import job_context
+
+# FileSync options a client may set for its job; everything else (where to
+# clone, where state lives, which token to use) belongs to the server
+JOB_OPTIONS = ['template', 'template_branch', 'template_config', 'dry_run',
+               'log_level']
+
+COMMANDS = ['update', 'fix', 'fix_all', 'onboard', 'onboard_all']
+
+
+class JobLogHandler(logging.Handler):
+    # sends each job's log records back to the client that asked for it.
+    # the job's context says which job a record is for, including in the
+    # threads it works on several repos with
+    def __init__(self):
+        super().__init__()
+        self.target = contextvars.ContextVar('job_log_target', default=None)
+        self.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)-8s - %(name)s: %(message)s',
+            '%Y-%m-%d %H:%M:%S'))
+
+    def attach(self, stream, level):
+        self.target.set((stream, level))
+
+    def detach(self):
+        self.target.set(None)
+
+    def emit(self, record):
+        target = self.target.get()
+        if target is None or record.levelno < target[1]:
+            return
+        send(target[0], {'log': self.format(record)})
+
+
+class TemplateCache(object):
+    # one clone of each template commit, shared by every job that syncs it.
+    # jobs get their own shallow copy, so per-run state (pinned head, hook
+    # workers) isn't shared; the clone and its config are
+    def __init__(self, root):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.root = root
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.templates = dict()
+        self.users = defaultdict(int)
+        self.retired = set()
+
+    def get(self, filesync, name):
+        key = (name, filesync.config.template_branch,
+               filesync.config.template_config)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is not None and \
+               template.live_head != template.pinned_head:
+                self.logger.info(f'{name} moved on from '
+                                 f'{template.pinned_head}; cloning it again')
+                self.retire(template)
+                template = None
+            if template is None:
+                clone_root = os.path.join(self.root, str(next(self.ids)))
+                template = filesync.build_template(name, clone_root)
+                template.pin_head()
+                self.templates[key] = template
+            self.users[template.clone_root] += 1
+        job_template = copy(template)
+        job_template.operation = filesync.config.operation
+        job_template.hook_workers = None
+        job_template.superseded_by = None
+        job_template._superseded_checked_at = None
+        return job_template
+
+    def release(self, template):
+        with self.lock:
+            self.users[template.clone_root] -= 1
+            self.maybe_remove(template.clone_root)
+
+    def maybe_remove(self, clone_root):
+        if clone_root in self.retired and self.users[clone_root] <= 0:
+            rmtree(clone_root, ignore_errors=True)
+            self.retired.discard(clone_root)
+            del self.users[clone_root]
+
+    def retire(self, template):
+        # jobs still using the old commit keep its clone until they finish
+        self.retired.add(template.clone_root)
+        self.maybe_remove(template.clone_root)
+
+
+class Server(object):
+    # keeps what every run would otherwise set up from scratch (the GitHub
+    # session, org handles, template clones) and runs update, fix and
+    # onboard jobs sent over a Unix socket, several at a time
+    def __init__(self, socket_path, clone_root, state_dir,
+                 token_variable_name='GITHUB_TOKEN', max_jobs=4):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.socket_path = socket_path
+        self.clone_root = clone_root
+        self.state_dir = state_dir
+        self.token_variable_name = token_variable_name
+        self.job_ids = count(1)
+        self.job_slots = threading.BoundedSemaphore(max_jobs)
+        self.lock = threading.Lock()
+        self.github = None
+        self.organizations = dict()
+        self.repo_locks = defaultdict(threading.Lock)
+        self.templates = TemplateCache(os.path.join(clone_root, 'templates'))
+        self.log_handler = JobLogHandler()
+        self.server = None
+
+    def build_filesync(self, job_id, options):
+        from filesync.filesync import FileSync
+
+        kwargs = {key: options.get(key) for key in JOB_OPTIONS}
+        filesync = FileSync(
+            autoclean=True,
+            clone_root=os.path.join(self.clone_root, 'jobs', str(job_id)),
+            state_dir=self.state_dir,
+            token_variable_name=self.token_variable_name,
+            interactive=False, **kwargs)
+        with self.lock:
+            # every job shares one session
+            if self.github is None:
+                from github import Github
+
+                from filesync.retry import retry_policy
+
+                # retrying and backing off the way FileSync.start() would
+                # have, since it won't build a session of its own
+                retry_policy.configure(filesync.config.retries,
+                                       filesync.config.retry_backoff)
+                self.github = Github(environ.get(self.token_variable_name),
+                                     retry=retry_policy.github_retry())
+        filesync.github = self.github
+        filesync.organizations = self.organizations
+        filesync.template_cache = self.templates
+        filesync.repo_locks = self.repo_locks
+        return filesync
+
+    def handle(self, request, stream):
+        job_id = next(self.job_ids)
+        command = request.get('command')
+        if command not in COMMANDS:
+            send(stream, {'log': f'unknown command "{command}"', 'exit': 2})
+            return
+        options = request.get('options') or {}
+        level = logging.getLevelName((options.get('log_level') or 'info')
+                                     .upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+        self.log_handler.attach(stream, level)
+        try:
+            if not self.job_slots.acquire(blocking=False):
+                self.logger.info('waiting for a free job slot')
+                self.job_slots.acquire()
+            try:
+                # jobs running side by side each keep their own spans, API
+                # calls and metrics, which go away with the job
+                with job_context():
+                    returncode = self.run_job(job_id, command, options,
+                                              request.get('args') or {})
+            finally:
+                self.job_slots.release()
+        finally:
+            self.log_handler.detach()
+        send(stream, {'exit': returncode})
+
+    def run_job(self, job_id, command, options, args):
+        self.logger.info(f'job {job_id}: {command} {options.get("template")} '
+                         f'{json.dumps(args)}')
+        filesync = None
+        try:
+            filesync = self.build_filesync(job_id, options)
+            getattr(filesync, command)(**args)
+            return 0
+        except SystemExit as error:
+            # FileSync.die() exits; that ends the job, not the server
+            return error.code if isinstance(error.code, int) else 1
+        except Exception as error:
+            self.logger.exception(f'job {job_id} failed: {error}')
+            return 1
+        finally:
+            if filesync is not None and filesync.template is not None:
+                self.templates.release(filesync.template)
+
+    def serve_forever(self):
+        self.setup_logging()
+        makedirs(self.clone_root, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = ThreadingServer(self.socket_path, JobRequestHandler)
+        self.server.filesync_server = self
+        # only this user may send jobs; they run with the server's token
+        os.chmod(self.socket_path, 0o600)
+        self.logger.info(f'listening on {self.socket_path}')
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socket_path)
+
+    def setup_logging(self):
+        root = logging.getLogger()
+        # let everything through to the job handler, which filters by each
+        # job's own level; the console keeps the server's level
+        for handler in root.handlers:
+            handler.setLevel(root.level)
+        root.setLevel(logging.DEBUG)
+        root.addHandler(self.log_handler)
+        for dependency in ['github', 'plumbum', 'sh', 'urllib3']:
+            logging.getLogger(dependency).setLevel(logging.WARNING)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+        except ValueError:
+            send(self.wfile, {'log': 'unreadable job', 'exit': 2})
+            return
+        self.server.filesync_server.handle(request, self.wfile)
+
+
+class ThreadingServer(socketserver.ThreadingMixIn,
+                      socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def send(stream, message):
+    try:
+        stream.write((json.dumps(message) + '\n').encode())
+        stream.flush()
+    except (BrokenPipeError, ConnectionResetError, ValueError):
+        # the client went away; the job carries on regardless
+        pass
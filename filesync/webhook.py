@@ -0,0 +1,243 @@
+import hashlib
+import hmac
+import json
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from filesync.api_stats import api_stats
+from filesync.git_trace import git_trace
+from filesync.metrics import metrics
+from filesync.tracing import tracer
+
+# GitHub never sends payloads bigger than this
+MAX_PAYLOAD = 25 * 1024 * 1024
+
+# a push event lists at most this many of the push's commits
+PAYLOAD_COMMITS = 20
+
+TEMPLATE_JOB = ('template',)
+
+
+def changed_files(payload):
+    files = set()
+    for commit in payload.get('commits') or []:
+        for kind in ['added', 'modified', 'removed']:
+            files.update(commit.get(kind) or [])
+    return files
+
+
+def verify_signature(secret, body, signature):
+    if not signature or not signature.startswith('sha256='):
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f'sha256={expected}', signature)
+
+
+class JobQueue(object):
+    # a bounded queue of jobs that drops a job that's already waiting, so a
+    # burst of pushes to one repo becomes a single run
+    def __init__(self, size):
+        self.size = size
+        self.jobs = deque()
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def get(self):
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+            return self.jobs.popleft()
+
+    def put(self, job):
+        with self.condition:
+            if job in self.jobs:
+                return 'duplicate'
+            if len(self.jobs) >= self.size:
+                return 'full'
+            self.jobs.append(job)
+            self.condition.notify()
+            return 'queued'
+
+
+class WebhookReceiver(object):
+    # turns GitHub push events into work: a push to the template's branch
+    # becomes a coalesced run for every repo, a push that changes a repo's
+    # answers file becomes a run for just that repo
+    def __init__(self, filesync, secret, host, port, queue_size=100,
+                 quiet_period=120):
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.filesync = filesync
+        self.secret = secret
+        self.address = (host, port)
+        self.quiet_period = quiet_period
+        self.queue = JobQueue(queue_size)
+        self.server = None
+
+    def answers_paths(self, name):
+        config = self.filesync.template.config
+        kwargs = config.repos.get(name) or {}
+        paths = {kwargs.get('answers-file') or kwargs.get('answers_file') or
+                 config.answers_file}
+        paths.update(config.old_answers_files or [])
+        return paths
+
+    def event(self, name, payload):
+        # returns the job an event calls for, or why it doesn't need one
+        if name == 'ping':
+            return None, 'pong'
+        if name != 'push':
+            # merges show up as pushes to the default branch; the other
+            # events GitHub may be set up to send don't change anything
+            return None, f'ignoring {name} event'
+        repo = payload.get('repository') or {}
+        full_name = repo.get('full_name', '')
+        branch = payload.get('ref', '').replace('refs/heads/', '', 1)
+        if payload.get('deleted'):
+            return None, 'ignoring deleted branch'
+
+        template = self.filesync.template
+        if full_name == template.github.full_name:
+            if branch != template.base_branch:
+                return None, f'ignoring push to template branch {branch}'
+            return TEMPLATE_JOB, None
+
+        if branch != repo.get('default_branch'):
+            return None, f'ignoring push to {full_name} branch {branch}'
+        managed_name = self.managed_name(repo)
+        if managed_name is None:
+            return None, f'{full_name} is not managed by this template'
+        files = self.pushed_files(payload)
+        if files is not None and not self.answers_paths(managed_name) & files:
+            return None, f"push to {full_name} didn't change its answers"
+        return ('repo', managed_name), None
+
+    def handle(self, name, body, signature):
+        # returns the HTTP status and message to answer the delivery with
+        if not verify_signature(self.secret, body, signature):
+            return 401, 'bad signature'
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, 'unreadable payload'
+        job, reason = self.event(name, payload)
+        if job is None:
+            self.logger.debug(reason)
+            return 200, reason
+        result = self.queue.put(job)
+        if result == 'full':
+            self.logger.warning(f'dropping {job}; {len(self.queue)} jobs are '
+                                'already waiting')
+            return 503, 'too many jobs waiting'
+        self.logger.info(f'{result} {job}')
+        return 202, result
+
+    def managed_name(self, repo):
+        # the name the template knows the repo by, or None if it doesn't
+        # manage it
+        config = self.filesync.template.config
+        full_name = repo.get('full_name', '')
+        name = repo.get('name')
+        for candidate in [full_name, name]:
+            if candidate in config.repos:
+                return candidate
+        if not config.autoscan or repo.get('fork') or repo.get('archived'):
+            return None
+        org = (repo.get('owner') or {}).get('login')
+        if org != config.org or self.filesync.is_excluded(name):
+            return None
+        return name
+
+    def pushed_files(self, payload):
+        # the files a push changed, or None if there's no telling
+        commits = payload.get('commits') or []
+        if len(commits) < PAYLOAD_COMMITS:
+            return changed_files(payload)
+        # the payload may have left some commits out, but comparing the
+        # push's ends covers all of them
+        from github import GithubException
+
+        full_name = payload['repository']['full_name']
+        try:
+            comparison = self.filesync.github.get_repo(full_name).compare(
+                payload['before'], payload['after'])
+            files = set()
+            for file in comparison.files:
+                files.add(file.filename)
+                if file.previous_filename:
+                    files.add(file.previous_filename)
+            return files
+        except (GithubException, KeyError) as error:
+            self.logger.warning(f"can't compare {full_name}'s push; assuming "
+                                f'it changed the answers: {error}')
+            return None
+
+    def run_job(self, job):
+        run = self.filesync.new_run()
+        try:
+            if job == TEMPLATE_JOB:
+                run.update(quiet_period=self.quiet_period)
+            else:
+                # the answers changed, not the template, so the repo may be
+                # at the template head already
+                run.update(single_repo=job[1], answers_changed=True)
+        except SystemExit:
+            # FileSync.die() exits; that ends the job, not the receiver
+            self.logger.error(f'{job} failed')
+        except Exception as error:
+            self.logger.exception(f'{job} failed: {error}')
+        # spans and API calls would otherwise pile up for as long as the
+        # receiver runs
+        tracer.reset()
+        api_stats.reset()
+        git_trace.reset()
+        metrics.reset()
+        if job == TEMPLATE_JOB:
+            # pick up any changes to the template's own config
+            self.filesync.refresh_template()
+
+    def serve_forever(self):
+        worker = threading.Thread(target=self.work, daemon=True)
+        worker.start()
+        self.server = ThreadingHTTPServer(self.address, WebhookRequestHandler)
+        self.server.receiver = self
+        self.logger.info(f'listening on {self.address[0]}:{self.address[1]}')
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def work(self):
+        while True:
+            self.run_job(self.queue.get())
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_PAYLOAD:
+            self.respond(413, 'payload too large')
+            return
+        body = self.rfile.read(length)
+        status, message = self.server.receiver.handle(
+            self.headers.get('X-GitHub-Event'), body,
+            self.headers.get('X-Hub-Signature-256'))
+        self.respond(status, message)
+
+    def log_message(self, format, *args):
+        self.server.receiver.logger.debug(format % args)
+
+    def respond(self, status, message):
+        body = f'{message}\n'.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
@@ -21,6 +21,7 @@ if __name__ == "__main__":
         description="sync templated common files across repos",
         install_requires=REQS,
         entry_points={
-            'console_scripts': ['filesync = filesync.cli:main'],
+            'console_scripts': ['filesync = filesync.cli:main',
+                                'filesync-serve = filesync.cli:serve'],
         }
     )
@@ -0,0 +1,175 @@
+"""
+Test api_stats.py
+"""
+
+import json
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync.api_stats import ApiStats, endpoint_template, percentile
+from filesync.tracing import tracer
+
+
+class TestEndpointTemplate(TestCase):
+    """
+    Test endpoint_template()
+    """
+
+    def test_repo_paths(self):
+        """
+        Test endpoint_template() replaces owners, repos and values
+        """
+
+        cases = {
+            "/repos/mezmo/foo": "/repos/{owner}/{repo}",
+            "/repos/mezmo/foo/contents/a/b.yml?ref=main":
+                "/repos/{owner}/{repo}/contents/{path}",
+            "/repos/mezmo/foo/branches/filesync/tpl/abc":
+                "/repos/{owner}/{repo}/branches/{branch}",
+            "/repos/mezmo/foo/git/refs/heads/main":
+                "/repos/{owner}/{repo}/git/refs/{ref}",
+            "/repos/mezmo/foo/git/refs": "/repos/{owner}/{repo}/git/refs",
+            "/repos/mezmo/foo/pulls/12/commits":
+                "/repos/{owner}/{repo}/pulls/{number}/commits",
+            "/repos/mezmo/foo/commits/" + "a" * 40:
+                "/repos/{owner}/{repo}/commits/{sha}",
+            "https://api.github.com/orgs/mezmo/repos?page=2":
+                "/orgs/{org}/repos",
+            "/api/v3/users/someone": "/users/{user}",
+            "/search/repositories?q=org:mezmo": "/search/repositories",
+            "/graphql": "/graphql",
+        }
+        for url, expected in cases.items():
+            self.assertEqual(endpoint_template(url), expected, url)
+
+    def test_percentile(self):
+        """
+        Test percentile() uses the nearest rank
+        """
+
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 0.5), 3)
+        self.assertEqual(percentile(values, 0.95), 5)
+        self.assertEqual(percentile([7], 0.5), 7)
+
+
+class TestApiStats(TestCase):
+    """
+    Test ApiStats
+    """
+
+    def setUp(self):
+        self.stats = ApiStats()
+        self.request_raw = MagicMock()
+        self.github = MagicMock()
+        requester = self.github._Github__requester
+        requester._filesync_api_stats = None
+        requester._Requester__requestRaw = self.request_raw
+
+    def request(self, verb, url):
+        """
+        Make a request the way PyGithub would
+        """
+
+        requester = self.github._Github__requester
+        return requester._Requester__requestRaw(None, verb, url, {}, None)
+
+    def test_instrument(self):
+        """
+        Test ApiStats.instrument() counts calls made through the requester
+        and labels them with the current span
+        """
+
+        self.request_raw.return_value = (
+            200, {"x-ratelimit-used": "10"}, b'{"name": "a"}')
+        self.stats.instrument(self.github)
+        # instrumenting twice mustn't count calls twice
+        self.stats.instrument(self.github)
+        with tracer.span("has_answersfile", repo="foo"):
+            result = self.request("GET", "/repos/mezmo/foo/contents/a.yml")
+        self.request_raw.return_value = (
+            304, {"x-ratelimit-used": "10"}, b"")
+        self.request("GET", "/repos/mezmo/foo/contents/a.yml")
+
+        self.assertEqual(result[0], 200)
+        self.assertEqual(self.request_raw.call_count, 2)
+        first, second = self.stats.calls
+        self.assertEqual(first.phase, "has_answersfile")
+        self.assertEqual(first.repo, "foo")
+        self.assertEqual(first.size, 13)
+        self.assertEqual(second.phase, "(none)")
+        self.assertIsNone(second.repo)
+        self.assertTrue(second.is_conditional_hit)
+        self.assertEqual(second.cost, 0)
+
+    def test_instrument_recorder(self):
+        """
+        Test ApiStats.instrument() records calls with the recorder it's given
+        """
+
+        self.request_raw.return_value = (200, {}, b"")
+        recorder = MagicMock()
+        self.stats.instrument(self.github, recorder)
+        self.request("GET", "/orgs/mezmo/repos")
+        recorder.record.assert_called_once()
+        self.assertEqual(self.stats.calls, [])
+
+    def test_rate_limit_cost(self):
+        """
+        Test ApiStats.rate_limit_cost() per resource and across windows
+        """
+
+        core = {"x-ratelimit-resource": "core", "x-ratelimit-used": "5"}
+        self.assertEqual(self.stats.rate_limit_cost(200, core), 1)
+        core["x-ratelimit-used"] = "7"
+        self.assertEqual(self.stats.rate_limit_cost(200, core), 2)
+        graphql = {"x-ratelimit-resource": "graphql",
+                   "x-ratelimit-used": "100"}
+        self.assertEqual(self.stats.rate_limit_cost(200, graphql), 1)
+        # a new window started
+        core["x-ratelimit-used"] = "1"
+        self.assertEqual(self.stats.rate_limit_cost(200, core), 1)
+        self.assertEqual(self.stats.rate_limit_cost(200, {}), 0)
+
+    def test_summary(self):
+        """
+        Test ApiStats.summary() groups by endpoint, phase and repo
+        """
+
+        for repo in ["foo", "foo", "bar"]:
+            with tracer.span("clone", repo=repo):
+                self.stats.record("GET", f"/repos/mezmo/{repo}", 200,
+                                  {}, b"1234", 0.5)
+        with tracer.span("fetch_repo_list"):
+            self.stats.record("GET", "/orgs/mezmo/repos", 200, {}, b"12", 1)
+
+        summary = self.stats.summary()
+        self.assertEqual(summary["calls"], 4)
+        self.assertEqual(summary["bytes"], 14)
+        self.assertEqual(
+            [(e["name"], e["calls"]) for e in summary["endpoints"]],
+            [("GET /repos/{owner}/{repo}", 3), ("GET /orgs/{org}/repos", 1)])
+        self.assertEqual(
+            [(p["name"], p["calls"]) for p in summary["phases"]],
+            [("clone", 3), ("fetch_repo_list", 1)])
+        self.assertEqual(
+            [(r["name"], r["calls"]) for r in summary["busiest_repos"]],
+            [("foo", 2), ("bar", 1)])
+        self.assertEqual(self.stats.repo_calls, {"foo": 2, "bar": 1})
+        self.assertEqual(summary["phase_endpoints"][0]["name"],
+                         "clone: GET /repos/{owner}/{repo}")
+
+    def test_write_report(self):
+        """
+        Test ApiStats.write_report() writes the summary as JSON
+        """
+
+        self.stats.record("POST", "/graphql", 200, {}, b"{}", 0.1)
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "api.json")
+            self.stats.write_report(path)
+            with open(path) as fin:
+                report = json.load(fin)
+        self.assertEqual(report["endpoints"][0]["name"], "POST /graphql")
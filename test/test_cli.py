@@ -2,12 +2,14 @@
 Test functions in cli.py
 """
 
+import os.path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import patch
 
 from click.testing import CliRunner
 
-from filesync.cli import main
+from filesync.cli import DEFAULT_CLONE_ROOT, main, serve
 
 
 class TestUpdate(TestCase):
@@ -21,7 +23,7 @@ class TestUpdate(TestCase):
     def setUpClass(cls):
         cls.runner = CliRunner()
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_update_valid(self, mock_filesync):
         """
         Test update() with no arguments
@@ -30,14 +32,214 @@ class TestUpdate(TestCase):
         self.runner.invoke(main, ["template", "update"])
         mock_filesync().update.assert_called()
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_update_one_repo(self, mock_filesync):
         """
         Test update() with no arguments
         """
 
         self.runner.invoke(main, ["template", "update", "-1", "single_repo"])
-        mock_filesync().update.assert_called_with("single_repo", None)
+        mock_filesync().update.assert_called_with(
+            "single_repo",
+            None,
+            incremental=False,
+            where=(),
+            quiet_period=None,
+            journal=None,
+            resume=None,
+            retry_failed=None,
+            with_templates=(),
+            incremental_render=False,
+            time_budget=None,
+        )
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_coalesce(self, mock_filesync):
+        """
+        Test update() with --coalesce
+        """
+
+        self.runner.invoke(
+            main, ["template", "update", "--coalesce", "--quiet-period", "5"]
+        )
+        mock_filesync().update.assert_called_with(
+            None, None, incremental=False, where=(), quiet_period=5,
+            journal=None, resume=None, retry_failed=None, with_templates=(),
+            incremental_render=False, time_budget=None
+        )
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_with_template(self, mock_filesync):
+        """
+        Test update() with --with-template
+        """
+
+        self.runner.invoke(
+            main, ["template", "update", "-T", "lint", "-T", "docs"]
+        )
+        mock_filesync().update.assert_called_with(
+            None, None, incremental=False, where=(), quiet_period=None,
+            journal=None, resume=None, retry_failed=None,
+            with_templates=("lint", "docs"), incremental_render=False,
+            time_budget=None
+        )
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_incremental_render(self, mock_filesync):
+        """
+        Test update() with --incremental-render
+        """
+
+        self.runner.invoke(main, ["template", "update", "--incremental-render"])
+        _, kwargs = mock_filesync().update.call_args
+        self.assertTrue(kwargs["incremental_render"])
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_time_budget(self, mock_filesync):
+        """
+        Test update() with --time-budget
+        """
+
+        self.runner.invoke(main, ["template", "update", "--time-budget",
+                                  "1h30m"])
+        _, kwargs = mock_filesync().update.call_args
+        self.assertEqual(kwargs["time_budget"], 5400)
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_time_budget_invalid(self, mock_filesync):
+        """
+        Test update() with a --time-budget that isn't a duration
+        """
+
+        res = self.runner.invoke(main, ["template", "update", "--time-budget",
+                                        "soon"])
+        self.assertEqual(res.exit_code, 2)
+        mock_filesync().update.assert_not_called()
+
+
+class TestUpdateJournal(TestCase):
+    """
+    Test update() with --resume and --retry-failed
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_resume(self, mock_filesync):
+        """
+        Test update() with --resume
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            journal = os.path.join(tmp_dir, "run.jsonl")
+            open(journal, "w").close()
+            self.runner.invoke(main, ["template", "update", "--resume",
+                                      journal])
+        mock_filesync().update.assert_called_with(
+            None, None, incremental=False, where=(), quiet_period=None,
+            journal=None, resume=journal, retry_failed=None,
+            with_templates=(), incremental_render=False, time_budget=None)
+
+    @patch("filesync.filesync.FileSync")
+    def test_update_resume_and_retry(self, mock_filesync):
+        """
+        Test update() with both --resume and --retry-failed
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            journal = os.path.join(tmp_dir, "run.jsonl")
+            open(journal, "w").close()
+            res = self.runner.invoke(main, ["template", "update", "--resume",
+                                            journal, "--retry-failed",
+                                            journal])
+        self.assertEqual(res.exit_code, 2)
+        mock_filesync().update.assert_not_called()
+
+
+class TestInventory(TestCase):
+    """
+    Test inventory() method
+
+    This is a wrapper method, so not much testing is needed
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.filesync.FileSync")
+    def test_inventory_valid(self, mock_filesync):
+        """
+        Test inventory() with a predicate
+        """
+
+        self.runner.invoke(main, ["template", "inventory", "-w", "a=b"])
+        mock_filesync().inventory.assert_called_with(("a=b",), refresh=True)
+
+    @patch("filesync.filesync.FileSync")
+    def test_inventory_cached(self, mock_filesync):
+        """
+        Test inventory() without refreshing
+        """
+
+        self.runner.invoke(main, ["template", "inventory", "--cached"])
+        mock_filesync().inventory.assert_called_with((), refresh=False)
+
+
+class TestDrift(TestCase):
+    """
+    Test drift() method
+
+    This is a wrapper method, so not much testing is needed
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.filesync.FileSync")
+    def test_drift(self, mock_filesync):
+        """
+        Test drift() with repos named
+        """
+
+        self.runner.invoke(main, ["template", "drift", "a", "org/b"])
+        mock_filesync().drift.assert_called_with(["a", "org/b"])
+
+
+class TestEstimate(TestCase):
+    """
+    Test estimate() method
+
+    This is a wrapper method, so not much testing is needed
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.filesync.FileSync")
+    def test_estimate(self, mock_filesync):
+        """
+        Test estimate() with its defaults
+        """
+
+        self.runner.invoke(main, ["template", "estimate"])
+        mock_filesync().estimate.assert_called_with(
+            None, where=(), jobs=1, window=3600, cached=False)
+
+    @patch("filesync.filesync.FileSync")
+    def test_estimate_options(self, mock_filesync):
+        """
+        Test estimate() with --jobs and --window
+        """
+
+        self.runner.invoke(main, ["template", "estimate", "-j", "8",
+                                  "--window", "30m", "--cached"])
+        mock_filesync().estimate.assert_called_with(
+            None, where=(), jobs=8, window=1800, cached=True)
 
 
 class TestOnboard(TestCase):
@@ -51,7 +253,7 @@ class TestOnboard(TestCase):
     def setUpClass(cls):
         cls.runner = CliRunner()
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_onboard_valid(self, mock_filesync):
         """
         Test onboard() with valid arguments
@@ -60,7 +262,7 @@ class TestOnboard(TestCase):
         self.runner.invoke(main, ["template", "onboard", "onboarding_repo"])
         mock_filesync().onboard.assert_called_with("onboarding_repo")
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_onboard_no_repo(self, mock_filesync):
         """
         Test onboard() with no arguments
@@ -70,6 +272,21 @@ class TestOnboard(TestCase):
         self.assertEqual(res.exit_code, 2)
         mock_filesync().onboard.assert_not_called()
 
+    @patch("filesync.filesync.FileSync")
+    def test_onboard_from(self, mock_filesync):
+        """
+        Test onboard() with a manifest
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            manifest = os.path.join(tmp_dir, "repos.yaml")
+            open(manifest, "w").close()
+            res = self.runner.invoke(main, ["template", "onboard", "--from",
+                                            manifest, "--jobs", "2"])
+        self.assertEqual(res.exit_code, 0)
+        mock_filesync().onboard_all.assert_called_with(manifest, 2)
+        mock_filesync().onboard.assert_not_called()
+
 
 class TestFix(TestCase):
     """
@@ -82,7 +299,7 @@ class TestFix(TestCase):
     def setUpClass(cls):
         cls.runner = CliRunner()
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_fix_valid(self, mock_filesync):
         """
         Test fix() with valid arguments
@@ -91,7 +308,7 @@ class TestFix(TestCase):
         self.runner.invoke(main, ["template", "fix", "repo", "existing_branch"])
         mock_filesync().fix.assert_called_with("repo", "existing_branch")
 
-    @patch("filesync.cli.FileSync")
+    @patch("filesync.filesync.FileSync")
     def test_fix_no_args(self, mock_filesync):
         """
         Test update() with no args
@@ -100,3 +317,100 @@ class TestFix(TestCase):
         res = self.runner.invoke(main, ["template", "fix"])
         self.assertEqual(res.exit_code, 2)
         mock_filesync().fix.assert_not_called()
+
+    @patch("filesync.filesync.FileSync")
+    def test_fix_all(self, mock_filesync):
+        """
+        Test fix() with --all
+        """
+
+        res = self.runner.invoke(main, ["template", "fix", "--all", "-j", "8"])
+        self.assertEqual(res.exit_code, 0)
+        mock_filesync().fix_all.assert_called_with(8)
+        mock_filesync().fix.assert_not_called()
+
+    @patch("filesync.filesync.FileSync")
+    def test_fix_all_with_args(self, mock_filesync):
+        """
+        Test fix() with --all and a repo
+        """
+
+        res = self.runner.invoke(main, ["template", "fix", "--all", "repo"])
+        self.assertEqual(res.exit_code, 2)
+        mock_filesync().fix_all.assert_not_called()
+
+
+class TestWebhook(TestCase):
+    """
+    Test webhook() method
+
+    This is a wrapper method, so not much testing is needed
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.filesync.FileSync")
+    def test_webhook_valid(self, mock_filesync):
+        """
+        Test webhook() with its defaults
+        """
+
+        self.runner.invoke(main, ["template", "webhook", "--port", "9000"])
+        mock_filesync().webhook.assert_called_with(
+            "127.0.0.1", 9000, 100, 120, "GITHUB_WEBHOOK_SECRET")
+
+
+class TestServer(TestCase):
+    """
+    Test --server and the serve command
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CliRunner()
+
+    @patch("filesync.client.RemoteFileSync")
+    @patch("filesync.filesync.FileSync")
+    def test_update_remote(self, mock_filesync, mock_remote):
+        """
+        Test update() is sent to the server with --server
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            socket_path = os.path.join(tmp_dir, "filesync.sock")
+            open(socket_path, "w").close()
+            self.runner.invoke(
+                main, ["--server", socket_path, "-b", "dev", "template",
+                       "update", "-1", "single_repo"])
+        mock_filesync.assert_not_called()
+        mock_remote.assert_called_with(
+            socket_path, template="template", template_branch="dev",
+            template_config="filesync.yaml", dry_run=False, log_level=None)
+        mock_remote().update.assert_called_with(
+            "single_repo", None, incremental=False, where=(),
+            quiet_period=None, journal=None, resume=None, retry_failed=None,
+            with_templates=(), incremental_render=False, time_budget=None)
+
+    @patch("filesync.server.Server")
+    def test_serve(self, mock_server):
+        """
+        Test serve starts a server on the socket
+        """
+
+        res = self.runner.invoke(
+            serve, ["--socket", "filesync.sock", "--max-jobs", "2"])
+        self.assertEqual(res.exit_code, 0)
+        mock_server.assert_called_with(
+            "filesync.sock", DEFAULT_CLONE_ROOT, None,
+            token_variable_name="GITHUB_TOKEN", max_jobs=2)
+        mock_server().serve_forever.assert_called()
+
+    def test_serve_no_socket(self):
+        """
+        Test serve without --socket
+        """
+
+        res = self.runner.invoke(serve, [])
+        self.assertEqual(res.exit_code, 2)
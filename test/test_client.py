@@ -0,0 +1,67 @@
+"""
+Test client.py
+"""
+
+import os.path
+from unittest import TestCase
+from unittest.mock import patch
+
+import click
+
+from filesync.client import RemoteFileSync
+
+
+class TestRemoteFileSync(TestCase):
+    """
+    Test RemoteFileSync
+    """
+
+    def setUp(self):
+        self.remote = RemoteFileSync("/nonexistent/filesync.sock",
+                                     template="tpl")
+
+    @patch.object(RemoteFileSync, "run")
+    def test_update(self, mock_run):
+        """
+        Test update() sends an absolute cache path and a list of predicates
+        """
+
+        self.remote.update(cache="repos.txt", where=("a=b",))
+
+        mock_run.assert_called_with(
+            "update", single_repo=None, cache=os.path.abspath("repos.txt"),
+            incremental=False, where=["a=b"], quiet_period=None,
+            journal=None, resume=None, retry_failed=None, with_templates=[],
+            incremental_render=False, time_budget=None)
+
+    def test_drift(self):
+        """
+        Test drift() isn't run remotely
+        """
+
+        with self.assertRaises(click.UsageError):
+            self.remote.drift()
+
+    def test_estimate(self):
+        """
+        Test estimate() isn't run remotely
+        """
+
+        with self.assertRaises(click.UsageError):
+            self.remote.estimate()
+
+    def test_inventory(self):
+        """
+        Test inventory() isn't run remotely
+        """
+
+        with self.assertRaises(click.UsageError):
+            self.remote.inventory()
+
+    def test_run_unreachable(self):
+        """
+        Test run() when nothing listens on the socket
+        """
+
+        with self.assertRaises(click.ClickException):
+            self.remote.fix("repo", "branch")
@@ -70,3 +70,17 @@ class TestLoggingConfig(TestCase):
             level=None,
         )
         self.assertEqual(result, "info")
+
+    def test_get_level_operation_is_receiving(self):
+        """
+        Test LoggingConfig.get_level() with the operation parameter is
+        "receiving"
+        """
+
+        self.log_class.config = {}
+        result = self.log_class.get_level(
+            dry_run=False,
+            operation="receiving",
+            level=None,
+        )
+        self.assertEqual(result, "info")
@@ -0,0 +1,56 @@
+"""
+Test config/onboarding_manifest.py
+"""
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from filesync.config.onboarding_manifest import OnboardingManifest
+from filesync.exceptions import UnrecognizedRepoConfigError
+
+
+class TestOnboardingManifest(TestCase):
+    """
+    Test class for OnboardingManifest class
+    """
+
+    def setUp(self):
+        with patch(
+            "filesync.config.onboarding_manifest.BaseConfig.load_config"
+        ) as mock_load:
+            mock_load.return_value = {}
+            self.manifest = OnboardingManifest("/fake/manifest/path")
+
+    def test_configure_repos(self):
+        """
+        Test OnboardingManifest.configure_repos() merges each repo's answers
+        over the shared ones
+        """
+
+        self.manifest.config["answers"] = {"use_docker": True, "port": 80}
+        self.manifest.config["repos"] = [
+            "service-a",
+            {"service-b": {"answers": {"port": 8080}}},
+            {"service-c": None},
+        ]
+        self.assertEqual(self.manifest.configure_repos(), [
+            ("service-a", {"use_docker": True, "port": 80}),
+            ("service-b", {"use_docker": True, "port": 8080}),
+            ("service-c", {"use_docker": True, "port": 80}),
+        ])
+
+    def test_configure_repos_empty(self):
+        """
+        Test OnboardingManifest.configure_repos() with no repos
+        """
+
+        self.assertEqual(self.manifest.configure_repos(), [])
+
+    def test_configure_repos_invalid(self):
+        """
+        Test OnboardingManifest.configure_repos() with a dict of two repos
+        """
+
+        self.manifest.config["repos"] = [{"a": {}, "b": {}}]
+        with self.assertRaises(UnrecognizedRepoConfigError):
+            self.manifest.configure_repos()
@@ -0,0 +1,114 @@
+"""
+Test estimate.py
+"""
+
+from unittest import TestCase
+
+from filesync.estimate import DEFAULT_COSTS, Estimate, History, wall_time
+
+
+class TestWallTime(TestCase):
+    """
+    Test wall_time()
+    """
+
+    def test_wall_time(self):
+        """
+        Test wall_time() spreads repos over the jobs, longest first
+        """
+
+        self.assertEqual(wall_time([30, 10, 20, 40], 1), 100)
+        self.assertEqual(wall_time([30, 10, 20, 40], 2), 50)
+        self.assertEqual(wall_time([100, 10, 10], 4), 100)
+        self.assertEqual(wall_time([], 4), 0)
+
+
+class TestHistory(TestCase):
+    """
+    Test History
+    """
+
+    def setUp(self):
+        self.history = History([
+            {"repo": "a", "outcome": "pushed", "duration": 30,
+             "api_calls": 10},
+            {"repo": "a", "outcome": "pushed", "duration": 50,
+             "api_calls": 14},
+            {"repo": "a", "outcome": "skipped", "duration": 5},
+            {"repo": "b", "outcome": "unchanged", "duration": 90},
+            {"repo": "c", "outcome": "deferred"},
+        ])
+
+    def test_typical(self):
+        """
+        Test History.typical() goes by the repo, then every repo, then the
+        defaults
+        """
+
+        self.assertEqual(self.history.typical("a", "update", "duration"), 40)
+        self.assertEqual(self.history.typical("a", "skip", "duration"), 5)
+        self.assertEqual(self.history.typical("new", "update", "duration"),
+                         50)
+        self.assertEqual(self.history.typical("b", "update", "api_calls"), 12)
+        self.assertEqual(self.history.typical("a", "skip", "api_calls"),
+                         DEFAULT_COSTS["skip"]["api_calls"])
+        self.assertIsNone(self.history.typical("a", "update", "disk_usage"))
+
+    def test_known(self):
+        """
+        Test History.known() ignores outcomes that say nothing about cost
+        """
+
+        self.assertTrue(self.history.known("a", "skip"))
+        self.assertFalse(self.history.known("c", "update"))
+
+
+class TestEstimate(TestCase):
+    """
+    Test Estimate
+    """
+
+    def setUp(self):
+        history = History([
+            {"repo": "a", "outcome": "pushed", "duration": 600,
+             "api_calls": 20, "disk_usage": 2 ** 20},
+            {"repo": "b", "outcome": "skipped", "duration": 60,
+             "api_calls": 4, "disk_usage": 2 ** 20},
+        ])
+        self.estimate = Estimate(history, ["a", "new"], ["b"], 2)
+
+    def test_estimate(self):
+        """
+        Test Estimate adds up each repo's typical cost
+        """
+
+        self.assertEqual(self.estimate.wall_time, 660)
+        self.assertEqual(self.estimate.api_calls, 44)
+        self.assertEqual(self.estimate.pr_writes, 6)
+        self.assertEqual(self.estimate.disk_usage, 3 * 2 ** 20)
+        self.assertEqual(self.estimate.disk_unknown, 0)
+        self.assertEqual(self.estimate.unknown, 1)
+
+    def test_pr_writes(self):
+        """
+        Test Estimate counts closing stale PRs and deleting their branches
+        only for repos that don't reuse their PR
+        """
+
+        history = History([])
+        self.assertEqual(Estimate(history, ["a", "b"], [], 1).pr_writes, 6)
+        self.assertEqual(
+            Estimate(history, ["a", "b"], [], 1, reused={"a"}).pr_writes, 4)
+        self.assertEqual(
+            Estimate(history, ["a", "b"], ["c"], 1,
+                     reused={"a", "b", "c"}).pr_writes, 2)
+
+    def test_shards(self):
+        """
+        Test Estimate.shards() fits each shard in the window
+        """
+
+        self.assertEqual(self.estimate.shards(3600), 1)
+        self.assertEqual(self.estimate.shards(300), 3)
+        self.estimate.api_calls = 12000
+        self.assertEqual(self.estimate.shards(3600), 3)
@@ -2,20 +2,33 @@
 Test FileSync class
 """
 
+import json
+import os.path
+from datetime import datetime, timezone
 from os import environ
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
+from github import GithubException
 from sh import ErrorReturnCode
 
 from filesync.exceptions import (
     AmbiguousOrgConfigError,
     FilesyncException,
     GitConfigError,
+    GraphQLError,
+    InventoryMissingError,
     MissingRequiredConfigError,
+    RunSupersededError,
     UnrecognizableBaseBranchError,
+    UnrecognizedPredicateError,
 )
 from filesync.filesync import FileSync
+from filesync.inventory import Inventory
+from filesync.manifest import Manifest
+from filesync.repo.repo_spec import RepoSpec
+from filesync.schedule import Schedule
 
 # pylint: disable=too-many-public-methods
 
@@ -96,19 +109,128 @@ class TestBuildRepos(TestCase):
         self.filesync.logger = MagicMock()
 
     @patch("filesync.filesync.FileSync.fetch_repo_list")
-    @patch("filesync.filesync.FileSync.build_repo")
-    def test_build_repos_base(self, mock_build_repo, mock_repo_list):
+    @patch("filesync.filesync.FileSync.build_repo_spec")
+    def test_build_repo_specs_base(self, mock_build_spec, mock_repo_list):
         """
-        Base test for build_repos()
+        Base test for build_repo_specs()
         """
 
         mock_repo_list.return_value = ["fake1", "fake2", "fake3"]
-        mock_build_repo.side_effect = ["fake4", "fake5", "fake6"]
-        repos = self.filesync.build_repos()
-        self.assertEqual(repos, ["fake4", "fake5", "fake6"])
-        mock_build_repo.assert_any_call("fake1")
-        mock_build_repo.assert_any_call("fake2")
-        mock_build_repo.assert_any_call("fake3")
+        mock_build_spec.side_effect = ["fake4", "fake5", "fake6"]
+        specs = self.filesync.build_repo_specs()
+        self.assertEqual(specs, ["fake4", "fake5", "fake6"])
+        mock_build_spec.assert_any_call("fake1")
+        mock_build_spec.assert_any_call("fake2")
+        mock_build_spec.assert_any_call("fake3")
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    def test_build_repos(self, mock_from_spec):
+        """
+        Test build_repos() only builds each repo when it's asked for
+        """
+
+        mock_from_spec.side_effect = lambda spec: f"repo {spec}"
+        repos = self.filesync.build_repos(["one", "two"])
+        mock_from_spec.assert_not_called()
+        self.assertEqual(next(repos), ("one", "repo one"))
+        mock_from_spec.assert_called_once_with("one")
+        self.assertEqual(list(repos), [("two", "repo two")])
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    def test_build_repos_failed(self, mock_from_spec):
+        """
+        Test build_repos() fails and journals a repo it can't build, and
+        moves on to the next
+        """
+
+        gone = RepoSpec("gone", "org", {}, "/tmp/fake_clones")
+        kept = RepoSpec("kept", "org", {}, "/tmp/fake_clones")
+        mock_from_spec.side_effect = [GithubException(404, "Not Found"),
+                                      "repo kept"]
+        self.filesync.journal = MagicMock()
+        self.filesync.template_sha = "abc123"
+        repos = list(self.filesync.build_repos([gone, kept]))
+        self.assertEqual(repos, [(kept, "repo kept")])
+        self.assertEqual(gone.outcome, "failed")
+        self.assertEqual(gone.error_class, "GithubException")
+        self.filesync.journal.record.assert_called_once_with(gone, "abc123")
+
+    @patch("filesync.filesync.FileSync.validate_repo")
+    def test_build_repo_spec(self, mock_validate):
+        """
+        Test build_repo_spec() keeps the repo's config without building it
+        """
+
+        mock_validate.return_value = ("fake_repo", "fake_org", {"a": 1})
+        self.filesync.config.set("clone_root", "/tmp/clones")
+        spec = self.filesync.build_repo_spec("fake_org/fake_repo", "main")
+        self.assertEqual(spec.name, "fake_repo")
+        self.assertEqual(spec.org, "fake_org")
+        self.assertEqual(spec.kwargs, {"a": 1, "base_branch": "main"})
+        self.assertEqual(spec.clone_path, "/tmp/clones/fake_repo")
+        self.assertIsNone(spec.outcome)
+
+
+class TestFilterRepoList(TestCase):
+    """
+    Test FileSync.filter_repo_list()
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN")
+        self.filesync.logger = MagicMock()
+        self.filesync.template = MagicMock()
+        self.filesync.template.name = "fake_template"
+
+    @patch("filesync.filesync.Inventory")
+    def test_filter_repo_list(self, mock_inventory):
+        """
+        Test filter_repo_list() drops indexed repos that don't match and keeps
+        repos the inventory doesn't know about
+        """
+
+        inventory = mock_inventory().load()
+        inventory.repos = ["match", "no_match"]
+        inventory.where.return_value = ["match"]
+        self.assertEqual(
+            self.filesync.filter_repo_list(
+                ["match", "no_match", "new"], ("docker=true",)),
+            ["match", "new"],
+        )
+        inventory.where.assert_called_with(("docker=true",))
+
+    def test_filter_repo_list_errors(self):
+        """
+        Test filter_repo_list() dies without an inventory or with a predicate
+        it can't read
+        """
+
+        self.filesync.die = MagicMock(side_effect=SystemExit(1))
+        self.filesync.config.set("state_dir", "/nonexistent/state")
+        with self.assertRaises(SystemExit):
+            self.filesync.filter_repo_list(["a"], ("docker=true",))
+        self.assertIsInstance(self.filesync.die.call_args[0][0],
+                              InventoryMissingError)
+
+        with patch.object(Inventory, "load", lambda inventory: inventory):
+            with self.assertRaises(SystemExit):
+                self.filesync.filter_repo_list(["a"], ("docker",))
+        self.assertIsInstance(self.filesync.die.call_args[0][0],
+                              UnrecognizedPredicateError)
+
+    @patch("filesync.filesync.FileSync.fetch_repo_list")
+    @patch("filesync.filesync.FileSync.validate_repo")
+    def test_inventory_targets(self, mock_validate, mock_repo_list):
+        """
+        Test inventory_targets() includes old answers files
+        """
+
+        mock_repo_list.return_value = ["org/one"]
+        mock_validate.return_value = ("one", "org", {"answers_file": ".a.yml"})
+        self.filesync.template.config.old_answers_files = [".old.yml"]
+        self.assertEqual(self.filesync.inventory_targets(),
+                         [("org/one", "org", "one", [".a.yml", ".old.yml"])])
 
 
 class TestBuildTemplate(
@@ -204,6 +326,17 @@ class TestBuildTemplate(
         mock_die.assert_called()
 
 
+def search_results(repos, total_count=None):
+    """
+    A page of search results like PyGithub's, saying how many matched
+    """
+
+    results = MagicMock()
+    results.__iter__.return_value = repos
+    results.totalCount = len(repos) if total_count is None else total_count
+    return results
+
+
 class TestFetchRepoList(TestCase):
     """
     Test FileSync.fetch_repo_list()
@@ -216,6 +349,16 @@ class TestFetchRepoList(TestCase):
         self.filesync.github = MagicMock()
         self.filesync.template = MagicMock()
         self.filesync.template.name = "fake_repo321"
+        self.filesync.template.config.select = None
+        self.filesync.template.config.exclude = None
+        patcher = patch("filesync.filesync.ScanState")
+        self.mock_scan_state = patcher.start()
+        journal_patcher = patch("filesync.filesync.Journal")
+        self.mock_journal = journal_patcher.start()
+        self.addCleanup(journal_patcher.stop)
+        self.mock_scan_state().high_water_mark = None
+        self.mock_scan_state().is_stale.return_value = False
+        self.addCleanup(patcher.stop)
 
     def test_fetch_repo_list_with_valid(self):
         """
@@ -306,6 +449,202 @@ class TestFetchRepoList(TestCase):
         self.assertEqual(repo_list, [])
         self.filesync.github.get_organization().get_repos.assert_called()
 
+    def test_fetch_repo_list_incremental(self):
+        """
+        Test fetch_repo_list() only probes repos pushed since the last scan
+        and keeps the previous result for the rest
+        """
+
+        self.filesync.template.config.autoscan = True
+        self.filesync.template.config.repos.keys.return_value = []
+        scan_state = self.mock_scan_state()
+        scan_state.high_water_mark = datetime(2021, 1, 2, tzinfo=timezone.utc)
+        scan_state.repos = ["old_repo", "gone_repo"]
+
+        fresh_repo = MagicMock()
+        fresh_repo.name = "fresh_repo"
+        fresh_repo.pushed_at = datetime(2021, 1, 3)
+        gone_repo = MagicMock()
+        gone_repo.name = "gone_repo"
+        gone_repo.pushed_at = datetime(2021, 1, 2, 12)
+        untouched_repo = MagicMock()
+        scan_state.is_stale.side_effect = [False, False, True]
+        self.filesync.github.get_organization().get_repos.return_value = [
+            fresh_repo,
+            gone_repo,
+            untouched_repo,
+        ]
+        self.filesync.is_scannable = MagicMock()
+        self.filesync.is_scannable.side_effect = [True, False]
+        self.filesync.still_listed = MagicMock(side_effect=set)
+
+        repo_list = self.filesync.fetch_repo_list(incremental=True)
+        self.assertEqual(sorted(repo_list), ["fresh_repo", "old_repo"])
+        self.filesync.still_listed.assert_called_with({"old_repo"})
+        self.filesync.github.get_organization().get_repos.assert_called_with(
+            sort="pushed", direction="desc"
+        )
+        self.assertEqual(self.filesync.is_scannable.call_count, 2)
+        scan_state.save.assert_called_with(
+            datetime(2021, 1, 3, tzinfo=timezone.utc),
+            {"fresh_repo", "old_repo"},
+        )
+
+    @patch("filesync.graphql.query")
+    def test_still_listed(self, mock_query):
+        """
+        Test FileSync.still_listed() drops repos that were deleted, archived
+        or moved
+        """
+
+        self.filesync.template.config.org = "Fake_Org"
+        mock_query.return_value = {
+            "r0": {"name": "archived", "isArchived": True,
+                   "owner": {"login": "fake_org"}},
+            "r1": None,
+            "r2": {"name": "kept", "isArchived": False,
+                   "owner": {"login": "fake_org"}},
+            "r3": {"name": "moved", "isArchived": False,
+                   "owner": {"login": "other_org"}},
+        }
+        listed = self.filesync.still_listed(
+            {"kept", "moved", "deleted", "archived"})
+        self.assertEqual(listed, {"kept"})
+        text = mock_query.call_args[0][1]
+        self.assertIn('r1: repository(owner: "Fake_Org", name: "deleted")',
+                      text)
+
+    def test_fetch_repo_list_not_incremental(self):
+        """
+        Test fetch_repo_list() ignores previous autoscan state unless asked
+        """
+
+        self.filesync.template.config.autoscan = True
+        self.filesync.template.config.repos.keys.return_value = []
+        scan_state = self.mock_scan_state()
+        scan_state.high_water_mark = datetime(2021, 1, 2, tzinfo=timezone.utc)
+        scan_state.repos = ["old_repo"]
+        self.filesync.github.get_organization().get_repos.return_value = []
+
+        repo_list = self.filesync.fetch_repo_list()
+        self.assertEqual(repo_list, [])
+        self.filesync.github.get_organization().get_repos.assert_called_with()
+
+    def test_fetch_repo_list_with_select(self):
+        """
+        Test fetch_repo_list() uses the search API when select is configured
+        """
+
+        self.filesync.template.config.autoscan = True
+        self.filesync.template.config.repos.keys.return_value = ["explicit"]
+        self.filesync.template.config.org = "fake_org"
+        self.filesync.template.config.select = {"topics": "python"}
+
+        fake_repo = MagicMock()
+        fake_repo.fork = False
+        fake_repo.archived = False
+        fake_repo.name = "python_service"
+        self.filesync.github.search_repositories.return_value = \
+            search_results([fake_repo])
+        self.filesync.has_answersfile = MagicMock()
+        self.filesync.has_answersfile.return_value = True
+
+        repo_list = self.filesync.fetch_repo_list()
+        self.assertEqual(sorted(repo_list), ["explicit", "python_service"])
+        self.filesync.github.search_repositories.assert_called_with(
+            "org:fake_org archived:false fork:false topic:python"
+        )
+        self.filesync.github.get_organization().get_repos.assert_not_called()
+
+    def test_fetch_repo_list_with_excluded(self):
+        """
+        Test fetch_repo_list() with a repo matching an exclude pattern
+        """
+
+        self.filesync.template.config.autoscan = True
+        self.filesync.template.config.exclude = ["sandbox-*"]
+
+        fake_repo = MagicMock()
+        fake_repo.fork = False
+        fake_repo.archived = False
+        fake_repo.name = "sandbox-thing"
+        self.filesync.github.get_organization().get_repos.return_value = [
+            fake_repo
+        ]
+        self.filesync.has_answersfile = MagicMock()
+
+        repo_list = self.filesync.fetch_repo_list()
+        self.assertEqual(repo_list, [])
+        self.filesync.has_answersfile.assert_not_called()
+
+    @patch("filesync.filesync.datetime")
+    def test_search_repos_split(self, mock_datetime):
+        """
+        Test FileSync.search_repos() splits a search with too many results
+        by when the repos were pushed
+        """
+
+        mock_datetime.now.return_value = datetime(2021, 1, 1, 0, 0, 10,
+                                                  tzinfo=timezone.utc)
+        self.filesync.template.config.org = "fake_org"
+        self.filesync.template.config.select = {}
+        first, second = MagicMock(), MagicMock()
+        self.filesync.github.search_repositories.side_effect = [
+            search_results([], total_count=1500),
+            search_results([first]),
+            search_results([second]),
+        ]
+
+        since = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(list(self.filesync.search_repos(since)),
+                         [first, second])
+        queries = [call.args[0] for call in
+                   self.filesync.github.search_repositories.call_args_list]
+        self.assertEqual(queries, [
+            "org:fake_org archived:false fork:false "
+            "pushed:>=2021-01-01T00:00:00Z",
+            "org:fake_org archived:false fork:false "
+            "pushed:2021-01-01T00:00:00Z..2021-01-01T00:00:05Z",
+            "org:fake_org archived:false fork:false "
+            "pushed:2021-01-01T00:00:06Z..2021-01-01T00:00:10Z",
+        ])
+
+    def test_search_repos_capped(self):
+        """
+        Test FileSync.search_repos() warns when a search can't be split
+        any further
+        """
+
+        self.filesync.template.config.org = "fake_org"
+        self.filesync.template.config.select = {}
+        fake_repo = MagicMock()
+        self.filesync.github.search_repositories.return_value = \
+            search_results([fake_repo], total_count=1500)
+
+        moment = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        self.assertEqual(list(self.filesync.search_repos(moment, moment)),
+                         [fake_repo])
+        self.filesync.github.search_repositories.assert_called_once()
+        self.filesync.logger.warning.assert_called_once()
+
+    def test_search_query(self):
+        """
+        Test FileSync.search_query() with every select option
+        """
+
+        self.filesync.template.config.org = "fake_org"
+        self.filesync.template.config.select = {
+            "topics": ["service", "python"],
+            "language": "Python",
+            "query": "in:name api",
+        }
+        self.assertEqual(
+            self.filesync.search_query(datetime(2021, 1, 2, 3, 4, 5)),
+            "org:fake_org archived:false fork:false topic:service "
+            "topic:python language:Python pushed:>=2021-01-02T03:04:05Z "
+            "in:name api",
+        )
+
     @patch("filesync.filesync.makedirs")
     def test_create_clone_root(self, mock_makedirs):
         """
@@ -624,10 +963,13 @@ class TestFetchRepoList(TestCase):
         self.filesync.stop()
         mock_clean.assert_called()
 
-    @patch("filesync.filesync.FileSync.build_repo")
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
     @patch("filesync.filesync.FileSync.stop")
     @patch("filesync.filesync.FileSync.start")
-    def test_update_single_repo(self, mock_start, mock_stop, mock_build):
+    def test_update_single_repo(
+        self, mock_start, mock_stop, mock_build, mock_from_spec
+    ):
         """
         Test FileSync.update() with a single repo
         """
@@ -635,10 +977,71 @@ class TestFetchRepoList(TestCase):
         self.filesync.update("fake_repo")
         mock_start.assert_called_with("updating")
         mock_build.assert_called_with("fake_repo")
-        mock_build().update.assert_called()
+        mock_from_spec.assert_called_with(mock_build())
+        mock_from_spec().update.assert_called()
+        mock_build().record.assert_called_with(mock_from_spec())
+        self.assertEqual(self.filesync.repos, [mock_build()])
         mock_stop.assert_called()
 
-    @patch("filesync.filesync.FileSync.build_repos")
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_journal(
+        self, mock_start, mock_stop, mock_build, mock_from_spec
+    ):
+        """
+        Test FileSync.update() journals each repo with the template commit
+        """
+
+        self.filesync.template.checked_out_head = "abc123"
+        self.filesync.update("fake_repo", journal="/tmp/journal.jsonl")
+        self.mock_journal.assert_called_with("/tmp/journal.jsonl")
+        self.mock_journal().record.assert_called_with(mock_build(), "abc123")
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_specs")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_resume(
+        self, mock_start, mock_stop, mock_build, mock_from_spec
+    ):
+        """
+        Test FileSync.update() skips repos a resumed journal finished
+        """
+
+        self.filesync.template.checked_out_head = "abc123"
+        done = MagicMock(listed_name="done")
+        todo = MagicMock(listed_name="todo")
+        mock_build.return_value = [done, todo]
+        self.mock_journal().completed.return_value = {"done"}
+        self.filesync.update(resume="/tmp/journal.jsonl")
+        self.mock_journal.assert_called_with("/tmp/journal.jsonl")
+        self.mock_journal().completed.assert_called_with("abc123")
+        self.assertEqual(self.filesync.repos, [todo])
+        mock_from_spec.assert_called_once_with(todo)
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
+    @patch("filesync.filesync.FileSync.build_repo_specs")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_retry_failed(
+        self, mock_start, mock_stop, mock_build_specs, mock_build,
+        mock_from_spec
+    ):
+        """
+        Test FileSync.update() only runs a journal's failed repos
+        """
+
+        self.mock_journal().failed.return_value = ["org/a", "b"]
+        self.filesync.update(retry_failed="/tmp/journal.jsonl")
+        mock_build_specs.assert_not_called()
+        mock_build.assert_any_call("org/a")
+        mock_build.assert_any_call("b")
+        self.assertEqual(len(self.filesync.repos), 2)
+
+    @patch("filesync.filesync.FileSync.build_repo_specs")
     @patch("filesync.filesync.FileSync.stop")
     @patch("filesync.filesync.FileSync.start")
     def test_update_multi_repos(self, mock_start, mock_stop, mock_build):
@@ -651,25 +1054,315 @@ class TestFetchRepoList(TestCase):
         mock_build.assert_called()
         mock_stop.assert_called()
 
-    @patch("filesync.filesync.FileSync.build_repo")
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
     @patch("filesync.filesync.FileSync.stop")
     @patch("filesync.filesync.FileSync.start")
-    def test_update_update_error(self, mock_start, mock_stop, mock_build):
+    def test_update_update_error(
+        self, mock_start, mock_stop, mock_build, mock_from_spec
+    ):
         """
         Test FileSync.update() when repo.update() fails
         """
 
-        mock_build().update.side_effect = FilesyncException
+        mock_from_spec().update.side_effect = FilesyncException
         self.filesync.logger = MagicMock()
         self.filesync.update("fake_repo")
         mock_start.assert_called_with("updating")
         mock_build.assert_called_with("fake_repo")
-        mock_build().update.assert_called()
+        mock_from_spec().update.assert_called()
+        self.assertEqual(mock_from_spec().outcome, "failed")
         mock_stop.assert_called()
         self.filesync.logger.error.assert_called()
 
+    @patch("filesync.filesync.FileSync.build_repo_specs")
+    @patch("filesync.filesync.FileSync.build_repos")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_superseded(
+        self, mock_start, mock_stop, mock_build, mock_build_specs
+    ):
+        """
+        Test FileSync.update() stops processing repos once the run is
+        superseded
+        """
+
+        first, second = MagicMock(), MagicMock()
+        first.update.side_effect = RunSupersededError
+        mock_build.return_value = [(MagicMock(), first),
+                                   (MagicMock(), second)]
+        self.filesync.logger = MagicMock()
+        self.filesync.update()
+        second.update.assert_not_called()
+        mock_stop.assert_called()
+
+    def run_outcomes(self, *outcomes, shard=None, **kwargs):
+        # an update where each repo ends up with one of the outcomes;
+        # returns whether the run says it synced them all
+        pairs = [(MagicMock(outcome=None), MagicMock(outcome=outcome,
+                                                     manifest=None))
+                 for outcome in outcomes]
+
+        def record(spec, repo, finished=True):
+            spec.outcome = repo.outcome
+
+        self.filesync.template.config.shard = shard
+        self.filesync.template.config.hooks = {}
+        with patch.object(FileSync, "start"), \
+             patch.object(FileSync, "stop"), \
+             patch.object(self.filesync, "record", side_effect=record), \
+             patch.object(FileSync, "build_repo_specs",
+                          return_value=[spec for spec, _ in pairs]), \
+             patch.object(FileSync, "build_repos", return_value=pairs):
+            self.filesync.update(**kwargs)
+        return self.filesync.synced_all
+
+    def test_update_synced_all(self):
+        """
+        Test FileSync.update() says it synced every repo only when a full run
+        left none behind
+        """
+
+        self.assertTrue(self.run_outcomes("pushed", "skipped", "unchanged"))
+        # what the CLI passes with and without --where
+        self.assertTrue(self.run_outcomes("pushed", where=()))
+        self.assertFalse(self.run_outcomes("pushed", "skipped",
+                                           where=("lang=go",)))
+        self.assertFalse(self.run_outcomes("pushed", shard="weekly"))
+
+    def test_update_synced_all_failed(self):
+        """
+        Test FileSync.update() with a repo that failed or was deferred
+        """
+
+        self.assertFalse(self.run_outcomes("pushed", "failed"))
+        self.assertFalse(self.run_outcomes("pushed", "deferred"))
+
+    def test_update_synced_all_dry_run(self):
+        """
+        Test FileSync.update() doesn't count a dry run as syncing anything
+        """
+
+        self.filesync.config.dry_run = True
+        self.assertFalse(self.run_outcomes("rendered", "skipped"))
+
+    @patch("filesync.filesync.FileSync.build_repos")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_already_synced(self, mock_start, mock_stop, mock_build):
+        """
+        Test FileSync.update() skips everything when an earlier coalesced run
+        already synced the template head
+        """
+
+        self.filesync.run_lock = MagicMock()
+        self.filesync.run_lock.last_done = "abc123"
+        self.filesync.template.head = "abc123"
+        self.filesync.update(quiet_period=0)
+        self.assertEqual(self.filesync.config.quiet_period, 0)
+        mock_build.assert_not_called()
+        mock_stop.assert_called()
+
+    @patch("filesync.filesync.sleep")
+    @patch("filesync.filesync.RunLock")
+    def test_maybe_coalesce(self, mock_lock, mock_sleep):
+        """
+        Test FileSync.maybe_coalesce() takes the lock, then waits
+        """
+
+        self.filesync.config.set("template", "fake_org/fake_template")
+        self.filesync.config.set("quiet_period", 30)
+        self.filesync.maybe_coalesce()
+        self.assertEqual(mock_lock.call_args[0][1], "fake_org__fake_template")
+        mock_lock().acquire.assert_called()
+        mock_sleep.assert_called_with(30)
+
+    @patch("filesync.filesync.sleep")
+    @patch("filesync.filesync.RunLock")
+    def test_maybe_coalesce_disabled(self, mock_lock, mock_sleep):
+        """
+        Test FileSync.maybe_coalesce() without a quiet period
+        """
+
+        self.filesync.maybe_coalesce()
+        mock_lock.assert_not_called()
+        mock_sleep.assert_not_called()
+        self.assertIsNone(self.filesync.run_lock)
+
     @patch("filesync.filesync.FileSync.maybe_clean")
-    @patch("filesync.filesync.FileSync.build_repo")
+    def test_stop_coalesced(self, mock_clean):
+        """
+        Test FileSync.stop() records the synced head and releases the lock
+        """
+
+        self.filesync.run_lock = MagicMock()
+        self.filesync.template.head = "abc123"
+        self.filesync.template.superseded_by = None
+        self.filesync.synced_all = True
+        self.filesync.stop()
+        self.filesync.run_lock.mark_done.assert_called_with("abc123")
+        self.filesync.run_lock.release.assert_called()
+
+    @patch("filesync.filesync.FileSync.maybe_clean")
+    def test_stop_not_synced(self, mock_clean):
+        """
+        Test FileSync.stop() doesn't record a head some repos don't have
+        """
+
+        self.filesync.run_lock = MagicMock()
+        self.filesync.template.superseded_by = None
+        self.filesync.stop()
+        self.filesync.run_lock.mark_done.assert_not_called()
+        self.filesync.run_lock.release.assert_called()
+
+    @patch("filesync.filesync.FileSync.maybe_clean")
+    def test_stop_superseded(self, mock_clean):
+        """
+        Test FileSync.stop() doesn't record a head it didn't finish
+        """
+
+        self.filesync.run_lock = MagicMock()
+        self.filesync.template.superseded_by = "def456"
+        self.filesync.stop()
+        self.filesync.run_lock.mark_done.assert_not_called()
+        self.filesync.run_lock.release.assert_called()
+
+    @patch("filesync.filesync.FileSync.run_batch_hook")
+    @patch("filesync.filesync.FileSync.build_repo_specs")
+    @patch("filesync.filesync.FileSync.build_repos")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_post_render_batch(
+        self, mock_start, mock_stop, mock_build, mock_build_specs, mock_hook
+    ):
+        """
+        Test FileSync.update() renders every repo before publishing any when
+        there's a post-render-batch hook
+        """
+
+        calls = []
+        first, second = MagicMock(), MagicMock()
+        first.render.side_effect = lambda: calls.append("render 1") or True
+        second.render.side_effect = lambda: calls.append("render 2") or False
+        first.publish.side_effect = lambda: calls.append("publish 1")
+        mock_hook.side_effect = lambda name, *args, **kwargs: calls.append(
+            name)
+        first_spec, second_spec = MagicMock(), MagicMock()
+        mock_build.return_value = [(first_spec, first), (second_spec, second)]
+        self.filesync.template.config.hooks = {"post-render-batch": "x"}
+        self.filesync.update()
+        self.assertEqual(calls, ["pre-run", "render 1", "render 2",
+                                 "post-render-batch", "publish 1",
+                                 "post-run"])
+        second.publish.assert_not_called()
+        first.update.assert_not_called()
+        self.assertEqual(first_spec.record.call_count, 2)
+        second_spec.record.assert_called_once_with(second)
+
+    def test_process_repo_failure(self):
+        """
+        Test FileSync.process_repo() records a failed repo
+        """
+
+        repo = MagicMock()
+        repo.update.side_effect = FilesyncException("nope")
+        self.assertFalse(self.filesync.process_repo(repo, repo.update))
+        self.assertEqual(repo.outcome, "failed")
+        self.assertEqual(repo.error, "nope")
+        self.filesync.logger.error.assert_called()
+
+    def test_process_repo_transient_failure(self):
+        """
+        Test FileSync.process_repo() records a repo whose git command or API
+        call failed after its retries
+        """
+
+        for error in [ErrorReturnCode(b"git push", b"", b"timed out"),
+                      GithubException(502, "Bad Gateway")]:
+            repo = MagicMock()
+            repo.update.side_effect = error
+            self.assertFalse(self.filesync.process_repo(repo, repo.update))
+            self.assertEqual(repo.outcome, "failed")
+            self.assertEqual(repo.error_class, error.__class__.__name__)
+
+    def test_process_repo_superseded(self):
+        """
+        Test FileSync.process_repo() lets a superseded run stop
+        """
+
+        repo = MagicMock()
+        repo.update.side_effect = RunSupersededError("newer head")
+        with self.assertRaises(RunSupersededError):
+            self.filesync.process_repo(repo, repo.update)
+
+    @patch("filesync.filesync.subprocess.run")
+    def test_run_batch_hook(self, mock_run):
+        """
+        Test FileSync.run_batch_hook() passes a manifest of every repo
+        """
+
+        with TemporaryDirectory() as clone_root:
+            self.filesync.config.set("clone_root", clone_root)
+            self.filesync.config.set("operation", "updating")
+            self.filesync.template.config.hooks = {"post-run": "hooks/all"}
+            self.filesync.template.clone_path = "/tpl"
+            repo = MagicMock()
+            repo.name = "fake_repo"
+            repo.clone_path = "/clones/fake_repo"
+            repo.operation = None
+            repo.outcome = "pushed"
+            repo.error = None
+            mock_run().returncode = 0
+
+            self.filesync.run_batch_hook("post-run", [repo])
+
+            manifest_path = os.path.join(clone_root,
+                                         ".filesync-post-run.json")
+            mock_run.assert_called_with(
+                ["/tpl/hooks/all", "updating", clone_root, manifest_path],
+                capture_output=True,
+            )
+            with open(manifest_path) as fin:
+                self.assertEqual(json.load(fin), [{
+                    "repo": "fake_repo",
+                    "clone_path": "/clones/fake_repo",
+                    "operation": "updating",
+                    "outcome": "pushed",
+                    "error": None,
+                }])
+
+    @patch("filesync.filesync.FileSync.die")
+    @patch("filesync.filesync.subprocess.run")
+    def test_run_batch_hook_failure(self, mock_run, mock_die):
+        """
+        Test FileSync.run_batch_hook() when the hook fails
+        """
+
+        with TemporaryDirectory() as clone_root:
+            self.filesync.config.set("clone_root", clone_root)
+            self.filesync.config.set("operation", "updating")
+            self.filesync.template.config.hooks = {"pre-run": "hooks/all"}
+            mock_run().returncode = 1
+            self.filesync.run_batch_hook("pre-run", [])
+            mock_die.assert_called()
+
+            mock_die.reset_mock()
+            self.filesync.run_batch_hook("pre-run", [], fatal=False)
+            mock_die.assert_not_called()
+            self.filesync.logger.error.assert_called()
+
+    @patch("filesync.filesync.subprocess.run")
+    def test_run_batch_hook_not_configured(self, mock_run):
+        """
+        Test FileSync.run_batch_hook() without the hook configured
+        """
+
+        self.filesync.template.config.hooks = {}
+        self.filesync.run_batch_hook("post-run", [])
+        mock_run.assert_not_called()
+
+    @patch("filesync.filesync.FileSync.maybe_clean")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
     @patch("filesync.filesync.FileSync.stop")
     @patch("filesync.filesync.FileSync.start")
     def test_update_keyboard_interrupt(
@@ -754,6 +1447,7 @@ class TestFetchRepoList(TestCase):
             "branch_separator",
             "dry_run",
             "hooks",
+            "reuse_pr",
         ]
         kwargs = {
             "answers_file": "answers_file",
@@ -761,6 +1455,7 @@ class TestFetchRepoList(TestCase):
             "branch_separator": "branch_separator",
             "dry_run": "dry_run",
             "hooks": "hooks",
+            "reuse_pr": "reuse_pr",
         }
         self.assertEqual(
             self.filesync.validate_repo("fake_org/fake_repo"),
@@ -785,6 +1480,7 @@ class TestFetchRepoList(TestCase):
             "branch_separator",
             "dry_run",
             "hooks",
+            "reuse_pr",
         ]
         kwargs = {
             "answers_file": "answers_file",
@@ -792,6 +1488,7 @@ class TestFetchRepoList(TestCase):
             "branch_separator": "branch_separator",
             "dry_run": "dry_run",
             "hooks": "hooks",
+            "reuse_pr": "reuse_pr",
         }
         self.assertEqual(
             self.filesync.validate_repo("fake_repo"),
@@ -834,6 +1531,7 @@ class TestFetchRepoList(TestCase):
             "branch_separator",
             "dry_run",
             "hooks",
+            "reuse_pr",
         ]
         kwargs = {
             "answers_file": "answers_file",
@@ -841,9 +1539,780 @@ class TestFetchRepoList(TestCase):
             "branch_separator": "branch_separator",
             "dry_run": True,
             "hooks": "hooks",
+            "reuse_pr": "reuse_pr",
             "interactive": True,
         }
         self.assertEqual(
             self.filesync.validate_repo("fake_repo"),
             ("fake_repo", "fake_org", kwargs),
         )
+
+    @patch("filesync.filesync.FileSync.split_org_and_name")
+    def test_validate_repo_incremental_render(self, mock_split):
+        """
+        Test FileSync.validate_repo() with --incremental-render
+        """
+
+        mock_split.return_value = ("fake_org", "fake_repo")
+        self.filesync.config.set("incremental_render", True)
+        self.filesync.template.config.repos = {}
+        _, _, kwargs = self.filesync.validate_repo("fake_repo")
+        self.assertTrue(kwargs["incremental_render"])
+
+    @patch("filesync.filesync.metrics")
+    def test_write_metrics(self, mock_metrics):
+        """
+        Test FileSync.write_metrics() labels the metrics with the run
+        """
+
+        self.filesync.config.set("metrics_file", "/tmp/filesync.prom")
+        self.filesync.config.set("clone_root", "/tmp/clones")
+        self.filesync.config.set("operation", "updating")
+        self.filesync.repos = ["repo"]
+        self.filesync.write_metrics()
+        self.filesync.maybe_write_metrics()
+        labels = {"template": self.filesync.config.template,
+                  "operation": "updating"}
+        mock_metrics.write.assert_called_with(
+            "/tmp/filesync.prom", labels, ["repo"], "/tmp/clones")
+        mock_metrics.maybe_write.assert_called_with(
+            "/tmp/filesync.prom", labels, ["repo"], "/tmp/clones")
+
+    @patch("filesync.filesync.metrics")
+    def test_write_metrics_not_asked(self, mock_metrics):
+        """
+        Test FileSync.write_metrics() when no metrics file was asked for
+        """
+
+        self.filesync.write_metrics()
+        self.filesync.maybe_write_metrics()
+        mock_metrics.write.assert_not_called()
+        mock_metrics.maybe_write.assert_not_called()
+
+    @patch("filesync.filesync.memory_tracker")
+    @patch("filesync.filesync.api_stats")
+    @patch("filesync.filesync.tracer")
+    def test_write_reports(self, mock_tracer, mock_api_stats, mock_memory):
+        """
+        Test FileSync.write_reports() when reports were asked for
+        """
+
+        self.filesync.config.set("api_report", "/tmp/api.json")
+        self.filesync.config.set("memory_report", "/tmp/memory.json")
+        self.filesync.config.set("timings_report", "/tmp/timings.json")
+        self.filesync.config.set("otlp_endpoint", "http://localhost:4318")
+        self.filesync.write_reports()
+        mock_tracer.write_report.assert_called_with("/tmp/timings.json", {})
+        mock_tracer.send_otlp.assert_called_with("http://localhost:4318")
+        mock_api_stats.write_report.assert_called_with("/tmp/api.json")
+        mock_memory.write_report.assert_called_with("/tmp/memory.json")
+
+    @patch("filesync.filesync.api_stats")
+    @patch("filesync.filesync.tracer")
+    def test_write_reports_not_asked(self, mock_tracer, mock_api_stats):
+        """
+        Test FileSync.write_reports() when no reports were asked for
+        """
+
+        self.filesync.write_reports()
+        mock_tracer.write_report.assert_not_called()
+        mock_tracer.send_otlp.assert_not_called()
+        mock_api_stats.write_report.assert_not_called()
+        mock_api_stats.log_summary.assert_called()
+
+
+class TestSharedState(TestCase):
+    """
+    Test the state a server shares between FileSync jobs
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN")
+        self.filesync.github = MagicMock()
+
+    def test_organization(self):
+        """
+        Test FileSync.organization() only fetches each org once
+        """
+
+        first = self.filesync.organization("org")
+        second = self.filesync.organization("org")
+        self.assertIs(first, second)
+        self.filesync.github.get_organization.assert_called_once_with("org")
+
+    def test_repo_lock(self):
+        """
+        Test FileSync.repo_lock() uses the shared locks when there are any
+        """
+
+        with self.filesync.repo_lock("repo"):
+            pass
+        self.filesync.repo_locks = {"repo": MagicMock()}
+        with self.filesync.repo_lock("repo"):
+            self.filesync.repo_locks["repo"].__enter__.assert_called()
+
+    @patch("filesync.filesync.api_stats")
+    def test_start_template_cache(self, _):
+        """
+        Test FileSync.start() takes the template from a shared cache
+        """
+
+        self.filesync.config.set("template", "org/template")
+        self.filesync.template_cache = MagicMock()
+        self.filesync.validate_config = MagicMock()
+        self.filesync.build_template = MagicMock()
+        self.filesync.template_cache.get().config.hook_mode = None
+        with TemporaryDirectory() as tmp_dir:
+            self.filesync.config.set("clone_root", tmp_dir)
+            self.filesync.start("updating")
+        self.filesync.template_cache.get.assert_called_with(
+            self.filesync, "org/template")
+        self.filesync.build_template.assert_not_called()
+
+
+class TestWebhook(TestCase):
+    """
+    Test the FileSync side of the webhook receiver
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 template="org/template",
+                                 clone_root="/tmp/clones")
+        self.filesync.logger = MagicMock()
+
+    def test_new_run(self):
+        """
+        Test FileSync.new_run() copies the options and clones elsewhere
+        """
+
+        run = self.filesync.new_run()
+        self.assertIsNot(run, self.filesync)
+        self.assertEqual(run.config.template, "org/template")
+        self.assertEqual(run.config.clone_root, "/tmp/clones/jobs")
+
+    def test_refresh_template(self):
+        """
+        Test FileSync.refresh_template() keeps the old template on errors
+        """
+
+        old_template = self.filesync.template = MagicMock()
+        old_template.clone_path = "/nonexistent/template"
+        self.filesync.build_template = MagicMock(
+            side_effect=MissingRequiredConfigError("org is required!"))
+        self.filesync.refresh_template()
+        self.assertIs(self.filesync.template, old_template)
+        self.filesync.build_template.assert_called_with("org/template",
+                                                        fatal=False)
+
+    @patch("filesync.webhook.WebhookReceiver")
+    def test_webhook_no_secret(self, mock_receiver):
+        """
+        Test FileSync.webhook() without a secret
+        """
+
+        self.filesync.start = MagicMock()
+        self.filesync.die = MagicMock(side_effect=SystemExit(1))
+        environ.pop("FAKE_SECRET", None)
+        with self.assertRaises(SystemExit):
+            self.filesync.webhook("127.0.0.1", 8080, 10, 5, "FAKE_SECRET")
+        mock_receiver.assert_not_called()
+
+    @patch("filesync.webhook.WebhookReceiver")
+    def test_webhook(self, mock_receiver):
+        """
+        Test FileSync.webhook() serves until interrupted
+        """
+
+        self.filesync.start = MagicMock()
+        self.filesync.stop = MagicMock()
+        mock_receiver().serve_forever.side_effect = KeyboardInterrupt
+        environ["FAKE_SECRET"] = "shh"
+        self.filesync.webhook("127.0.0.1", 8080, 10, 5, "FAKE_SECRET")
+        mock_receiver.assert_called_with(self.filesync, "shh", "127.0.0.1",
+                                         8080, queue_size=10, quiet_period=5)
+        self.filesync.stop.assert_called()
+
+
+class TestFixAll(TestCase):
+    """
+    Test fixing every open PR of a template at once
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 clone_root="/fake/root")
+        self.filesync.logger = MagicMock()
+        self.filesync.github = MagicMock()
+        self.filesync.template = MagicMock()
+        self.filesync.template.name = "tpl"
+        config = {"branch_prefix": "filesync", "branch_separator": "/",
+                  "org": "org", "exclude": ["excluded"]}
+        self.filesync.template.config.get.side_effect = config.get
+        for key, value in config.items():
+            setattr(self.filesync.template.config, key, value)
+        self.filesync.template.config.repos = {
+            "listed": {},
+            "other/custom": {"branch-prefix": "sync"},
+        }
+
+    def test_branch_prefixes(self):
+        """
+        Test FileSync.branch_prefixes() includes repos' own prefixes
+        """
+
+        self.assertEqual(self.filesync.branch_prefixes(),
+                         {("filesync/tpl", "/"), ("sync/tpl", "/")})
+
+    def test_listed_name(self):
+        """
+        Test FileSync.listed_name() uses the name the config knows
+        """
+
+        self.assertEqual(self.filesync.listed_name("org", "listed"), "listed")
+        self.assertEqual(self.filesync.listed_name("other", "custom"),
+                         "other/custom")
+        self.assertEqual(self.filesync.listed_name("org", "scanned"),
+                         "scanned")
+        self.assertEqual(self.filesync.listed_name("elsewhere", "repo"),
+                         "elsewhere/repo")
+
+    @patch("filesync.filesync.search_pull_requests")
+    def test_find_template_prs(self, mock_search):
+        """
+        Test FileSync.find_template_prs() keeps only this template's PRs
+        """
+
+        def pr(owner, name, branch):
+            return {"headRefName": branch,
+                    "repository": {"name": name, "owner": {"login": owner}}}
+
+        mock_search.return_value = [
+            pr("org", "listed", "filesync/tpl/abc"),
+            pr("org", "listed", "filesync/tpl-other/abc"),
+            pr("org", "excluded", "filesync/tpl/abc"),
+            pr("other", "custom", "sync/tpl"),
+        ]
+        targets = self.filesync.find_template_prs()
+        self.assertEqual(targets, [("listed", "filesync/tpl/abc"),
+                                   ("other/custom", "sync/tpl")])
+        searches = [c.args[1] for c in mock_search.call_args_list]
+        self.assertIn("is:pr is:open org:other head:sync/tpl", searches)
+        self.assertIn("is:pr is:open org:org head:filesync/tpl", searches)
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    def test_process_bulk_repo(self, mock_from_spec):
+        """
+        Test FileSync.process_bulk_repo() runs the step on the PR's branch
+        """
+
+        mock_from_spec().outcome = "pushed"
+        mock_from_spec().manifest = None
+        mock_from_spec().pr_url = "https://github.com/org/listed/pull/1"
+        spec = self.filesync.process_bulk_repo("listed", "fix",
+                                               base_branch="filesync/tpl/a")
+        self.assertEqual(spec.kwargs["base_branch"], "filesync/tpl/a")
+        mock_from_spec().fix.assert_called()
+        self.assertEqual(spec.outcome, "pushed")
+        self.assertIsNotNone(spec.duration)
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    def test_process_bulk_repo_error(self, mock_from_spec):
+        """
+        Test FileSync.process_bulk_repo() when the repo can't be built
+        """
+
+        mock_from_spec.side_effect = ErrorReturnCode("git", b"", b"")
+        spec = self.filesync.process_bulk_repo("listed", "fix")
+        self.assertEqual(spec.outcome, "failed")
+        self.assertEqual(spec.error_class, "ErrorReturnCode")
+
+    def test_run_parallel(self):
+        """
+        Test FileSync.run_parallel() collects every item's spec
+        """
+
+        specs = self.filesync.run_parallel(
+            lambda item: MagicMock(listed_name=item), ["a", "b", "c"], 2)
+        self.assertEqual(sorted(spec.listed_name for spec in specs),
+                         ["a", "b", "c"])
+        self.assertEqual(self.filesync.repos, specs)
+
+    @patch("filesync.filesync.FileSync.report_results")
+    @patch("filesync.filesync.FileSync.process_bulk_repo")
+    @patch("filesync.filesync.FileSync.find_template_prs")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_fix_all(self, mock_start, mock_stop, mock_find, mock_process,
+                     mock_report):
+        """
+        Test FileSync.fix_all() fixes every PR found
+        """
+
+        mock_find.return_value = [("a", "filesync/tpl/1"),
+                                  ("b", "filesync/tpl/2")]
+        self.filesync.fix_all(jobs=2)
+        mock_start.assert_called_with("fixing")
+        mock_process.assert_any_call("a", "fix", base_branch="filesync/tpl/1")
+        mock_process.assert_any_call("b", "fix", base_branch="filesync/tpl/2")
+        mock_report.assert_called()
+        mock_stop.assert_called()
+
+
+class TestOnboardAll(TestCase):
+    """
+    Test onboarding every repo in a manifest at once
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 clone_root="/fake/root")
+        self.filesync.logger = MagicMock()
+        self.filesync.template = MagicMock()
+        self.filesync.template.config.repos = {}
+        self.filesync.template.config.org = "org"
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    def test_process_bulk_repo_answers(self, mock_from_spec):
+        """
+        Test FileSync.process_bulk_repo() hands the answers to the repo
+        """
+
+        self.filesync.process_bulk_repo("a", "onboard",
+                                        answers={"use_docker": True})
+        spec = mock_from_spec.call_args.args[0]
+        self.assertEqual(spec.kwargs["answers"], {"use_docker": True})
+        mock_from_spec().onboard.assert_called()
+
+    @patch("filesync.filesync.FileSync.report_results")
+    @patch("filesync.filesync.FileSync.process_bulk_repo")
+    @patch("filesync.filesync.OnboardingManifest")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_onboard_all(self, mock_start, mock_stop, mock_manifest,
+                         mock_process, mock_report):
+        """
+        Test FileSync.onboard_all() onboards every repo in the manifest
+        """
+
+        mock_manifest().repos = [("a", {"x": 1}), ("b", {"x": 2})]
+        self.filesync.onboard_all("/fake/repos.yaml", jobs=2)
+        mock_start.assert_called_with("onboarding")
+        mock_process.assert_any_call("a", "onboard", answers={"x": 1})
+        mock_process.assert_any_call("b", "onboard", answers={"x": 2})
+        mock_report.assert_called()
+        mock_stop.assert_called()
+
+    def test_report_results(self):
+        """
+        Test FileSync.report_results() lists each repo and the totals
+        """
+
+        specs = [MagicMock(listed_name="b", outcome="failed", pr_url=None,
+                           error="dirty", duration=1.5),
+                 MagicMock(listed_name="a", outcome="pushed",
+                           pr_url="https://github.com/org/a/pull/1",
+                           duration=2.0)]
+        with patch("filesync.filesync.log_or_print") as mock_log:
+            self.filesync.report_results(specs)
+        lines = [c.args[1] for c in mock_log.call_args_list]
+        self.assertIn("a https://github.com/org/a/pull/1", lines[0])
+        self.assertIn("dirty", lines[1])
+        self.assertEqual(lines[2], "1 failed, 1 pushed")
+
+
+class TestTemplateGroup(TestCase):
+    """
+    Test rendering several templates into each repo at once
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 clone_root="/fake/root",
+                                 template_branch="dev")
+        self.filesync.logger = MagicMock()
+        self.filesync.github = MagicMock()
+        self.filesync.template = MagicMock(checked_out_head="abc123")
+        self.filesync.template.name = "ci"
+        self.filesync.template.config.org = "org"
+        self.companion = MagicMock(checked_out_head="def456")
+        self.companion.name = "lint"
+        self.companion.config.answers_file = ".lint-answers.yml"
+        self.companion.config.repos = {
+            "special": {"answers-file": ".special-lint.yml"}}
+        journal_patcher = patch("filesync.filesync.Journal")
+        self.mock_journal = journal_patcher.start()
+        self.addCleanup(journal_patcher.stop)
+
+    @patch("filesync.filesync.Template")
+    def test_build_template_companion(self, mock_template):
+        """
+        Test FileSync.build_template() leaves --template-branch to the main
+        template
+        """
+
+        self.filesync.build_template("lint", companion=True)
+        self.assertIsNone(mock_template.call_args.kwargs["base_branch"])
+
+    def test_companions_for(self):
+        """
+        Test FileSync.companions_for() uses each repo's answers file
+        """
+
+        self.filesync.companions = [self.companion]
+        self.assertEqual(self.filesync.companions_for("plain"),
+                         [(self.companion, ".lint-answers.yml")])
+        self.assertEqual(self.filesync.companions_for("special"),
+                         [(self.companion, ".special-lint.yml")])
+
+    def test_group_sha(self):
+        """
+        Test FileSync.group_sha() covers every template in the group
+        """
+
+        self.assertEqual(self.filesync.group_sha(), "abc123")
+        self.filesync.companions = [self.companion]
+        self.assertEqual(self.filesync.group_sha(), "abc123+def456")
+
+    @patch("filesync.filesync.Repository")
+    def test_repo_from_spec(self, mock_repo):
+        """
+        Test FileSync.repo_from_spec() hands a repo its companions
+        """
+
+        self.filesync.companions = [self.companion]
+        spec = MagicMock(listed_name="plain", kwargs={})
+        self.filesync.repo_from_spec(spec)
+        self.assertEqual(mock_repo.call_args.kwargs["companions"],
+                         [(self.companion, ".lint-answers.yml")])
+
+    @patch("filesync.filesync.FileSync.repo_from_spec")
+    @patch("filesync.filesync.FileSync.build_repo_spec")
+    @patch("filesync.filesync.FileSync.build_template")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_update_with_templates(
+        self, mock_start, mock_stop, mock_build_template, mock_build,
+        mock_from_spec
+    ):
+        """
+        Test FileSync.update() builds each companion template once for the
+        whole run
+        """
+
+        mock_build_template.return_value = self.companion
+        self.filesync.update("repo", with_templates=("lint", "docs"))
+        mock_build_template.assert_any_call("lint", companion=True)
+        mock_build_template.assert_any_call("docs", companion=True)
+        self.assertEqual(self.filesync.companions,
+                         [self.companion, self.companion])
+        self.mock_journal().record.assert_called_with(
+            mock_build(), "abc123+def456+def456")
+        mock_from_spec().update.assert_called()
+
+
+class TestManifests(TestCase):
+    """
+    Test FileSync's use of managed-files manifests
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 state_dir=tmp_dir.name)
+        self.filesync.logger = MagicMock()
+        self.filesync.github = MagicMock()
+        self.filesync.template = MagicMock(head="abc123def")
+        self.filesync.template.name = "tpl"
+        self.filesync.journal = MagicMock()
+        self.filesync.template_sha = "abc123def"
+
+    def write_manifest(self, repo, template_version="abc123"):
+        manifest = Manifest(self.filesync.manifest_path(repo))
+        manifest.answers_file = ".copier-answers.yml"
+        manifest.template_version = template_version
+        manifest.files = {"Makefile": "111"}
+        manifest.save()
+        return manifest
+
+    def test_manifest_path(self):
+        """
+        Test FileSync.manifest_path() keeps an org's repos apart
+        """
+
+        self.assertTrue(self.filesync.manifest_path("org/repo").endswith(
+            os.path.join("manifests", "tpl", "org__repo.json")))
+
+    def test_save_manifest(self):
+        """
+        Test FileSync.save_manifest() only saves what was pushed or already
+        there, keeping the shas of files an incremental render left alone
+        """
+
+        previous = Manifest(self.filesync.manifest_path("org/repo"))
+        previous.files = {"Makefile": "111", "setup.cfg": "999"}
+        previous.answers_file = ".copier-answers.yml"
+        previous.save()
+
+        manifest = Manifest(None)
+        manifest.answers_file = ".copier-answers.yml"
+        manifest.files = {"Makefile": "222", "setup.cfg": "333"}
+        manifest.kept = {"setup.cfg"}
+        repo = MagicMock(manifest=manifest, outcome="rendered")
+        self.filesync.save_manifest("org/repo", repo)
+        self.assertIsNone(manifest.path)
+
+        repo.outcome = "pushed"
+        self.filesync.save_manifest("org/repo", repo)
+        saved = Manifest(self.filesync.manifest_path("org/repo")).load()
+        self.assertEqual(saved.files, {"Makefile": "222", "setup.cfg": "999"})
+
+    @patch("filesync.filesync.fetch_states")
+    def test_skip_in_sync(self, mock_fetch):
+        """
+        Test FileSync.skip_in_sync() only skips repos on the template head
+        whose manifest still matches
+        """
+
+        self.write_manifest("clean")
+        self.write_manifest("old", template_version="fff000")
+        self.write_manifest("pinned")
+        specs = [MagicMock(listed_name=name, kwargs={})
+                 for name in ["clean", "old", "new"]]
+        specs.append(MagicMock(listed_name="pinned",
+                               kwargs={"template_ref": "v1"}))
+        mock_fetch.return_value = [(specs[0], "clean", [])]
+        remaining = self.filesync.skip_in_sync(specs)
+        self.assertEqual(remaining, specs[1:])
+        targets = mock_fetch.call_args[0][1]
+        self.assertEqual([target[0] for target in targets], [specs[0]])
+        self.assertEqual(specs[0].outcome, "skipped")
+        self.filesync.journal.record.assert_called_once_with(specs[0],
+                                                             "abc123def")
+
+    @patch("filesync.filesync.fetch_states")
+    def test_skip_in_sync_graphql_error(self, mock_fetch):
+        """
+        Test FileSync.skip_in_sync() clones everything when the manifests
+        can't be checked
+        """
+
+        self.write_manifest("clean")
+        specs = [MagicMock(listed_name="clean", kwargs={})]
+        mock_fetch.side_effect = GraphQLError("nope")
+        self.assertEqual(self.filesync.skip_in_sync(specs), specs)
+
+    @patch("filesync.filesync.log_or_print")
+    @patch("filesync.filesync.fetch_states")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_drift(self, mock_start, mock_stop, mock_fetch, mock_print):
+        """
+        Test FileSync.drift() reports each repo's status without cloning
+        """
+
+        self.filesync.template.config.org = "org"
+        self.filesync.template.config.repos = {}
+        self.write_manifest("edited")
+        mock_fetch.return_value = [("edited", "drifted", ["Makefile"])]
+        self.filesync.drift(["edited", "new"])
+        targets = mock_fetch.call_args[0][1]
+        self.assertEqual([target[:3] for target in targets],
+                         [("edited", "org", "edited")])
+        printed = [call[0][1] for call in mock_print.call_args_list]
+        self.assertIn("        drifted edited", printed)
+        self.assertIn("                  Makefile", printed)
+        self.assertIn("    no-manifest new", printed)
+        self.assertEqual(printed[-1], "1 drifted, 1 no-manifest")
+
+
+class TestTimeBudget(TestCase):
+    """
+    Test FileSync's time-budgeted runs
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 state_dir=self.tmp_dir.name,
+                                 clone_root="/tmp/fake_clones")
+        self.filesync.logger = MagicMock()
+        self.filesync.github = MagicMock()
+        self.filesync.template = MagicMock(head="abc123")
+        self.filesync.template.name = "tpl"
+        self.filesync.journal = MagicMock()
+        self.filesync.template_sha = "abc123"
+
+    def test_build_repo_spec_priority(self):
+        """
+        Test FileSync.build_repo_spec() keeps a repo's priority out of its
+        kwargs
+        """
+
+        self.filesync.template.config.org = "org"
+        self.filesync.template.config.repos = {"urgent": {"priority": 5}}
+        spec = self.filesync.build_repo_spec("urgent")
+        self.assertEqual(spec.priority, 5)
+        self.assertNotIn("priority", spec.kwargs)
+        self.assertEqual(self.filesync.build_repo_spec("other").priority, 0)
+
+    def test_projected_durations(self):
+        """
+        Test FileSync.projected_durations() takes each repo's median from
+        this template's journals
+        """
+
+        directory = os.path.join(self.tmp_dir.name, "journals")
+        os.makedirs(directory)
+        for name, duration in [("tpl-1.jsonl", 10), ("tpl-2.jsonl", 30),
+                               ("tpl-3.jsonl", 20), ("other-1.jsonl", 99)]:
+            with open(os.path.join(directory, name), "w") as fout:
+                fout.write(json.dumps({"repo": "a", "duration": duration}))
+                fout.write("\n")
+        self.assertEqual(self.filesync.projected_durations(), {"a": 20})
+
+    def test_prioritize(self):
+        """
+        Test FileSync.prioritize() orders repos by commits behind, going by
+        the inventory over the manifests
+        """
+
+        for repo, version in [("a", "aaa"), ("b", "bbb")]:
+            manifest = Manifest(self.filesync.manifest_path(repo))
+            manifest.template_version = version
+            manifest.save()
+        inventory = Inventory(self.filesync.inventory_path())
+        inventory.add("b", {"_template_version": "ccc"})
+        inventory.save()
+        compare = {"aaa": 2, "ccc": 7}
+        self.filesync.template.github.compare.side_effect = \
+            lambda base, head: MagicMock(ahead_by=compare[base])
+        self.filesync.schedule = Schedule(600, {})
+        specs = [MagicMock(listed_name=name, priority=0)
+                 for name in ["a", "b"]]
+        ordered = self.filesync.prioritize(specs)
+        self.assertEqual([spec.listed_name for spec in ordered], ["b", "a"])
+        self.filesync.template.github.compare.assert_any_call("ccc", "abc123")
+
+    def test_prioritize_not_rendered_at(self):
+        """
+        Test FileSync.prioritize() counts a manifest without rendered_at as
+        never synced
+        """
+
+        manifest = Manifest(self.filesync.manifest_path("old"))
+        manifest.template_version = "abc123"
+        manifest.save()
+        with open(manifest.path) as fin:
+            data = json.load(fin)
+        del data["rendered_at"]
+        with open(manifest.path, "w") as fout:
+            json.dump(data, fout)
+        Manifest(self.filesync.manifest_path("new")).save()
+        self.filesync.commits_behind = MagicMock(return_value={})
+        self.filesync.schedule = Schedule(600, {})
+        specs = [MagicMock(listed_name=name, priority=0)
+                 for name in ["new", "old"]]
+        ordered = self.filesync.prioritize(specs)
+        self.assertEqual([spec.listed_name for spec in ordered],
+                         ["old", "new"])
+
+    def test_scheduled(self):
+        """
+        Test FileSync.scheduled() defers the repos that wouldn't fit
+        """
+
+        self.filesync.schedule = Schedule(100, {"a": 10, "b": 200, "c": 10})
+        specs = [MagicMock(listed_name=name) for name in ["a", "b", "c"]]
+        self.assertEqual(list(self.filesync.scheduled(specs)), specs[:1])
+        self.assertEqual(specs[1].outcome, "deferred")
+        self.assertEqual(specs[2].outcome, "deferred")
+        self.filesync.journal.record.assert_called_with(specs[2], "abc123")
+
+    def test_scheduled_no_budget(self):
+        """
+        Test FileSync.scheduled() without a time budget
+        """
+
+        specs = [MagicMock(listed_name="a")]
+        self.assertEqual(list(self.filesync.scheduled(specs)), specs)
+
+
+class TestEstimate(TestCase):
+    """
+    Test FileSync.estimate()
+    """
+
+    def setUp(self):
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 state_dir=self.tmp_dir.name,
+                                 clone_root="/tmp/fake_clones")
+        self.filesync.logger = MagicMock()
+        self.filesync.github = MagicMock()
+        self.filesync.template = MagicMock(head="abc123")
+        self.filesync.template.name = "tpl"
+        self.filesync.template.config.old_answers_files = None
+
+    @patch("filesync.filesync.Inventory")
+    def test_current_versions(self, mock_inventory):
+        """
+        Test FileSync.current_versions() reads the answers files through
+        GraphQL without saving an inventory
+        """
+
+        mock_inventory().repos = ["a", "org/b"]
+        mock_inventory().column.return_value = ["abc", None]
+        spec = MagicMock(listed_name="org/b", org="org",
+                         kwargs={"answers_file": ".answers.yml"})
+        spec.name = "b"
+        versions = self.filesync.current_versions([spec])
+        self.assertEqual(versions, {"a": "abc", "org/b": None})
+        mock_inventory().fetch.assert_called_with(
+            self.filesync.github, [("org/b", "org", "b", [".answers.yml"])])
+        mock_inventory().save.assert_not_called()
+
+    @patch("filesync.filesync.log_or_print")
+    @patch("filesync.filesync.FileSync.current_versions")
+    @patch("filesync.filesync.FileSync.build_repo_specs")
+    @patch("filesync.filesync.FileSync.stop")
+    @patch("filesync.filesync.FileSync.start")
+    def test_estimate(self, mock_start, mock_stop, mock_build, mock_versions,
+                      mock_print):
+        """
+        Test FileSync.estimate() only counts repos behind the template head
+        as updates, and goes by the journals
+        """
+
+        mock_build.return_value = [
+            MagicMock(listed_name=name, kwargs={"reuse_pr": name == "old"})
+            for name in ["current", "old", "new"]]
+        mock_versions.return_value = {"current": "abc", "old": "fff"}
+        directory = os.path.join(self.tmp_dir.name, "journals")
+        os.makedirs(directory)
+        with open(os.path.join(directory, "tpl-1.jsonl"), "w") as fout:
+            for entry in [
+                {"repo": "old", "outcome": "pushed", "duration": 1200,
+                 "api_calls": 30},
+                {"repo": "current", "outcome": "skipped", "duration": 60,
+                 "api_calls": 3},
+            ]:
+                fout.write(json.dumps(entry) + "\n")
+        self.filesync.estimate(jobs=2, window=1200)
+        printed = [call[0][1] for call in mock_print.call_args_list]
+        self.assertEqual(printed[0], "3 repos; 2 behind abc123")
+        self.assertTrue(printed[1].startswith("wall time: 21m with 2 jobs"))
+        self.assertTrue(printed[2].startswith("API calls: 63 "))
+        self.assertTrue(printed[3].startswith("PR writes: up to 4 "))
+        self.assertEqual(printed[-1], "shards: 2 for each run to fit in 20m")
@@ -0,0 +1,126 @@
+"""
+Test git_trace.py
+"""
+
+import json
+import os.path
+import subprocess
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from filesync.git_trace import GitTrace, parse_events
+from filesync.tracing import tracer
+
+ROOT = "20261019T074137.577859Z-H0a7c9cdf-P0000260e"
+CHILD = f"{ROOT}/20261019T074137.581389Z-H0a7c9cdf-P00002610"
+
+EVENTS = [
+    {"event": "version", "sid": ROOT, "evt": "3", "exe": "2.39.5"},
+    {"event": "cmd_name", "sid": ROOT, "name": "clone"},
+    {"event": "child_start", "sid": ROOT, "child_id": 0},
+    {"event": "cmd_name", "sid": CHILD, "name": "upload-pack"},
+    {"event": "child_start", "sid": CHILD, "child_id": 0},
+    {"event": "data", "sid": CHILD, "category": "pack-objects",
+     "key": "write_pack_file/wrote", "value": "5"},
+    {"event": "atexit", "sid": CHILD, "t_abs": 0.005, "code": 0},
+    {"event": "data", "sid": ROOT, "category": "negotiation_v2",
+     "key": "total_rounds", "value": "2"},
+    {"event": "atexit", "sid": ROOT, "t_abs": 0.012, "code": 0},
+]
+
+
+class TestParseEvents(TestCase):
+    """
+    Test parse_events()
+    """
+
+    def test_parse_events(self):
+        """
+        Test parse_events() reads the root process and adds up its children
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "events.json")
+            with open(path, "w") as fout:
+                for event in EVENTS:
+                    fout.write(json.dumps(event) + "\n")
+                fout.write('{"event": "atex')
+            stats = parse_events(path)
+
+        self.assertEqual(stats["duration"], 0.012)
+        self.assertEqual(stats["exit_code"], 0)
+        self.assertEqual(stats["processes"], ["clone", "upload-pack"])
+        self.assertEqual(stats["children"], 2)
+        self.assertEqual(stats["negotiation_rounds"], 2)
+        self.assertEqual(stats["objects_packed"], 5)
+
+    def test_parse_events_missing(self):
+        """
+        Test parse_events() when git never wrote anything
+        """
+
+        self.assertIsNone(parse_events("/nonexistent/events.json")["duration"])
+
+
+class TestGitTrace(TestCase):
+    """
+    Test GitTrace
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.git_trace = GitTrace()
+
+    def test_disabled(self):
+        """
+        Test GitTrace is off until enabled
+        """
+
+        self.assertFalse(self.git_trace.enabled)
+        self.git_trace.enable(os.path.join(self.tmp_dir.name, "trace"))
+        self.assertTrue(self.git_trace.enabled)
+
+    def test_command(self):
+        """
+        Test GitTrace.command() with a real git, labeled with the span
+        """
+
+        self.git_trace.enable(os.path.join(self.tmp_dir.name, "trace"))
+        clone_path = os.path.join(self.tmp_dir.name, "repo")
+        with tracer.span("clone", repo="repo"):
+            with self.git_trace.command("init", clone_path) as env:
+                subprocess.run(["git", "init", "-q", clone_path], env=env,
+                               check=True)
+
+        command = self.git_trace.commands[0]
+        self.assertEqual(command["command"], "init")
+        self.assertEqual(command["repo"], "repo")
+        self.assertEqual(command["phase"], "clone")
+        self.assertEqual(command["exit_code"], 0)
+        self.assertGreater(command["duration"], 0)
+        # the event files are cleaned up once read
+        self.assertEqual(os.listdir(self.git_trace.directory), [])
+
+    def test_summary(self):
+        """
+        Test GitTrace.summary() groups by command, phase and repo
+        """
+
+        base = {"duration": 1.0, "children": 1, "bytes_received": 10,
+                "negotiation_rounds": 1, "objects_packed": 0}
+        self.git_trace.commands = [
+            {**base, "command": "clone", "phase": "clone", "repo": "a"},
+            {**base, "command": "fetch", "phase": "clone", "repo": "a"},
+            {**base, "command": "push", "phase": "push_changes",
+             "repo": "b", "duration": 3.0},
+        ]
+        summary = self.git_trace.summary()
+        self.assertEqual(summary["commands"], 3)
+        self.assertEqual(summary["duration"], 5.0)
+        self.assertEqual(summary["by_command"][0]["name"], "push")
+        self.assertEqual(
+            [(row["name"], row["duration"]) for row in summary["by_repo"]],
+            [("b", 3.0), ("a", 2.0)])
+        self.assertEqual(summary["by_phase"][1]["bytes_received"], 20)
+        self.assertEqual(summary["slowest"][0]["repo"], "b")
@@ -0,0 +1,79 @@
+"""
+Test functions in graphql.py
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync import graphql
+from filesync.exceptions import GraphQLError
+
+
+class TestGraphQL(TestCase):
+    """
+    Test GraphQL helpers
+    """
+
+    def setUp(self):
+        self.github = MagicMock()
+        self.requester = self.github._Github__requester
+
+    def test_batched(self):
+        """
+        Test batched() splits a list into batches
+        """
+
+        self.assertEqual(list(graphql.batched([1, 2, 3], 2)), [[1, 2], [3]])
+
+    def test_query(self):
+        """
+        Test query() returns the data from the response
+        """
+
+        self.requester.requestJsonAndCheck.return_value = (
+            {}, {"data": {"viewer": {"login": "me"}}})
+        self.assertEqual(graphql.query(self.github, "query { viewer }"),
+                         {"viewer": {"login": "me"}})
+        self.requester.requestJsonAndCheck.assert_called_with(
+            "POST", "/graphql", input={"query": "query { viewer }"})
+
+    def test_query_partial_errors(self):
+        """
+        Test query() tolerates errors as long as there's data
+        """
+
+        self.requester.requestJsonAndCheck.return_value = (
+            {}, {"data": {"r0": None}, "errors": [{"message": "NOT_FOUND"}]})
+        self.assertEqual(graphql.query(self.github, "q"), {"r0": None})
+
+    def test_query_failed(self):
+        """
+        Test query() raises when there's no data at all
+        """
+
+        self.requester.requestJsonAndCheck.return_value = (
+            {}, {"data": None, "errors": [{"message": "bad query"}]})
+        with self.assertRaises(GraphQLError):
+            graphql.query(self.github, "q")
+
+    def test_search_pull_requests(self):
+        """
+        Test search_pull_requests() follows the pages of results
+        """
+
+        pr = {"number": 1, "headRefName": "filesync/tpl/abc"}
+        self.requester.requestJsonAndCheck.side_effect = [
+            ({}, {"data": {"search": {
+                "issueCount": 2,
+                "pageInfo": {"hasNextPage": True, "endCursor": "c1"},
+                "nodes": [pr, {}]}}}),
+            ({}, {"data": {"search": {
+                "issueCount": 2,
+                "pageInfo": {"hasNextPage": False, "endCursor": None},
+                "nodes": [pr]}}}),
+        ]
+        prs = graphql.search_pull_requests(self.github, "is:pr is:open")
+        self.assertEqual(prs, [pr, pr])
+        _, kwargs = self.requester.requestJsonAndCheck.call_args
+        self.assertEqual(kwargs["input"]["variables"],
+                         {"search": "is:pr is:open", "cursor": "c1"})
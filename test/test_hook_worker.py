@@ -0,0 +1,153 @@
+"""
+Test hook worker protocol
+"""
+
+import os
+import os.path
+import sys
+from io import StringIO
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+from unittest import TestCase
+
+from filesync.exceptions import HookFailure
+from filesync.hook_worker import HookWorkerPool, serve
+
+WORKER_SCRIPT = dedent("""\
+    #!{python}
+    import subprocess
+    import sys
+    sys.path.insert(0, {root!r})
+    from filesync.hook_worker import serve
+
+    def main(operation, clone_root, repo, answers_file, hook=None):
+        if repo == "crash":
+            sys.exit(3)
+        if repo == "bad":
+            print("no good", file=sys.stderr)
+            return 2
+        if repo == "linter":
+            subprocess.run(["echo", "linter says hi"], check=True)
+        print("fine")
+
+    if sys.argv[1:] == ["--worker"]:
+        serve(main)
+    else:
+        sys.exit(main(*sys.argv[1:]))
+""")
+
+# a worker that doesn't keep its stdout to the protocol
+NOISY_SCRIPT = dedent("""\
+    #!/bin/sh
+    while read line; do
+        echo "Cloning into 'vendor'..."
+    done
+""")
+
+
+class TestServe(TestCase):
+    """
+    Test serve()
+    """
+
+    def test_serve(self):
+        """
+        Test serve() answers each request and reports failures
+        """
+
+        def handler(operation, clone_root, repo, answers_file, hook=None):
+            print(f"{hook} {operation} {repo}")
+            if repo == "boom":
+                raise RuntimeError("boom")
+            return 0
+
+        stdin = StringIO(
+            '{"hook": "post-clone", "operation": "updating", '
+            '"clone_root": "/r", "repo": "one", "answers_file": ".a.yml"}\n'
+            "\n"
+            '{"hook": "post-clone", "operation": "updating", '
+            '"clone_root": "/r", "repo": "boom", "answers_file": ".a.yml"}\n'
+        )
+        stdout = StringIO()
+        serve(handler, stdin=stdin, stdout=stdout)
+        replies = stdout.getvalue().splitlines()
+        self.assertEqual(len(replies), 2)
+        self.assertIn('"returncode": 0', replies[0])
+        self.assertIn("post-clone updating one", replies[0])
+        self.assertIn('"returncode": 1', replies[1])
+        self.assertIn("RuntimeError: boom", replies[1])
+
+
+class TestHookWorkerPool(TestCase):
+    """
+    Test HookWorkerPool against a real worker process
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.script = os.path.join(self.tmp_dir.name, "hook.py")
+        self.write_script(WORKER_SCRIPT)
+        self.pool = HookWorkerPool()
+        self.addCleanup(self.pool.close)
+
+    def write_script(self, script):
+        """
+        Make the hook script run this
+        """
+
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with open(self.script, "w") as fout:
+            fout.write(script.format(python=sys.executable, root=root))
+        os.chmod(self.script, 0o755)
+
+    def run_hook(self, repo):
+        """
+        Send one hook call to the worker
+        """
+
+        return self.pool.run(self.script, "post-copier", "updating", "/r",
+                             repo, ".a.yml")
+
+    def test_run_reuses_worker(self):
+        """
+        Test HookWorkerPool.run() sends every call to the same process
+        """
+
+        self.assertEqual(self.run_hook("one"), (0, "fine\n"))
+        pid = self.pool.workers[self.script].process.pid
+        self.assertEqual(self.run_hook("bad"), (2, "no good\n"))
+        self.assertEqual(self.pool.workers[self.script].process.pid, pid)
+
+    def test_run_worker_exits(self):
+        """
+        Test HookWorkerPool.run() when the worker dies, and that the next
+        call starts a new one
+        """
+
+        with self.assertRaises(HookFailure):
+            self.run_hook("crash")
+        self.assertEqual(self.run_hook("one"), (0, "fine\n"))
+
+    def test_run_bad_reply(self):
+        """
+        Test HookWorkerPool.run() when the worker's stdout isn't a reply, and
+        that the next call starts a new worker
+        """
+
+        self.write_script(NOISY_SCRIPT)
+        with self.assertRaises(HookFailure) as context:
+            self.run_hook("one")
+        self.assertIn("Cloning into 'vendor'...", str(context.exception))
+        self.assertIsNone(self.pool.workers[self.script].process)
+        self.write_script(WORKER_SCRIPT)
+        self.assertEqual(self.run_hook("one"), (0, "fine\n"))
+
+    def test_run_subprocess(self):
+        """
+        Test HookWorkerPool.run() when the handler starts a process that
+        writes to stdout
+        """
+
+        self.assertEqual(self.run_hook("linter"), (0, "fine\n"))
+        self.assertEqual(self.run_hook("one"), (0, "fine\n"))
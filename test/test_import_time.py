@@ -0,0 +1,59 @@
+"""
+Test how long it takes to start the CLI
+"""
+
+import subprocess
+import sys
+from unittest import TestCase
+
+# how long importing filesync.cli may take, in microseconds. it was about
+# 65ms with everything heavy imported lazily, against over 600ms before
+IMPORT_TIME_BUDGET = 250000
+
+# dependencies that must only be imported once they're actually used
+LAZY_MODULES = ["copier", "github", "jinja2", "plumbum", "pydantic"]
+
+
+def import_time(module):
+    """
+    Import module in a fresh interpreter and return the cumulative import
+    time python -X importtime reports for it
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = [part.strip() for part in line.split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+class TestImportTime(TestCase):
+    """
+    Test CLI startup stays fast
+    """
+
+    def test_lazy_modules(self):
+        """
+        Test importing the CLI doesn't import any heavy dependencies
+        """
+
+        code = ("import sys, filesync.cli; "
+                f"print(','.join(m for m in {LAZY_MODULES!r} "
+                "if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", code],
+                                capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "")
+
+    def test_import_time(self):
+        """
+        Test importing the CLI stays within its budget
+        """
+
+        # the best of a few runs, so a busy machine doesn't fail the test
+        best = min(import_time("filesync.cli") for _ in range(3))
+        self.assertLess(best, IMPORT_TIME_BUDGET,
+                        f"importing filesync.cli took {best}us")
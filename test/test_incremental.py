@@ -0,0 +1,231 @@
+"""
+Test incremental.py
+"""
+
+import os
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import pathspec
+from sh import git
+
+from filesync.incremental import ANSWERS_HASH_KEY, RenderPlan, \
+                                 answers_hash, forget_affected
+from filesync.repo.template import Template
+
+
+def answers(**kwargs):
+    kwargs[ANSWERS_HASH_KEY] = answers_hash(kwargs)
+    return kwargs
+
+
+class TestRenderPlan(TestCase):
+    """
+    Test RenderPlan
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.template = MagicMock(clone_path=tmp_dir.name,
+                                  checked_out_head="new456")
+        self.template.file_at.return_value = None
+        self.template.resolve_commit.return_value = "3f2a9c1" + "0" * 33
+        self.write("copier.yml", "use_docker:\n  type: bool\n")
+        self.write("{{_copier_conf.answers_file}}.jinja",
+                   "{{ _copier_answers|to_nice_yaml }}")
+        self.write("Makefile", "test:\n\tpytest\n")
+        self.write("setup.cfg.jinja", "[flake8]\n")
+        self.write("{% if use_docker %}Dockerfile{% endif %}.jinja",
+                   "FROM python\n")
+        self.write(".github/workflows/ci.yml.jinja",
+                   "{% include 'partials/steps.yml' %}\n")
+        self.write("partials/steps.yml", "- run: make test\n")
+
+    def write(self, path, content):
+        path = os.path.join(self.template.clone_path, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as fout:
+            fout.write(content)
+
+    def plan(self, changed, since="3f2a9c1", **kwargs):
+        self.template.changed_files.return_value = changed
+        plan = RenderPlan(self.template, answers(**kwargs),
+                          ".copier-answers.yml")
+        return plan.plan(since)
+
+    def test_answers_hash(self):
+        """
+        Test answers_hash() ignores copier's own keys
+        """
+
+        self.assertEqual(answers_hash({"a": 1, "_commit": "abc"}),
+                         answers_hash({"a": 1}))
+        self.assertNotEqual(answers_hash({"a": 1}), answers_hash({"a": 2}))
+
+    def test_resolves_version(self):
+        """
+        Test RenderPlan.plan() diffs against the full sha of the version
+        copier recorded
+        """
+
+        self.plan(["setup.cfg.jinja"], since="v1.2.0-3-g3f2a9c1",
+                  use_docker=True)
+        self.template.resolve_commit.assert_called_with("v1.2.0-3-g3f2a9c1")
+        self.template.changed_files.assert_called_with("3f2a9c1" + "0" * 33)
+
+    def test_changed_file(self):
+        """
+        Test RenderPlan.plan() renders a changed template file
+        """
+
+        plan = self.plan(["setup.cfg.jinja"], use_docker=True)
+        self.assertEqual(plan.paths, {"setup.cfg"})
+        self.assertFalse(plan.skip)
+
+    def test_conditional_file_skipped(self):
+        """
+        Test RenderPlan.plan() has nothing to do when the only changed file
+        isn't rendered for the repo's answers
+        """
+
+        changed = ["{% if use_docker %}Dockerfile{% endif %}.jinja"]
+        self.assertTrue(self.plan(changed, use_docker=False).skip)
+        self.assertEqual(self.plan(changed, use_docker=True).paths,
+                         {"Dockerfile"})
+
+    def test_included_file(self):
+        """
+        Test RenderPlan.plan() renders the files including a changed partial
+        """
+
+        self.write("copier.yml", "_exclude: [partials, copier.yml]\n")
+        plan = self.plan(["partials/steps.yml"], use_docker=True)
+        self.assertEqual(plan.paths, {".github/workflows/ci.yml"})
+
+    def test_question_changed(self):
+        """
+        Test RenderPlan.plan() renders files using a question whose default
+        changed
+        """
+
+        self.template.file_at.return_value = "use_docker:\n  type: str\n"
+        plan = self.plan(["copier.yml"], use_docker=True)
+        self.assertEqual(plan.paths, {"Dockerfile"})
+
+    def test_setting_changed(self):
+        """
+        Test RenderPlan.plan() renders everything when a copier setting
+        changed
+        """
+
+        self.write("copier.yml", "_subdirectory: template\n")
+        plan = self.plan(["copier.yml"], use_docker=True)
+        self.assertTrue(plan.full)
+        self.assertEqual(plan.exclude(), ())
+
+    def test_answers_changed(self):
+        """
+        Test RenderPlan.plan() renders everything when the answers changed
+        since the last render
+        """
+
+        plan = RenderPlan(self.template, {"use_docker": True,
+                                          ANSWERS_HASH_KEY: "stale"},
+                          ".copier-answers.yml").plan("3f2a9c1")
+        self.assertTrue(plan.full)
+
+    def test_no_diff(self):
+        """
+        Test RenderPlan.plan() renders everything when the template can't be
+        diffed
+        """
+
+        self.assertTrue(self.plan(None, use_docker=True).full)
+        self.template.resolve_commit.return_value = None
+        self.assertTrue(self.plan(["Makefile"], since="v0.1.0-2-g0badc0d",
+                                  use_docker=True).full)
+        self.assertTrue(self.plan(["Makefile"], since=None).full)
+
+    def test_forget_affected(self):
+        """
+        Test forget_affected() makes the next plan diff the template again
+        """
+
+        self.plan(["setup.cfg.jinja"], use_docker=True)
+        self.plan(["setup.cfg.jinja"], use_docker=False)
+        self.assertEqual(self.template.changed_files.call_count, 1)
+        forget_affected()
+        self.plan(["setup.cfg.jinja"], use_docker=True)
+        self.assertEqual(self.template.changed_files.call_count, 2)
+
+    def test_exclude(self):
+        """
+        Test RenderPlan.exclude() leaves out everything but the plan
+        """
+
+        plan = self.plan([".github/workflows/ci.yml.jinja"], use_docker=True)
+        spec = pathspec.PathSpec.from_lines("gitwildmatch", plan.exclude())
+        for path in [".github", ".github/workflows",
+                     ".github/workflows/ci.yml", ".copier-answers.yml"]:
+            self.assertFalse(spec.match_file(path), path)
+        for path in ["Makefile", ".github/CODEOWNERS", "setup.cfg"]:
+            self.assertTrue(spec.match_file(path), path)
+
+
+class TestRenderPlanGit(TestCase):
+    """
+    Test RenderPlan against a real shallow template clone
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        origin = os.path.join(tmp_dir.name, "origin")
+        os.makedirs(origin)
+        self.origin = git.bake(_cwd=origin)
+        self.origin("init", "-q")
+        self.origin("config", "uploadpack.allowAnySHA1InWant", "true")
+        self.commit("Makefile", "test:\n\tpytest\n")
+        self.write("setup.cfg.jinja", "[flake8]\n")
+        self.old = self.commit("copier.yml", "use_docker:\n  type: bool\n")
+        self.commit("setup.cfg.jinja", "[flake8]\nmax-line-length = 100\n")
+
+        clone_root = os.path.join(tmp_dir.name, "clones")
+        git("clone", "-q", "--depth", "1", f"file://{origin}",
+            os.path.join(clone_root, "template"))
+        with patch("filesync.repo.template.BaseRepo.clone"):
+            with patch("filesync.repo.template.Template.load_template_config"):
+                self.template = Template(
+                    name="template",
+                    token="fake_token",
+                    github=MagicMock(),
+                    clone_root=clone_root,
+                )
+        self.template.github.get_commit.return_value.sha = self.old
+
+    def write(self, path, content):
+        with open(os.path.join(str(self.origin._partial_call_args["cwd"]),
+                               path), "w") as fout:
+            fout.write(content)
+
+    def commit(self, path, content):
+        self.write(path, content)
+        self.origin("add", "-A")
+        self.origin("-c", "user.name=test", "-c", "user.email=test@test",
+                    "commit", "-q", "-m", f"change {path}")
+        return str(self.origin("rev-parse", "HEAD")).strip()
+
+    def test_abbreviated_version(self):
+        """
+        Test RenderPlan.plan() renders only the changed file when copier
+        recorded an abbreviated sha the shallow clone has never seen
+        """
+
+        plan = RenderPlan(self.template, answers(use_docker=False),
+                          ".copier-answers.yml").plan(self.old[:7])
+        self.assertFalse(plan.full, plan.reason)
+        self.assertEqual(plan.paths, {"setup.cfg"})
+        self.template.github.get_commit.assert_called_with(self.old[:7])
@@ -0,0 +1,151 @@
+"""
+Test Inventory class
+"""
+
+import os.path
+from datetime import date
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from filesync.exceptions import InventoryMissingError, \
+                                UnrecognizedPredicateError
+from filesync.inventory import Inventory, parse_predicate
+
+
+class TestParsePredicate(TestCase):
+    """
+    Test parse_predicate()
+    """
+
+    def test_parse_predicate_equals(self):
+        """
+        Test parse_predicate() with key=value
+        """
+
+        self.assertEqual(parse_predicate("lang=python"),
+                         ("lang", False, "python"))
+
+    def test_parse_predicate_not_equals(self):
+        """
+        Test parse_predicate() with key!=value, where value isn't a string
+        """
+
+        self.assertEqual(parse_predicate("docker!=true"),
+                         ("docker", True, True))
+
+    def test_parse_predicate_invalid(self):
+        """
+        Test parse_predicate() without an operator
+        """
+
+        with self.assertRaises(UnrecognizedPredicateError):
+            parse_predicate("docker")
+        with self.assertRaises(UnrecognizedPredicateError):
+            parse_predicate("docker=[true")
+
+    def test_parse_predicate_date(self):
+        """
+        Test parse_predicate() keeps dates the way the inventory stores them
+        """
+
+        self.assertEqual(parse_predicate("since=2024-03-01"),
+                         ("since", False, "2024-03-01"))
+
+
+class TestInventory(TestCase):
+    """
+    Test Inventory
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.inventory = Inventory(
+            os.path.join(self.tmp_dir.name, "inventory", "tpl.json"))
+        self.inventory.add("a", {"_template_version": "abc", "lang": "go"})
+        self.inventory.add("b", None)
+        self.inventory.add("c", {"_template_version": "abc", "docker": True,
+                                 "lang": "python"})
+
+    def test_add(self):
+        """
+        Test Inventory.add() keeps every column the same length
+        """
+
+        self.assertEqual(self.inventory.column("docker"), [None, None, True])
+        self.assertEqual(self.inventory.column("lang"), ["go", None, "python"])
+        self.assertEqual(self.inventory.column("missing"), [None] * 3)
+
+    def test_version_distribution(self):
+        """
+        Test Inventory.version_distribution()
+        """
+
+        self.assertEqual(self.inventory.version_distribution(),
+                         {"abc": 2, None: 1})
+
+    def test_where(self):
+        """
+        Test Inventory.where() ANDs predicates together
+        """
+
+        self.assertEqual(self.inventory.where(["_template_version=abc"]),
+                         ["a", "c"])
+        self.assertEqual(
+            self.inventory.where(["_template_version=abc", "docker!=true"]),
+            ["a"])
+
+    def test_save_and_load(self):
+        """
+        Test Inventory round-trips through save() and load()
+        """
+
+        self.inventory.save()
+        loaded = Inventory(self.inventory.path).load()
+        self.assertEqual(loaded.repos, ["a", "b", "c"])
+        self.assertEqual(loaded.where(["lang=python"]), ["c"])
+
+    def test_save_and_load_dates(self):
+        """
+        Test dates in answers match the same predicates before and after a
+        round trip
+        """
+
+        self.inventory.add("d", {"since": date(2024, 3, 1),
+                                 "windows": [{"start": date(2024, 3, 2)}]})
+        self.assertEqual(self.inventory.where(["since=2024-03-01"]), ["d"])
+        self.inventory.save()
+        loaded = Inventory(self.inventory.path).load()
+        self.assertEqual(loaded.where(["since=2024-03-01"]), ["d"])
+        self.assertEqual(loaded.column("windows")[3],
+                         [{"start": "2024-03-02"}])
+
+    def test_load_missing(self):
+        """
+        Test Inventory.load() when there's no inventory yet
+        """
+
+        with self.assertRaises(InventoryMissingError):
+            Inventory(os.path.join(self.tmp_dir.name, "nope.json")).load()
+
+    @patch("filesync.inventory.graphql.query")
+    def test_fetch(self, mock_query):
+        """
+        Test Inventory.fetch() falls back to old answers files
+        """
+
+        mock_query.return_value = {
+            "r0": {"a0": None, "a1": {"text": "_template_version: def\n"}},
+            "r1": None,
+        }
+        inventory = Inventory(self.inventory.path)
+        inventory.fetch("fake_github", [
+            ("org/one", "org", "one", [".new.yml", ".old.yml"]),
+            ("two", "org", "two", [".new.yml"]),
+        ])
+        self.assertEqual(inventory.repos, ["org/one", "two"])
+        self.assertEqual(inventory.column("_template_version"), ["def", None])
+        query = mock_query.call_args[0][1]
+        self.assertIn('r0: repository(owner: "org", name: "one")', query)
+        self.assertIn('a1: object(expression: "HEAD:.old.yml")', query)
@@ -0,0 +1,73 @@
+"""
+Test job_context.py
+"""
+
+import threading
+from contextvars import copy_context
+from unittest import TestCase
+
+from filesync.job_context import PerJob, job_context
+
+
+class Counter(object):
+    # pylint: disable=too-few-public-methods
+    """
+    Run-wide state to keep per job
+    """
+
+    def __init__(self):
+        self.count = 0
+
+
+class TestPerJob(TestCase):
+    """
+    Test PerJob
+    """
+
+    def setUp(self):
+        self.counter = PerJob(Counter)
+
+    def test_outside_job(self):
+        """
+        Test PerJob passes everything on to one instance outside a job
+        """
+
+        self.counter.count += 1
+        self.counter.count += 1
+        self.assertEqual(self.counter.count, 2)
+
+    def test_jobs_kept_apart(self):
+        """
+        Test each job, and its threads, get their own instance
+        """
+
+        counts = dict()
+        done = threading.Barrier(2)
+
+        def job(name, amount):
+            with job_context():
+                worker = threading.Thread(
+                    target=copy_context().run,
+                    args=[self.add, amount])
+                worker.start()
+                worker.join()
+                self.add(amount)
+                # both jobs are running at this point
+                done.wait()
+                counts[name] = self.counter.count
+
+        threads = [threading.Thread(target=job, args=[name, amount])
+                   for name, amount in [("a", 1), ("b", 10)]]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counts, {"a": 2, "b": 20})
+        self.assertEqual(self.counter.count, 0)
+
+    def add(self, amount):
+        """
+        Count for whichever job the caller is part of
+        """
+
+        self.counter.count += amount
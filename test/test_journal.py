@@ -0,0 +1,103 @@
+"""
+Test journal.py
+"""
+
+import json
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync.journal import Journal
+
+
+def spec(name, outcome, **kwargs):
+    return MagicMock(listed_name=name, outcome=outcome,
+                     **{"error": None, "error_class": None, "pr_url": None,
+                        "duration": None, "api_calls": None,
+                        "disk_usage": None, **kwargs})
+
+
+class TestJournal(TestCase):
+    """
+    Test Journal
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = os.path.join(tmp_dir.name, "journals", "run.jsonl")
+        self.journal = Journal(self.path)
+
+    def test_record(self):
+        """
+        Test Journal.record() appends one line per repo
+        """
+
+        self.journal.record(spec("org/a", "pushed",
+                                 pr_url="https://github.com/org/a/pull/1"),
+                            "abc")
+        self.journal.record(spec("b", "failed", error="dirty",
+                                 error_class="DirtyRepoError"), "abc")
+
+        with open(self.path) as fin:
+            entries = [json.loads(line) for line in fin]
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]["repo"], "org/a")
+        self.assertEqual(entries[0]["template_sha"], "abc")
+        self.assertEqual(entries[0]["pr_url"],
+                         "https://github.com/org/a/pull/1")
+        self.assertEqual(entries[1]["error_class"], "DirtyRepoError")
+
+    def test_completed(self):
+        """
+        Test Journal.completed() only counts the same template commit
+        """
+
+        self.journal.record(spec("a", "pushed"), "abc")
+        self.journal.record(spec("b", "unchanged"), "abc")
+        self.journal.record(spec("c", "failed"), "abc")
+        self.journal.record(spec("d", "rendered"), "abc")
+        self.journal.record(spec("e", "pushed"), "old")
+
+        self.assertEqual(self.journal.completed("abc"), {"a", "b"})
+
+    def test_failed(self):
+        """
+        Test Journal.failed() goes by each repo's last entry
+        """
+
+        self.journal.record(spec("a", "failed"), "abc")
+        self.journal.record(spec("b", "failed"), "abc")
+        self.journal.record(spec("a", "pushed"), "abc")
+
+        self.assertEqual(self.journal.failed(), ["b"])
+
+    def test_entries_partial_line(self):
+        """
+        Test Journal.entries() skips a line cut off by a crash
+        """
+
+        self.journal.record(spec("a", "pushed"), "abc")
+        with open(self.path, "a") as fout:
+            fout.write('{"repo": "b", "outc')
+
+        self.assertEqual([entry["repo"] for entry in self.journal.entries()],
+                         ["a"])
+
+    def test_entries_missing(self):
+        """
+        Test Journal.entries() before anything was journaled
+        """
+
+        self.assertEqual(self.journal.entries(), [])
+
+    def test_durations(self):
+        """
+        Test Journal.durations() collects each repo's timed entries
+        """
+
+        self.journal.record(spec("a", "pushed", duration=12.5), "abc")
+        self.journal.record(spec("a", "failed", duration=3.0), "abc")
+        self.journal.record(spec("b", "deferred"), "abc")
+        self.assertEqual(self.journal.durations(), {"a": [12.5, 3.0]})
@@ -0,0 +1,139 @@
+"""
+Test manifest.py
+"""
+
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import yaml
+from sh import git
+
+from filesync.incremental import answers_hash
+from filesync.manifest import Manifest, batched, blob_sha, fetch_states
+
+
+def answers_text(**answers):
+    answers["_template_version"] = "abc123"
+    return yaml.dump(answers)
+
+
+class TestManifest(TestCase):
+    """
+    Test Manifest
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.manifest = Manifest(
+            os.path.join(self.tmp_dir.name, "manifests", "tpl", "repo.json"))
+        self.manifest.answers_file = ".copier-answers.yml"
+        self.manifest.answers_hash = answers_hash({"lang": "go"})
+        self.manifest.template_version = "abc123"
+        self.manifest.files = {"Makefile": "111", "setup.cfg": "222"}
+
+    def test_blob_sha(self):
+        """
+        Test blob_sha() gives a file the sha git does
+        """
+
+        path = os.path.join(self.tmp_dir.name, "Makefile")
+        with open(path, "w") as fout:
+            fout.write("test:\n\tpytest\n")
+        self.assertEqual(blob_sha(path),
+                         str(git("hash-object", path)).strip())
+
+    def test_save_and_load(self):
+        """
+        Test Manifest.save() writes what Manifest.load() reads
+        """
+
+        self.assertFalse(self.manifest.exists)
+        self.manifest.save()
+        self.assertTrue(self.manifest.exists)
+        loaded = Manifest(self.manifest.path).load()
+        self.assertEqual(loaded.files, self.manifest.files)
+        self.assertEqual(loaded.template_version, "abc123")
+        self.assertEqual(loaded.answers_hash, self.manifest.answers_hash)
+
+    def test_merge(self):
+        """
+        Test Manifest.merge() keeps the last sha of files left out of an
+        incremental render
+        """
+
+        previous = Manifest(None)
+        previous.files = {"Makefile": "000", "setup.cfg": "999"}
+        self.manifest.kept = {"setup.cfg"}
+        self.manifest.merge(previous)
+        self.assertEqual(self.manifest.files,
+                         {"Makefile": "111", "setup.cfg": "999"})
+
+    def test_compare_clean(self):
+        """
+        Test Manifest.compare() when nothing has changed
+        """
+
+        self.assertEqual(
+            self.manifest.compare(answers_text(lang="go"),
+                                  {"Makefile": "111", "setup.cfg": "222"}),
+            ("clean", []))
+
+    def test_compare_drifted(self):
+        """
+        Test Manifest.compare() lists edited and deleted files
+        """
+
+        self.assertEqual(
+            self.manifest.compare(answers_text(lang="go"),
+                                  {"Makefile": "333", "setup.cfg": None}),
+            ("drifted", ["Makefile", "setup.cfg"]))
+
+    def test_compare_answers(self):
+        """
+        Test Manifest.compare() when the answers file doesn't match
+        """
+
+        files = dict(self.manifest.files)
+        self.assertEqual(
+            self.manifest.compare(answers_text(lang="rust"), files),
+            ("answers-changed", []))
+        self.manifest.template_version = "def456"
+        self.assertEqual(
+            self.manifest.compare(answers_text(lang="go"), files),
+            ("behind", []))
+        self.assertEqual(self.manifest.compare(None, files),
+                         ("no-answers", []))
+
+    def test_batched(self):
+        """
+        Test batched() caps the files asked about in one query
+        """
+
+        big = Manifest(None)
+        big.files = {str(i): "sha" for i in range(300)}
+        targets = [("a", "org", "a", big), ("b", "org", "b", big),
+                   ("c", "org", "c", self.manifest)]
+        self.assertEqual([[target[0] for target in batch]
+                          for batch in batched(targets)],
+                         [["a"], ["b", "c"]])
+
+    @patch("filesync.manifest.graphql.query")
+    def test_fetch_states(self, mock_query):
+        """
+        Test fetch_states() compares each repo with its manifest
+        """
+
+        mock_query.return_value = {
+            "r0": {"a": {"text": answers_text(lang="go")},
+                   "f0": {"oid": "111"}, "f1": {"oid": "222"}},
+            "r1": None,
+        }
+        states = list(fetch_states(MagicMock(), [
+            ("a", "org", "a", self.manifest),
+            ("b", "org", "b", self.manifest)]))
+        self.assertEqual(states, [("a", "clean", []), ("b", "missing", [])])
+        query = mock_query.call_args[0][1]
+        self.assertIn('f0: object(expression: "HEAD:Makefile")', query)
@@ -0,0 +1,72 @@
+"""
+Test memory.py
+"""
+
+import json
+import os.path
+import tracemalloc
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from filesync.memory import MemoryTracker, peak_rss
+from filesync.tracing import Tracer
+
+
+class TestMemoryTracker(TestCase):
+    """
+    Test MemoryTracker
+    """
+
+    def setUp(self):
+        self.tracer = Tracer()
+        tracer_patch = patch("filesync.memory.tracer", self.tracer)
+        tracer_patch.start()
+        self.addCleanup(tracer_patch.stop)
+        self.addCleanup(tracemalloc.stop)
+        self.tracker = MemoryTracker()
+
+    def test_phases(self):
+        """
+        Test MemoryTracker records growth per phase once started
+        """
+
+        with self.tracer.span("before"):
+            pass
+        self.tracker.start()
+        self.assertTrue(self.tracker.enabled)
+        kept = list()
+        for _ in range(2):
+            with self.tracer.span("clone"):
+                kept.append(bytearray(2**20))
+
+        summary = self.tracker.summary()
+        phases = {phase["name"]: phase for phase in summary["phases"]}
+        self.assertEqual(list(phases), ["clone"])
+        self.assertEqual(phases["clone"]["count"], 2)
+        self.assertGreaterEqual(phases["clone"]["traced_growth"], 2 * 2**20)
+        self.assertGreaterEqual(phases["clone"]["max_traced_growth"], 2**20)
+        self.assertGreaterEqual(summary["peak_traced"], 2 * 2**20)
+        self.assertTrue(summary["top_allocations"])
+
+    def test_write_report(self):
+        """
+        Test MemoryTracker.write_report() writes the summary as JSON
+        """
+
+        self.tracker.start()
+        with self.tracer.span("update"):
+            pass
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "memory.json")
+            self.tracker.write_report(path)
+            with open(path) as fin:
+                report = json.load(fin)
+        self.assertEqual(report["phases"][0]["name"], "update")
+
+    def test_peak_rss(self):
+        """
+        Test peak_rss() is in bytes
+        """
+
+        self.assertGreater(peak_rss(), 2**20)
@@ -0,0 +1,122 @@
+"""
+Test metrics.py
+"""
+
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from filesync.metrics import RunMetrics, disk_usage
+from filesync.tracing import Tracer
+
+LABELS = {"template": "tpl", "operation": "updating"}
+
+
+class TestRunMetrics(TestCase):
+    """
+    Test RunMetrics
+    """
+
+    def setUp(self):
+        self.metrics = RunMetrics()
+        self.tracer = Tracer()
+        self.tracer_patch = patch("filesync.metrics.tracer", self.tracer)
+        self.tracer_patch.start()
+        self.addCleanup(self.tracer_patch.stop)
+
+    def test_render(self):
+        """
+        Test RunMetrics.render() outcomes, counters and labels
+        """
+
+        repos = [MagicMock(outcome=outcome)
+                 for outcome in ["pushed", "pushed", "failed", None]]
+        self.metrics.count("repos_scanned", 7)
+        self.metrics.count("pull_requests_opened")
+
+        with TemporaryDirectory() as tmp_dir:
+            text = self.metrics.render(LABELS, repos, tmp_dir)
+
+        labels = 'template="tpl",operation="updating"'
+        self.assertIn(f"filesync_repos_scanned{{{labels}}} 7", text)
+        self.assertIn(f'filesync_repos{{{labels},outcome="pushed"}} 2', text)
+        self.assertIn(f'filesync_repos{{{labels},outcome="failed"}} 1', text)
+        self.assertIn(f'filesync_repos{{{labels},outcome="pending"}} 1', text)
+        self.assertIn(f'filesync_repos{{{labels},outcome="skipped"}} 0', text)
+        self.assertIn(
+            f'filesync_pull_requests{{{labels},action="opened"}} 1', text)
+        self.assertIn(f"filesync_run_in_progress{{{labels}}} 0", text)
+        self.assertIn("# TYPE filesync_phase_duration_seconds histogram",
+                      text)
+
+    def test_phase_durations(self):
+        """
+        Test RunMetrics.phase_durations() builds cumulative buckets
+        """
+
+        for _ in range(2):
+            with self.tracer.span("clone"):
+                pass
+        self.tracer.spans[0].duration = 0.05
+        self.tracer.spans[1].duration = 7
+
+        lines = self.metrics.phase_durations().render({})
+        self.assertIn('filesync_phase_duration_seconds_bucket'
+                      '{phase="clone",le="0.1"} 1', lines)
+        self.assertIn('filesync_phase_duration_seconds_bucket'
+                      '{phase="clone",le="10"} 2', lines)
+        self.assertIn('filesync_phase_duration_seconds_bucket'
+                      '{phase="clone",le="+Inf"} 2', lines)
+        self.assertIn('filesync_phase_duration_seconds_count'
+                      '{phase="clone"} 2', lines)
+        self.assertIn('filesync_phase_duration_seconds_sum'
+                      '{phase="clone"} 7.05', lines)
+
+    def test_escape(self):
+        """
+        Test label values are escaped
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            text = self.metrics.render({"template": 'a"b\\c'}, [], tmp_dir)
+        self.assertIn('template="a\\"b\\\\c"', text)
+
+    def test_write(self):
+        """
+        Test RunMetrics.write() writes the file, and maybe_write() waits
+        between writes
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "filesync.prom")
+            self.metrics.maybe_write(path, LABELS, [], tmp_dir)
+            with open(path) as fin:
+                self.assertIn("filesync_run_in_progress", fin.read())
+            self.assertEqual(os.listdir(tmp_dir), ["filesync.prom"])
+
+            os.remove(path)
+            self.metrics.maybe_write(path, LABELS, [], tmp_dir)
+            self.assertFalse(os.path.exists(path))
+
+    def test_write_failure(self):
+        """
+        Test RunMetrics.write() only warns when the file can't be written
+        """
+
+        with self.assertLogs("RunMetrics", level="WARNING"):
+            self.metrics.write("/nonexistent/dir/filesync.prom", LABELS, [],
+                               "/nonexistent")
+
+    def test_disk_usage(self):
+        """
+        Test disk_usage() adds up file sizes
+        """
+
+        with TemporaryDirectory() as tmp_dir:
+            os.makedirs(os.path.join(tmp_dir, "sub"))
+            for name, size in [("a", 3), ("sub/b", 4)]:
+                with open(os.path.join(tmp_dir, name), "w") as fout:
+                    fout.write("x" * size)
+            self.assertEqual(disk_usage(tmp_dir), 7)
+        self.assertEqual(disk_usage("/nonexistent"), 0)
@@ -0,0 +1,147 @@
+"""
+Test profiling.py
+"""
+
+import json
+import os.path
+import pstats
+import signal
+import threading
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
+
+from filesync.profiling import Profiler, Sampler, profile_name
+
+
+def busy():
+    """
+    Something to profile
+    """
+
+    return sum(i * i for i in range(20000))
+
+
+def update():
+    """
+    A step named like Repository.update
+    """
+
+    busy()
+
+
+class TestProfiler(TestCase):
+    """
+    Test Profiler
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.directory = os.path.join(self.tmp_dir.name, "profiles")
+
+    def test_profile_name(self):
+        """
+        Test profile_name() makes safe file names
+        """
+
+        self.assertEqual(profile_name("repo", "a/b c", "update"),
+                         "repo-a_b_c-update")
+
+    def test_repo_mode(self):
+        """
+        Test Profiler.profile_repo() writes a .pstats file per repo step and
+        finish() writes a merged summary
+        """
+
+        profiler = Profiler("repo", None, self.directory)
+        for repo in ["one", "two"]:
+            with profiler.profile_repo(repo, update):
+                update()
+        profiler.finish()
+
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(files, ["repo-one-update.pstats",
+                                 "repo-two-update.pstats", "summary.txt"])
+        stats = pstats.Stats(os.path.join(self.directory, files[0]))
+        self.assertTrue(any(func[2] == "busy" for func in stats.stats))
+        with open(os.path.join(self.directory, "summary.txt")) as fin:
+            self.assertIn("busy", fin.read())
+
+    def test_repo_mode_other_thread(self):
+        """
+        Test Profiler.profile_repo() skips repos worked on in other threads
+        """
+
+        profiler = Profiler("repo", None, self.directory)
+
+        def work():
+            with profiler.profile_repo("one", update):
+                update()
+
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+        self.assertEqual(profiler.profiles, [])
+
+    def test_run_mode(self):
+        """
+        Test Profiler in run mode only profiles the run as a whole
+        """
+
+        profiler = Profiler("run", "cprofile", self.directory)
+        profiler.start_run()
+        with profiler.profile_repo("one", update):
+            update()
+        profiler.finish()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ["run.pstats", "summary.txt"])
+
+    def test_disabled(self):
+        """
+        Test Profiler does nothing without a mode
+        """
+
+        profiler = Profiler(None, None, self.directory)
+        profiler.start_run()
+        with profiler.profile_repo("one", update):
+            update()
+        profiler.finish()
+        self.assertFalse(os.path.exists(self.directory))
+
+    def test_sampling(self):
+        """
+        Test Profiler with the sampling profiler writes speedscope files
+        """
+
+        profiler = Profiler("run", "sampling", self.directory)
+        profiler.start_run()
+        sleep(0.05)
+        profiler.finish()
+
+        path = os.path.join(self.directory, "run.speedscope.json")
+        with open(path) as fin:
+            profile = json.load(fin)
+        samples = profile["profiles"][0]["samples"]
+        self.assertTrue(samples)
+        frames = profile["shared"]["frames"]
+        self.assertEqual(frames[samples[0][-1]]["name"], "test_sampling")
+        with open(os.path.join(self.directory, "summary.txt")) as fin:
+            self.assertIn("test_sampling", fin.read())
+
+
+class TestSampler(TestCase):
+    """
+    Test Sampler
+    """
+
+    def test_restores_handler(self):
+        """
+        Test Sampler.disable() puts the previous SIGALRM handler back
+        """
+
+        previous = signal.getsignal(signal.SIGALRM)
+        sampler = Sampler()
+        sampler.enable()
+        sampler.disable()
+        self.assertEqual(signal.getsignal(signal.SIGALRM), previous)
@@ -7,7 +7,7 @@ Unit tests for filesync/repo/base_repo.py
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
-from sh import ErrorReturnCode
+from sh import ErrorReturnCode, ErrorReturnCode_128
 
 from filesync.exceptions import DirtyRepoError, UnrecognizableBaseBranchError
 from filesync.repo.base_repo import BaseRepo
@@ -212,7 +212,7 @@ class TestBaseRepo(TestCase):
         """
 
         self.test_repo.git_cmd("clone", "some args")
-        mock_git.assert_called_with("clone", "some args")
+        mock_git.assert_called_with("clone", "some args", _tty_out=False)
 
     @patch("filesync.repo.base_repo.git")
     def test_git_cmd_no_clone(self, mock_git):
@@ -222,9 +222,56 @@ class TestBaseRepo(TestCase):
 
         self.test_repo.git_cmd("commit", "some args")
         mock_git.assert_called_with(
-            "commit", "some args", _cwd="/fake/root/fake repo"
+            "commit", "some args", _tty_out=False,
+            _cwd="/fake/root/fake repo"
         )
 
+    @patch("filesync.repo.base_repo.git_trace")
+    @patch("filesync.repo.base_repo.git")
+    def test_git_cmd_traced(self, mock_git, mock_git_trace):
+        """
+        Test BaseRepo.git_cmd() runs git with the trace2 environment
+        """
+
+        mock_git_trace.enabled = True
+        env = mock_git_trace.command.return_value.__enter__.return_value
+        self.test_repo.git_cmd("fetch", "origin")
+        mock_git_trace.command.assert_called_with(
+            "fetch", "/fake/root/fake repo")
+        mock_git.assert_called_with(
+            "fetch", "origin", _env=env, _tty_out=False,
+            _cwd="/fake/root/fake repo"
+        )
+
+    @patch("filesync.retry.sleep")
+    @patch("filesync.repo.base_repo.rmtree")
+    @patch("filesync.repo.base_repo.git")
+    def test_git_cmd_clone_retried(self, mock_git, mock_rmtree, mock_sleep):
+        """
+        Test BaseRepo.git_cmd() retries a clone that hit a network error
+        """
+
+        error = ErrorReturnCode_128(
+            "git clone", b"", b"fatal: the remote end hung up unexpectedly")
+        mock_git.side_effect = [error, "cloned"]
+        self.assertEqual(self.test_repo.git_cmd("clone", "url", "path"),
+                         "cloned")
+        mock_rmtree.assert_called_with("/fake/root/fake repo",
+                                       ignore_errors=True)
+        mock_sleep.assert_called_once()
+
+    @patch("filesync.repo.base_repo.git")
+    def test_git_cmd_not_retried(self, mock_git):
+        """
+        Test BaseRepo.git_cmd() doesn't retry errors that aren't transient
+        """
+
+        mock_git.side_effect = ErrorReturnCode_128(
+            "git push", b"", b"error: failed to push some refs")
+        with self.assertRaises(ErrorReturnCode_128):
+            self.test_repo.git_cmd("push")
+        mock_git.assert_called_once()
+
     @patch.object(BaseRepo, "active_branch", "fake_branch")
     @patch.object(BaseRepo, "base_branch", "fake_branch")
     @patch("filesync.repo.base_repo.BaseRepo.git_cmd")
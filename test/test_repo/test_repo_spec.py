@@ -0,0 +1,50 @@
+"""
+Tests for filesync.repo.repo_spec
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync.repo.repo_spec import RepoSpec
+
+
+class TestRepoSpec(TestCase):
+    """
+    Tests for filesync.repo.repo_spec:RepoSpec
+    """
+
+    def setUp(self):
+        self.spec = RepoSpec("fake_repo", "fake_org", {"reuse_pr": True},
+                             "/fake/root")
+
+    def test_init(self):
+        """
+        Test RepoSpec() works out the clone path and starts pending
+        """
+
+        self.assertEqual(self.spec.clone_path, "/fake/root/fake_repo")
+        self.assertEqual(self.spec.listed_name, "fake_repo")
+        self.assertIsNone(self.spec.outcome)
+        self.assertIsNone(self.spec.error)
+
+    def test_slots(self):
+        """
+        Test RepoSpec has no __dict__ to keep it small
+        """
+
+        with self.assertRaises(AttributeError):
+            self.spec.github = MagicMock()
+
+    def test_record(self):
+        """
+        Test RepoSpec.record() keeps what happened to the repo
+        """
+
+        repo = MagicMock(operation="updating", outcome="failed", error="x",
+                         error_class="DirtyRepoError", pr_url=None)
+        self.spec.record(repo)
+        self.assertEqual(self.spec.operation, "updating")
+        self.assertEqual(self.spec.outcome, "failed")
+        self.assertEqual(self.spec.error, "x")
+        self.assertEqual(self.spec.error_class, "DirtyRepoError")
+        self.assertIsNone(self.spec.pr_url)
@@ -4,10 +4,17 @@ Unit tests for filesync/repo/repository.py
 # pylint: disable=protected-access,too-many-arguments,too-many-public-methods
 # pylint: disable=unused-argument
 
+import os
+import os.path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 from unittest.mock import MagicMock, patch
 
-from filesync.exceptions import HookFailure
+import yaml
+
+from filesync.exceptions import HookFailure, RunSupersededError
+from filesync.incremental import answers_hash
+from filesync.manifest import blob_sha
 from filesync.repo.repository import Repository
 from filesync.repo.template import Template
 
@@ -120,6 +127,83 @@ class TestRepository(TestCase):
 
         self.assertTrue(self.test_repo.needs_update)
 
+    @patch.object(Repository, "update_branch_is_current", True)
+    @patch.object(Repository, "update_branch_name", "test/fake_template")
+    @patch.object(Template, "head", "abc123")
+    def test_needs_update_reuse_pr_current(self):
+        """
+        Test Repository.needs_update when the reused branch already has the
+        template head
+        """
+
+        self.test_repo.reuse_pr = True
+        self.assertFalse(self.test_repo.needs_update)
+
+    @patch.object(Repository, "update_branch_is_current", False)
+    @patch.object(Repository, "has_update_branch", True)
+    @patch.object(Repository, "template_version", "def456")
+    @patch.object(Template, "head", "abc123")
+    def test_needs_update_reuse_pr_behind(self):
+        """
+        Test Repository.needs_update when the reused branch exists but has an
+        older template commit
+        """
+
+        self.test_repo.reuse_pr = True
+        self.assertTrue(self.test_repo.needs_update)
+
+    @patch.object(Repository, "update_branch_is_current", True)
+    @patch.object(Repository, "has_update_branch", False)
+    @patch.object(Repository, "template_version", "abc123")
+    @patch.object(Template, "head", "abc123")
+    def test_needs_update_answers_changed(self):
+        """
+        Test Repository.needs_update when the answers changed but the repo is
+        at the template head
+        """
+
+        self.test_repo.answers_changed = True
+        self.assertTrue(self.test_repo.needs_update)
+        self.test_repo.reuse_pr = True
+        self.assertTrue(self.test_repo.needs_update)
+
+    @patch.object(Repository, "has_update_branch", True)
+    @patch.object(Repository, "update_branch_name", "test/fake_template")
+    @patch.object(Template, "head", "abc123")
+    def test_update_branch_is_current(self):
+        """
+        Test Repository.update_branch_is_current reads the branch's commit
+        message
+        """
+
+        branch = self.test_repo.github.get_branch()
+        branch.commit.commit.message = "ci: updating\n\ncommit: abc123\n"
+        self.assertTrue(self.test_repo.update_branch_is_current)
+        branch.commit.commit.message = "ci: updating\n\ncommit: old456\n"
+        self.assertFalse(self.test_repo.update_branch_is_current)
+
+    @patch.object(Repository, "has_update_branch", False)
+    def test_update_branch_is_current_no_branch(self):
+        """
+        Test Repository.update_branch_is_current without a branch
+        """
+
+        self.assertFalse(self.test_repo.update_branch_is_current)
+
+    def test_update_branch_name_reuse_pr(self):
+        """
+        Test Repository.update_branch_name when reusing the PR
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.reuse_pr = True
+        self.test_repo.branch_prefix = "test"
+        self.test_repo.template.name = "fake_template"
+        self.assertEqual(
+            self.test_repo.update_branch_name,
+            "test/fake_template",
+        )
+
     @patch.object(Repository, "base_branch", "fake_main")
     def test_update_branch_name_fixing(self):
         """
@@ -143,6 +227,38 @@ class TestRepository(TestCase):
             "test/fake_template/abc123",
         )
 
+    def test_build_manifest(self):
+        """
+        Test Repository.build_manifest() hashes every file the template
+        renders for the repo's answers, but not the answers file
+        """
+
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        template_path = os.path.join(tmp_dir.name, "template")
+        self.test_repo.clone_path = os.path.join(tmp_dir.name, "repo")
+        self.template.clone_path = template_path
+        sources = {
+            os.path.join(template_path, "Makefile"): "",
+            os.path.join(template_path, "{{_copier_conf.answers_file}}.jinja"):
+                "",
+            os.path.join(template_path, "{% if docker %}Dockerfile"
+                                        "{% endif %}.jinja"): "",
+            os.path.join(self.test_repo.clone_path, "Makefile"): "test:\n",
+            os.path.join(self.test_repo.clone_path, ".copier-answers.yml"):
+                yaml.dump({"_template_version": "abc123", "docker": False}),
+        }
+        for path, content in sources.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as fout:
+                fout.write(content)
+
+        manifest = self.test_repo.build_manifest()
+        self.assertEqual(manifest.template_version, "abc123")
+        self.assertEqual(manifest.answers_hash, answers_hash({"docker": False}))
+        self.assertEqual(manifest.files, {"Makefile": blob_sha(
+            os.path.join(self.test_repo.clone_path, "Makefile"))})
+
     @patch("filesync.repo.repository.Repository.close_pr")
     @patch("filesync.repo.repository.Repository.delete_branch")
     def test_clean_stale_branches(self, mock_delete, mock_close):
@@ -159,6 +275,22 @@ class TestRepository(TestCase):
         mock_delete.assert_called()
         mock_close.assert_called_with(mock_pr)
 
+    @patch.object(Repository, "update_branch_name", "filesync/test_template")
+    @patch("filesync.repo.repository.Repository.close_pr")
+    @patch("filesync.repo.repository.Repository.delete_branch")
+    def test_clean_stale_branches_reuse_pr(self, mock_delete, mock_close):
+        """
+        Test Repository.clean_stale_branches keeps the reused branch
+        """
+
+        self.test_repo.reuse_pr = True
+        mock_branch = MagicMock()
+        mock_branch.name = "filesync/test_template"
+        self.test_repo.github.get_branches.return_value = [mock_branch]
+        self.test_repo.clean_stale_branches()
+        mock_delete.assert_not_called()
+        mock_close.assert_not_called()
+
     def test_close_pr_dry_run(self):
         """
         Test Repository.close_pr() with a dry run.
@@ -248,7 +380,8 @@ class TestRepository(TestCase):
         mock_load.return_value = {
             "_commit": "abc123",
             "test": "value",
-            "_src_path": "/tmp/dne"
+            "_src_path": "/tmp/dne",
+            "_answers_hash": "stale",
         }
         self.test_repo.munge_answers()
         mock_dump.assert_called_with(
@@ -256,6 +389,28 @@ class TestRepository(TestCase):
             mock_open().__enter__(),
         )
 
+    @patch("filesync.repo.repository.open")
+    @patch("yaml.safe_load")
+    @patch("yaml.dump")
+    def test_munge_answers_incremental(self, mock_dump, mock_load, mock_open):
+        """
+        Test Repository.munge_answers() records the answers' hash only for an
+        incremental render
+        """
+
+        mock_load.return_value = {
+            "_commit": "abc123",
+            "test": "value",
+            "_src_path": "/tmp/dne"
+        }
+        self.test_repo.incremental_render = True
+        self.test_repo.munge_answers()
+        mock_dump.assert_called_with(
+            {"_template_version": "abc123", "test": "value",
+             "_answers_hash": answers_hash({"test": "value"})},
+            mock_open().__enter__(),
+        )
+
     @patch("filesync.repo.repository.Repository.run_hook")
     def test_post_copier_hook(self, mock_hook):
         """
@@ -359,6 +514,46 @@ class TestRepository(TestCase):
             title="1", body="3\n4\n5", head="def456", base="abc123"
         )
 
+    @patch.object(Repository, "base_branch", "abc123")
+    @patch.object(Repository, "commit_message", "1\n\n3\n4\n5")
+    @patch.object(Repository, "update_branch_name", "def456")
+    def test_open_pull_request_reuse_pr_existing(self):
+        """
+        Test Repository.open_pull_request() edits an existing PR in place when
+        reusing the PR
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.reuse_pr = True
+        self.test_repo.dry_run = False
+        self.test_repo.github.owner.login = "fake_org"
+        existing = MagicMock()
+        self.test_repo.github.get_pulls.return_value = [existing]
+        self.test_repo.open_pull_request()
+        self.test_repo.github.get_pulls.assert_called_with(
+            state="open", head="fake_org:def456", base="abc123"
+        )
+        existing.edit.assert_called_with(title="1", body="3\n4\n5")
+        self.test_repo.github.create_pull.assert_not_called()
+
+    @patch.object(Repository, "base_branch", "abc123")
+    @patch.object(Repository, "commit_message", "1\n\n3\n4\n5")
+    @patch.object(Repository, "update_branch_name", "def456")
+    def test_open_pull_request_reuse_pr_none_open(self):
+        """
+        Test Repository.open_pull_request() opens a PR when reusing the PR
+        but none is open
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.reuse_pr = True
+        self.test_repo.dry_run = False
+        self.test_repo.github.get_pulls.return_value = []
+        self.test_repo.open_pull_request()
+        self.test_repo.github.create_pull.assert_called_with(
+            title="1", body="3\n4\n5", head="def456", base="abc123"
+        )
+
     @patch.object(Repository, "commit_message", "1\n\n3\n4\n5")
     @patch("filesync.repo.repository.Repository.git_cmd")
     def test_push_changes_dry_run(self, mock_git):
@@ -382,7 +577,21 @@ class TestRepository(TestCase):
         self.test_repo.push_changes()
         mock_git.assert_called_with("push")
 
-    @patch("filesync.repo.repository.copy")
+    @patch.object(Repository, "commit_message", "1\n\n3\n4\n5")
+    @patch.object(Repository, "update_branch_name", "def456")
+    @patch("filesync.repo.repository.Repository.git_cmd")
+    def test_push_changes_reuse_pr(self, mock_git):
+        """
+        Test Repository.push_changes() force-pushes when reusing the PR
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.reuse_pr = True
+        self.test_repo.dry_run = False
+        self.test_repo.push_changes()
+        mock_git.assert_called_with("push", "--force", "origin", "def456")
+
+    @patch("copier.copy")
     @patch("filesync.repo.repository.Repository.munge_answers")
     @patch("filesync.repo.template.Template.clone")
     def test_run_copier_interactive(self, mock_clone, mock_munge, mock_copy):
@@ -399,9 +608,11 @@ class TestRepository(TestCase):
             force=False,
             quiet=False,
             vcs_ref=None,
+            data={},
+            exclude=(),
         )
 
-    @patch("filesync.repo.repository.copy")
+    @patch("copier.copy")
     @patch("filesync.repo.repository.Repository.munge_answers")
     @patch("filesync.repo.template.Template.clone")
     def test_run_copier_noninteractive(self, mock_clone, mock_munge, mock_copy):
@@ -418,8 +629,23 @@ class TestRepository(TestCase):
             force=True,
             quiet=True,
             vcs_ref=None,
+            data={},
+            exclude=(),
         )
 
+    @patch("copier.copy")
+    @patch("filesync.repo.repository.Repository.munge_answers")
+    @patch("filesync.repo.template.Template.clone")
+    def test_run_copier_answers(self, mock_clone, mock_munge, mock_copy):
+        """
+        Test Repository.run_copier() with answers given up front
+        """
+
+        self.test_repo.answers = {"use_docker": True}
+        self.test_repo.run_copier()
+        _, kwargs = mock_copy.call_args
+        self.assertEqual(kwargs["data"], {"use_docker": True})
+
     @patch("filesync.repo.repository.subprocess.run")
     def test_run_hook_successful(self, mock_run):
         """
@@ -441,6 +667,28 @@ class TestRepository(TestCase):
             capture_output=True,
         )
 
+    @patch("filesync.repo.repository.subprocess.run")
+    def test_run_hook_worker(self, mock_run):
+        """
+        Test Repository.run_hook() with hook workers
+        """
+
+        self.test_repo.hooks["fake-hook"] = "post-fake"
+        self.test_repo.operation = "testing"
+        self.template.hook_workers = MagicMock()
+        self.template.hook_workers.run.return_value = (1, "nope\n")
+        with self.assertRaisesRegex(HookFailure, 'stderr: "nope"'):
+            self.test_repo.run_hook("fake-hook")
+        self.template.hook_workers.run.assert_called_with(
+            "fake_root/test_template/post-fake",
+            "fake-hook",
+            "testing",
+            "/fake/root",
+            "fake repo",
+            ".copier-answers.yml",
+        )
+        mock_run.assert_not_called()
+
     @patch("filesync.repo.repository.subprocess.run")
     def test_run_hook_no_hook(self, mock_run):
         """
@@ -496,6 +744,7 @@ class TestRepository(TestCase):
         mock_git.assert_called_with("checkout", "-b", "fake_branch")
 
     @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
     @patch("filesync.repo.repository.Repository.clean_stale_branches")
     @patch("filesync.repo.repository.Repository.clone")
     @patch("filesync.repo.repository.Repository.confirm_changes")
@@ -524,6 +773,7 @@ class TestRepository(TestCase):
         mock_hook.assert_called_with("post-push")
 
     @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
     @patch("filesync.repo.repository.Repository.clean_stale_branches")
     @patch("filesync.repo.repository.Repository.clone")
     @patch("filesync.repo.repository.Repository.confirm_changes")
@@ -552,6 +802,7 @@ class TestRepository(TestCase):
         mock_push.assert_not_called()
 
     @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
     @patch("filesync.repo.repository.Repository.clean_stale_branches")
     @patch("filesync.repo.repository.Repository.clone")
     @patch("filesync.repo.repository.Repository.confirm_changes")
@@ -577,3 +828,297 @@ class TestRepository(TestCase):
 
         self.test_repo.update("fixing")
         mock_clean.assert_not_called()
+
+    @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
+    @patch("filesync.repo.repository.Repository.clean_stale_branches")
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.confirm_changes")
+    @patch("filesync.repo.repository.Repository.open_pull_request")
+    @patch("filesync.repo.repository.Repository.push_changes")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_update_superseded(
+        self,
+        mock_switch,
+        mock_copier,
+        mock_hook,
+        mock_push,
+        mock_open,
+        mock_confirm,
+        mock_clone,
+        mock_clean,
+    ):
+        """
+        Test Repository.update() stops before pushing when the template has
+        moved past its pinned head
+        """
+
+        self.template.is_superseded = MagicMock(return_value=True)
+        with self.assertRaises(RunSupersededError):
+            self.test_repo.update("updating")
+        mock_clean.assert_not_called()
+        mock_push.assert_not_called()
+
+    @patch.object(Repository, "needs_update", False)
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render_skipped(
+        self, mock_switch, mock_copier, mock_hook, mock_clone
+    ):
+        """
+        Test Repository.render() when the repo doesn't need an update
+        """
+
+        self.assertFalse(self.test_repo.render("updating"))
+        self.assertEqual(self.test_repo.outcome, "skipped")
+        mock_copier.assert_not_called()
+
+    @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.confirm_changes")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render_rendered(
+        self, mock_switch, mock_copier, mock_hook, mock_confirm, mock_clone
+    ):
+        """
+        Test Repository.render() when copier changed something
+        """
+
+        mock_confirm.return_value = True
+        self.assertTrue(self.test_repo.render("updating"))
+        self.assertEqual(self.test_repo.outcome, "rendered")
+        mock_hook.assert_called_with("post-copier")
+
+    @patch.object(Repository, "needs_update", False)
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render_template_ref(self, mock_switch, mock_hook, mock_clone):
+        """
+        Test Repository.render() renders from the repo's own template ref
+        """
+
+        view = MagicMock()
+        self.template.at_ref = MagicMock(return_value=view)
+        self.test_repo.template_ref = "release-1"
+        self.test_repo.render("updating")
+        self.template.at_ref.assert_called_with("release-1")
+        self.assertIs(self.test_repo.template, view)
+
+    @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
+    @patch("filesync.repo.repository.Repository.plan_render")
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.confirm_changes")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render_incremental(
+        self, mock_switch, mock_copier, mock_hook, mock_confirm, mock_clone,
+        mock_plan
+    ):
+        """
+        Test Repository.render() only renders what the plan says to
+        """
+
+        self.test_repo.incremental_render = True
+        mock_plan().skip = False
+        mock_plan().exclude.return_value = ("*", "!/Makefile")
+        self.test_repo.render("updating")
+        mock_copier.assert_called_with(exclude=("*", "!/Makefile"))
+
+    @patch.object(Repository, "needs_update", True)
+    @patch("filesync.repo.repository.Repository.plan_render")
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render_incremental_nothing_to_do(
+        self, mock_switch, mock_copier, mock_hook, mock_clone, mock_plan
+    ):
+        """
+        Test Repository.render() skips a repo none of the changes apply to
+        """
+
+        self.test_repo.incremental_render = True
+        mock_plan().skip = True
+        self.assertFalse(self.test_repo.render("updating"))
+        self.assertEqual(self.test_repo.outcome, "skipped")
+        mock_copier.assert_not_called()
+
+    @patch("filesync.repo.repository.Repository.clean_stale_branches")
+    @patch("filesync.repo.repository.Repository.open_pull_request")
+    @patch("filesync.repo.repository.Repository.push_changes")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    def test_publish(self, mock_hook, mock_push, mock_open, mock_clean):
+        """
+        Test Repository.publish()
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.publish()
+        mock_clean.assert_called()
+        mock_push.assert_called()
+        mock_open.assert_called()
+        self.assertEqual(self.test_repo.outcome, "pushed")
+
+
+class TestRepositoryCompanions(TestCase):
+    """
+    Tests for filesync.repo.repository:Repository rendering several
+    templates at once
+    """
+
+    def setUp(self):
+        self.template = MagicMock(head="abc123", base_branch="main")
+        self.template.name = "ci"
+        self.template.at_ref.return_value = self.template
+        self.companion = MagicMock(head="def456", base_branch="trunk")
+        self.companion.name = "lint"
+        self.test_repo = Repository(
+            name="fake repo",
+            token="fake_token",
+            github=MagicMock(),
+            clone_root="/fake/root",
+            template=self.template,
+            companions=[(self.companion, ".lint-answers.yml")],
+        )
+
+    def test_commit_message(self):
+        """
+        Test Repository.commit_message has a section for each template
+        """
+
+        self.test_repo.operation = "updating"
+        message = self.test_repo.commit_message
+        self.assertTrue(message.startswith(
+            "ci: updating files from ci, lint\n"))
+        self.assertIn("template: ci\nbranch: main\ncommit: abc123", message)
+        self.assertIn("template: lint\nbranch: trunk\ncommit: def456",
+                      message)
+
+    def test_update_branch_name(self):
+        """
+        Test Repository.update_branch_name names every template and changes
+        whenever any of their heads do
+        """
+
+        self.test_repo.operation = "updating"
+        name = self.test_repo.update_branch_name
+        self.assertTrue(name.startswith("filesync/ci+lint/"))
+        self.companion.head = "fed789"
+        self.assertNotEqual(self.test_repo.update_branch_name, name)
+
+    def test_update_branch_name_reuse_pr(self):
+        """
+        Test Repository.update_branch_name when reusing a group's PR
+        """
+
+        self.test_repo.operation = "updating"
+        self.test_repo.reuse_pr = True
+        self.assertEqual(self.test_repo.update_branch_name,
+                         "filesync/ci+lint")
+
+    @patch.object(Repository, "has_update_branch", True)
+    def test_update_branch_is_current(self):
+        """
+        Test Repository.update_branch_is_current needs every template's head
+        """
+
+        branch = self.test_repo.github.get_branch()
+        branch.commit.commit.message = "commit: abc123\n"
+        self.assertFalse(self.test_repo.update_branch_is_current)
+        branch.commit.commit.message = "commit: abc123\n\ncommit: def456\n"
+        self.assertTrue(self.test_repo.update_branch_is_current)
+
+    @patch.object(Repository, "has_update_branch", False)
+    @patch.object(Repository, "answers_version")
+    def test_needs_update_companion_outdated(self, mock_version):
+        """
+        Test Repository.needs_update when only a companion is behind
+        """
+
+        mock_version.side_effect = lambda path: {
+            ".copier-answers.yml": "abc123",
+            ".lint-answers.yml": "old000",
+        }[path]
+        self.assertTrue(self.test_repo.needs_update)
+        self.assertEqual(self.test_repo.outdated_companions(), ["lint"])
+
+    @patch.object(Repository, "has_update_branch", False)
+    @patch.object(Repository, "answers_version")
+    def test_needs_update_all_current(self, mock_version):
+        """
+        Test Repository.needs_update when every template is current
+        """
+
+        mock_version.side_effect = lambda path: {
+            ".copier-answers.yml": "abc123",
+            ".lint-answers.yml": "def456",
+        }[path]
+        self.assertFalse(self.test_repo.needs_update)
+
+    @patch("filesync.repo.repository.Repository.git_cmd")
+    def test_confirm_changes_answers_files(self, mock_git):
+        """
+        Test Repository.confirm_changes() when only answers files changed
+        """
+
+        mock_git.return_value = " M .copier-answers.yml\n" \
+                                " M .lint-answers.yml\n"
+        self.assertFalse(self.test_repo.confirm_changes())
+        mock_git.return_value = " M .lint-answers.yml\n M setup.cfg\n"
+        self.assertTrue(self.test_repo.confirm_changes())
+
+    @patch("filesync.repo.repository.os.path.exists")
+    def test_select_companions(self, mock_exists):
+        """
+        Test Repository.select_companions() drops templates the repo has no
+        answers file for
+        """
+
+        mock_exists.return_value = False
+        self.test_repo.select_companions()
+        self.assertEqual(self.test_repo.companions, [])
+
+    @patch("copier.copy")
+    @patch("filesync.repo.repository.Repository.munge_answers")
+    def test_run_copier_companion(self, mock_munge, mock_copy):
+        """
+        Test Repository.run_copier() renders a companion against its own
+        answers file, without the main template's answers
+        """
+
+        self.test_repo.answers = {"use_docker": True}
+        self.test_repo.run_copier(self.companion, ".lint-answers.yml")
+        _, kwargs = mock_copy.call_args
+        self.assertEqual(kwargs["answers_file"], ".lint-answers.yml")
+        self.assertEqual(kwargs["data"], {})
+        mock_munge.assert_called_with(".lint-answers.yml")
+
+    @patch.object(Repository, "needs_update", True)
+    @patch.object(Repository, "build_manifest", MagicMock())
+    @patch("filesync.repo.repository.Repository.select_companions")
+    @patch("filesync.repo.repository.Repository.clone")
+    @patch("filesync.repo.repository.Repository.confirm_changes")
+    @patch("filesync.repo.repository.Repository.run_hook")
+    @patch("filesync.repo.repository.Repository.run_copier")
+    @patch("filesync.repo.repository.Repository.switch_to_update_branch")
+    def test_render(
+        self, mock_switch, mock_copier, mock_hook, mock_confirm, mock_clone,
+        mock_select
+    ):
+        """
+        Test Repository.render() renders each template in turn
+        """
+
+        self.assertTrue(self.test_repo.render("updating"))
+        mock_copier.assert_any_call(exclude=())
+        mock_copier.assert_called_with(self.companion, ".lint-answers.yml")
@@ -3,13 +3,19 @@ Unit tests for filesync/repo/template.py
 """
 # pylint: disable=protected-access
 
+from copy import copy
 from unittest import TestCase
-from unittest.mock import MagicMock, patch
+from unittest.mock import MagicMock, PropertyMock, patch
+
+from github import GithubException
+from sh import ErrorReturnCode
 
 from filesync.exceptions import (
     MissingRequiredConfigError,
     TemplateConfigMissingError,
+    TemplateRefError,
 )
+from filesync.repo.base_repo import BaseRepo
 from filesync.repo.template import Template
 
 
@@ -124,3 +130,156 @@ class TestTemplate(TestCase):
         self.template.operation = "updating"
         with self.assertRaises(MissingRequiredConfigError):
             self.template.validate_template_config()
+
+    @patch("filesync.repo.template.BaseRepo.git_cmd")
+    def test_pin_head(self, mock_git):
+        """
+        Test Template.pin_head() uses the commit that was cloned
+        """
+
+        mock_git.return_value = "abc123\n"
+        self.template.pin_head()
+        mock_git.assert_called_with("rev-parse", "HEAD")
+        self.assertEqual(self.template.head, "abc123")
+
+    @patch.object(BaseRepo, "head", new_callable=PropertyMock)
+    def test_is_superseded_not_pinned(self, mock_head):
+        """
+        Test Template.is_superseded() without a pinned head
+        """
+
+        self.assertFalse(self.template.is_superseded())
+        mock_head.assert_not_called()
+
+    @patch("filesync.repo.template.monotonic")
+    @patch.object(BaseRepo, "head", new_callable=PropertyMock)
+    def test_is_superseded(self, mock_head, mock_monotonic):
+        """
+        Test Template.is_superseded() once the branch moves on, asking GitHub
+        at most once per interval
+        """
+
+        self.template.pinned_head = "abc123"
+        mock_head.return_value = "abc123"
+        mock_monotonic.return_value = 100
+        self.assertFalse(self.template.is_superseded())
+
+        mock_head.return_value = "def456"
+        mock_monotonic.return_value = 110
+        self.assertFalse(self.template.is_superseded())
+        self.assertEqual(mock_head.call_count, 1)
+
+        mock_monotonic.return_value = 200
+        self.assertTrue(self.template.is_superseded())
+        self.assertEqual(self.template.superseded_by, "def456")
+        self.assertEqual(self.template.head, "abc123")
+
+    def test_at_ref_same_branch(self):
+        """
+        Test Template.at_ref() is the template itself for its own branch
+        """
+
+        self.template._base_branch = "main"
+        self.assertIs(self.template.at_ref(None), self.template)
+        self.assertIs(self.template.at_ref("main"), self.template)
+
+    @patch("filesync.repo.template.Template.add_worktree")
+    def test_at_ref_cached(self, mock_add):
+        """
+        Test Template.at_ref() checks each ref out once, for every copy of
+        the template
+        """
+
+        self.template._base_branch = "main"
+        view = self.template.at_ref("release-1")
+        self.assertIs(copy(self.template).at_ref("release-1"), view)
+        mock_add.assert_called_once_with("release-1")
+
+    @patch("filesync.repo.template.os.path.exists")
+    @patch("filesync.repo.template.Template.git_cmd")
+    def test_add_worktree(self, mock_git, mock_exists):
+        """
+        Test Template.add_worktree() makes a view of the ref's head
+        """
+
+        mock_exists.return_value = False
+        mock_git.side_effect = lambda *args: "abc123\n" \
+            if args[0] == "rev-parse" else ""
+        view = self.template.add_worktree("release/1")
+        mock_git.assert_any_call("fetch", "--depth", "1", "origin",
+                                 "release/1")
+        mock_git.assert_called_with("worktree", "add", "-B", "release/1",
+                                    "fake_root/test_template@release_1",
+                                    "abc123")
+        self.assertEqual(view.clone_path, "fake_root/test_template@release_1")
+        self.assertEqual(view.head, "abc123")
+        self.assertEqual(view.vcs_ref, "release/1")
+        self.assertEqual(view.base_branch, "release/1")
+        self.assertEqual(self.template.clone_path, "fake_root/test_template")
+        self.assertFalse(view.is_superseded())
+
+    @patch("filesync.repo.template.os.path.exists")
+    @patch("filesync.repo.template.Template.git_cmd")
+    def test_add_worktree_missing_ref(self, mock_git, mock_exists):
+        """
+        Test Template.add_worktree() with a ref the template doesn't have
+        """
+
+        mock_exists.return_value = False
+        mock_git.side_effect = ErrorReturnCode(
+            "git fetch", b"", b"couldn't find remote ref nope")
+        with self.assertRaises(TemplateRefError):
+            self.template.add_worktree("nope")
+
+    @patch("filesync.repo.template.Template.git_cmd")
+    def test_changed_files(self, mock_git):
+        """
+        Test Template.changed_files() fetches the old commit and diffs it
+        once
+        """
+
+        old = "3f2a9c1" + "0" * 33
+        self.template.pinned_head = "new456"
+        mock_git.return_value = "Makefile\nsetup.cfg.jinja\n"
+        self.assertEqual(self.template.changed_files(old),
+                         ["Makefile", "setup.cfg.jinja"])
+        self.template.changed_files(old)
+        mock_git.assert_any_call("fetch", "--depth", "1", "origin", old)
+        mock_git.assert_called_with("diff", "--name-only", "--no-renames",
+                                    old, "new456")
+        self.assertEqual(mock_git.call_count, 2)
+
+    @patch("filesync.repo.template.Template.git_cmd")
+    def test_changed_files_unreachable(self, mock_git):
+        """
+        Test Template.changed_files() when the old commit can't be fetched
+        """
+
+        self.template.pinned_head = "new456"
+        mock_git.side_effect = ErrorReturnCode(
+            "git fetch", b"", b"not our ref")
+        self.assertIsNone(self.template.changed_files("abc"))
+
+    def test_resolve_commit(self):
+        """
+        Test Template.resolve_commit() turns what git describe recorded into
+        a full sha
+        """
+
+        self.template.github = MagicMock()
+        self.template.github.get_commit.return_value.sha = "3f2a9c1" + "0" * 33
+        for version, ref in [("3f2a9c1", "3f2a9c1"), ("v1.2.0", "v1.2.0"),
+                             ("v1.2.0-3-g3f2a9c1", "3f2a9c1")]:
+            self.assertEqual(self.template.resolve_commit(version),
+                             "3f2a9c1" + "0" * 33)
+            self.template.github.get_commit.assert_called_with(ref)
+
+    def test_resolve_commit_unknown(self):
+        """
+        Test Template.resolve_commit() with a version GitHub doesn't know
+        """
+
+        self.template.github = MagicMock()
+        self.template.github.get_commit.side_effect = GithubException(
+            422, {"message": "No commit found"}, None)
+        self.assertIsNone(self.template.resolve_commit("3f2a9c1"))
@@ -0,0 +1,70 @@
+"""
+Test retry.py
+"""
+
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from sh import ErrorReturnCode_128
+
+from filesync.retry import RetryPolicy
+
+
+def git_error(stderr):
+    return ErrorReturnCode_128("git", b"", stderr.encode())
+
+
+class TestRetryPolicy(TestCase):
+    """
+    Test RetryPolicy
+    """
+
+    def setUp(self):
+        self.policy = RetryPolicy()
+        self.policy.configure(retries=2, backoff=1)
+
+    def test_configure_defaults(self):
+        """
+        Test RetryPolicy.configure() falls back to the defaults
+        """
+
+        self.policy.configure()
+        self.assertEqual(self.policy.retries, 3)
+        self.assertEqual(self.policy.backoff, 2)
+        self.assertEqual(self.policy.delay(2), 8)
+
+    def test_is_transient(self):
+        """
+        Test RetryPolicy.is_transient() for network and other failures
+        """
+
+        network = git_error("fatal: unable to access: Could not resolve host")
+        self.assertTrue(self.policy.is_transient("fetch", network))
+        self.assertFalse(self.policy.is_transient("commit", network))
+        self.assertFalse(self.policy.is_transient(
+            "push", git_error("! [rejected] (non-fast-forward)")))
+
+    @patch("filesync.retry.sleep")
+    def test_run_git_backoff(self, mock_sleep):
+        """
+        Test RetryPolicy.run_git() backs off exponentially, then gives up
+        """
+
+        run = MagicMock(side_effect=git_error("error: RPC failed"))
+        before_retry = MagicMock()
+        with self.assertRaises(ErrorReturnCode_128):
+            self.policy.run_git("fetch", run, before_retry)
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual([c.args[0] for c in mock_sleep.call_args_list],
+                         [1, 2])
+        self.assertEqual(before_retry.call_count, 2)
+
+    def test_github_retry(self):
+        """
+        Test RetryPolicy.github_retry() passes the policy on to urllib3
+        """
+
+        retry = self.policy.github_retry()
+        self.assertEqual(retry.total, 2)
+        self.assertEqual(retry.backoff_factor, 1)
+        self.assertIn(502, retry.status_forcelist)
@@ -0,0 +1,42 @@
+"""
+Test RunLock class
+"""
+
+import fcntl
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from filesync.run_lock import RunLock
+
+
+class TestRunLock(TestCase):
+    """
+    Test RunLock
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.lock = RunLock(self.tmp_dir.name, "org__template")
+
+    def test_acquire_and_release(self):
+        """
+        Test RunLock.acquire() holds the lock until release()
+        """
+
+        self.lock.acquire()
+        with open(self.lock.lock_path) as other:
+            with self.assertRaises(BlockingIOError):
+                fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self.lock.release()
+        with open(self.lock.lock_path) as other:
+            fcntl.flock(other, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def test_last_done(self):
+        """
+        Test RunLock.last_done before and after mark_done()
+        """
+
+        self.assertIsNone(self.lock.last_done)
+        self.lock.mark_done("abc123")
+        self.assertEqual(self.lock.last_done, "abc123")
@@ -0,0 +1,81 @@
+"""
+Test ScanState class
+"""
+
+import os.path
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync.scan_state import ScanState, as_utc
+
+
+class TestScanState(TestCase):
+    """
+    Test ScanState
+    """
+
+    def setUp(self):
+        self.tmp_dir = TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.path = os.path.join(self.tmp_dir.name, "autoscan", "tpl.json")
+        self.fingerprint = {"org": "fake_org"}
+
+    def test_as_utc_naive(self):
+        """
+        Test as_utc() treats naive datetimes as UTC
+        """
+
+        self.assertEqual(
+            as_utc(datetime(2021, 1, 1)),
+            datetime(2021, 1, 1, tzinfo=timezone.utc),
+        )
+
+    def test_load_missing(self):
+        """
+        Test ScanState.load() without a previous scan
+        """
+
+        state = ScanState(self.path, self.fingerprint)
+        self.assertIsNone(state.high_water_mark)
+        self.assertEqual(state.repos, [])
+
+    def test_save_and_load(self):
+        """
+        Test ScanState round-trips through save() and load()
+        """
+
+        mark = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        ScanState(self.path, self.fingerprint).save(mark, {"b", "a"})
+        state = ScanState(self.path, self.fingerprint)
+        self.assertEqual(state.high_water_mark, mark)
+        self.assertEqual(state.repos, ["a", "b"])
+
+    def test_load_fingerprint_changed(self):
+        """
+        Test ScanState.load() ignores state saved under other settings
+        """
+
+        mark = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        ScanState(self.path, self.fingerprint).save(mark, {"a"})
+        state = ScanState(self.path, {"org": "other_org"})
+        self.assertIsNone(state.high_water_mark)
+        self.assertEqual(state.repos, [])
+
+    def test_is_stale(self):
+        """
+        Test ScanState.is_stale() against the high water mark
+        """
+
+        state = ScanState(self.path, self.fingerprint)
+        repo = MagicMock()
+        repo.pushed_at = datetime(2021, 1, 1)
+        self.assertFalse(state.is_stale(repo))
+
+        state.high_water_mark = datetime(2021, 1, 2, tzinfo=timezone.utc)
+        self.assertTrue(state.is_stale(repo))
+        repo.pushed_at = datetime(2021, 1, 3)
+        self.assertFalse(state.is_stale(repo))
+        repo.pushed_at = None
+        self.assertFalse(state.is_stale(repo))
@@ -0,0 +1,91 @@
+"""
+Test schedule.py
+"""
+
+from datetime import datetime, timezone
+from time import monotonic
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from filesync.schedule import DEFAULT_DURATION, Schedule, format_duration, \
+                              parse_duration
+
+
+class TestParseDuration(TestCase):
+    """
+    Test parse_duration()
+    """
+
+    def test_parse_duration(self):
+        """
+        Test parse_duration() with units, several units and none
+        """
+
+        self.assertEqual(parse_duration("45m"), 2700)
+        self.assertEqual(parse_duration("1h30m"), 5400)
+        self.assertEqual(parse_duration("90s"), 90)
+        self.assertEqual(parse_duration("120"), 120)
+
+    def test_parse_duration_invalid(self):
+        """
+        Test parse_duration() with something that isn't a duration
+        """
+
+        for text in ["soon", "45 minutes", "1h30", ""]:
+            with self.assertRaises(ValueError):
+                parse_duration(text)
+
+    def test_format_duration(self):
+        """
+        Test format_duration() to the nearest minute
+        """
+
+        self.assertEqual(format_duration(1260), "21m")
+        self.assertEqual(format_duration(5400), "1h30m")
+        self.assertEqual(format_duration(3610), "1h00m")
+
+
+class TestSchedule(TestCase):
+    """
+    Test Schedule
+    """
+
+    def test_projected(self):
+        """
+        Test Schedule.projected() falls back to the median for new repos
+        """
+
+        schedule = Schedule(600, {"a": 10, "b": 20, "c": 90})
+        self.assertEqual(schedule.projected("a"), 10)
+        self.assertEqual(schedule.projected("new"), 20)
+        self.assertEqual(Schedule(600, {}).projected("new"),
+                         DEFAULT_DURATION)
+
+    def test_fits(self):
+        """
+        Test Schedule.fits() counts the time already spent
+        """
+
+        schedule = Schedule(100, {"quick": 10, "slow": 80},
+                            started=monotonic() - 30)
+        self.assertTrue(schedule.fits("quick"))
+        self.assertFalse(schedule.fits("slow"))
+
+    def test_order(self):
+        """
+        Test Schedule.order() goes by priority, then commits behind, then
+        the longest since the last sync
+        """
+
+        specs = {name: MagicMock(listed_name=name, priority=0)
+                 for name in ["fresh", "stale", "unknown", "urgent", "old"]}
+        specs["urgent"].priority = 5
+        behind = {"fresh": 1, "stale": 30, "old": 1, "urgent": 0}
+        last_synced = {
+            "fresh": datetime(2024, 6, 1, tzinfo=timezone.utc),
+            "old": datetime(2023, 1, 1, tzinfo=timezone.utc),
+        }
+        ordered = Schedule(600, {}).order(list(specs.values()), behind,
+                                          last_synced)
+        self.assertEqual([spec.listed_name for spec in ordered],
+                         ["urgent", "unknown", "stale", "old", "fresh"])
@@ -0,0 +1,305 @@
+"""
+Test server.py
+"""
+
+import io
+import json
+import logging
+import os.path
+import threading
+from contextvars import copy_context
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from filesync.client import RemoteFileSync
+from filesync.retry import DEFAULT_RETRIES
+from filesync.server import JobLogHandler, Server, TemplateCache
+from filesync.tracing import tracer
+
+
+class FakeTemplate(object):
+    def __init__(self, clone_root, head):
+        self.clone_root = clone_root
+        self.live_head = head
+        self.pinned_head = None
+        self.operation = None
+        self.hook_workers = None
+        self.superseded_by = None
+        self._superseded_checked_at = None
+
+    def pin_head(self):
+        self.pinned_head = self.live_head
+
+
+def read_messages(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestJobLogHandler(TestCase):
+    """
+    Test JobLogHandler
+    """
+
+    def setUp(self):
+        self.handler = JobLogHandler()
+        self.logger = logging.getLogger("TestJobLogHandler")
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.handler)
+        self.addCleanup(self.logger.removeHandler, self.handler)
+
+    def test_emit(self):
+        """
+        Test records reach the stream attached to the logging thread
+        """
+
+        stream = io.BytesIO()
+        self.handler.attach(stream, logging.INFO)
+        self.logger.debug("too quiet")
+        self.logger.info("hello")
+        self.handler.detach()
+        self.logger.info("after the job")
+
+        messages = read_messages(io.StringIO(stream.getvalue().decode()))
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0]["log"].endswith("hello"))
+
+    def test_emit_other_thread(self):
+        """
+        Test records from another thread don't reach the stream
+        """
+
+        stream = io.BytesIO()
+        self.handler.attach(stream, logging.DEBUG)
+        thread = threading.Thread(target=self.logger.info, args=["elsewhere"])
+        thread.start()
+        thread.join()
+        self.handler.detach()
+
+        self.assertEqual(stream.getvalue(), b"")
+
+    def test_emit_job_threads(self):
+        """
+        Test records from the threads a job hands its context to reach that
+        job's stream, and no other
+        """
+
+        streams = {"a": io.BytesIO(), "b": io.BytesIO()}
+        attached = threading.Barrier(2)
+
+        def job(name):
+            self.handler.attach(streams[name], logging.DEBUG)
+            attached.wait()
+            worker = threading.Thread(target=copy_context().run,
+                                      args=[self.logger.info, f"from {name}"])
+            worker.start()
+            worker.join()
+            self.handler.detach()
+
+        jobs = [threading.Thread(target=job, args=[name]) for name in streams]
+        for thread in jobs:
+            thread.start()
+        for thread in jobs:
+            thread.join()
+
+        for name, stream in streams.items():
+            messages = read_messages(io.StringIO(stream.getvalue().decode()))
+            self.assertEqual([message["log"].rsplit(": ", 1)[1]
+                              for message in messages], [f"from {name}"])
+
+
+class TestTemplateCache(TestCase):
+    """
+    Test TemplateCache
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache = TemplateCache(tmp_dir.name)
+        self.head = "abc"
+        self.built = list()
+        self.filesync = MagicMock()
+        self.filesync.config.operation = "updating"
+        self.filesync.build_template.side_effect = self.build_template
+
+    def build_template(self, name, clone_root):
+        os.makedirs(clone_root)
+        self.built.append(FakeTemplate(clone_root, self.head))
+        return self.built[-1]
+
+    def test_get_reuses_clone(self):
+        """
+        Test get() clones once while the template doesn't move
+        """
+
+        first = self.cache.get(self.filesync, "org/template")
+        second = self.cache.get(self.filesync, "org/template")
+
+        self.filesync.build_template.assert_called_once()
+        self.assertEqual(first.clone_root, second.clone_root)
+        self.assertIsNot(first, second)
+        self.assertEqual(first.pinned_head, "abc")
+        self.assertEqual(first.operation, "updating")
+
+    def test_get_after_template_moves(self):
+        """
+        Test get() clones again once the template moves, and the old clone
+        is removed when its last job releases it
+        """
+
+        first = self.cache.get(self.filesync, "org/template")
+        self.built[0].live_head = self.head = "def"
+        second = self.cache.get(self.filesync, "org/template")
+
+        self.assertNotEqual(first.clone_root, second.clone_root)
+        self.assertEqual(second.pinned_head, "def")
+        self.assertTrue(os.path.exists(first.clone_root))
+
+        self.cache.release(first)
+        self.assertFalse(os.path.exists(first.clone_root))
+        self.cache.release(second)
+        self.assertTrue(os.path.exists(second.clone_root))
+
+
+class TestServer(TestCase):
+    """
+    Test Server
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = tmp_dir.name
+        self.server = Server(os.path.join(self.tmp_dir, "filesync.sock"),
+                             self.tmp_dir, self.tmp_dir)
+        self.server.templates = MagicMock()
+        self.filesync = MagicMock()
+        build_patch = patch.object(self.server, "build_filesync",
+                                   return_value=self.filesync)
+        build_patch.start()
+        self.addCleanup(build_patch.stop)
+
+    def test_run_job(self):
+        """
+        Test run_job() runs the command and releases the template
+        """
+
+        returncode = self.server.run_job(1, "fix", {}, {"repo": "r",
+                                                        "branch": "b"})
+
+        self.assertEqual(returncode, 0)
+        self.filesync.fix.assert_called_with(repo="r", branch="b")
+        self.server.templates.release.assert_called_with(
+            self.filesync.template)
+
+    def test_run_job_dies(self):
+        """
+        Test run_job() when FileSync exits
+        """
+
+        self.filesync.update.side_effect = SystemExit(1)
+
+        self.assertEqual(self.server.run_job(1, "update", {}, {}), 1)
+        self.server.templates.release.assert_called()
+
+    def test_run_job_fails(self):
+        """
+        Test run_job() when the command raises
+        """
+
+        self.filesync.update.side_effect = RuntimeError("boom")
+
+        self.assertEqual(self.server.run_job(1, "update", {}, {}), 1)
+
+    @patch("github.Github")
+    def test_build_filesync_one_session(self, mock_github):
+        """
+        Test jobs starting at the same time share one GitHub session
+        """
+
+        server = Server(os.path.join(self.tmp_dir, "other.sock"),
+                        self.tmp_dir, self.tmp_dir)
+        started = threading.Barrier(4)
+
+        def build(job_id):
+            started.wait()
+            return server.build_filesync(job_id, {})
+
+        threads = [threading.Thread(target=build, args=[job_id])
+                   for job_id in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        mock_github.assert_called_once()
+        retry = mock_github.call_args.kwargs["retry"]
+        self.assertEqual(retry.total, DEFAULT_RETRIES)
+
+    def test_handle_job_state(self):
+        """
+        Test handle() gives each job its own spans and API calls
+        """
+
+        def update(**kwargs):
+            with tracer.span("update"):
+                pass
+            self.assertEqual(len(tracer.spans), 1)
+
+        self.filesync.update.side_effect = update
+        with tracer.span("outside"):
+            pass
+        before = len(tracer.spans)
+        stream = io.BytesIO()
+        self.server.handle({"command": "update"}, stream)
+
+        messages = read_messages(io.StringIO(stream.getvalue().decode()))
+        self.assertEqual(messages[-1]["exit"], 0)
+        self.assertEqual(len(tracer.spans), before)
+
+    def test_handle_unknown_command(self):
+        """
+        Test handle() with a command the server doesn't run
+        """
+
+        stream = io.BytesIO()
+        self.server.handle({"command": "inventory"}, stream)
+
+        messages = read_messages(io.StringIO(stream.getvalue().decode()))
+        self.assertEqual(messages[-1]["exit"], 2)
+        self.filesync.inventory.assert_not_called()
+
+    def test_serve(self):
+        """
+        Test a job sent by RemoteFileSync runs and streams its logs back
+        """
+
+        def update(**kwargs):
+            logging.getLogger("FileSync").info("updating away")
+
+        self.filesync.update.side_effect = update
+        root = logging.getLogger()
+        self.addCleanup(root.setLevel, root.level)
+        for handler in root.handlers:
+            self.addCleanup(handler.setLevel, handler.level)
+        self.addCleanup(root.removeHandler, self.server.log_handler)
+
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+        while self.server.server is None:
+            sleep(0.01)
+
+        remote = RemoteFileSync(self.server.socket_path, template="tpl")
+        with patch("filesync.client.click.echo") as mock_echo:
+            remote.update(single_repo="repo")
+
+        self.filesync.update.assert_called_with(
+            single_repo="repo", cache=None, incremental=False, where=[],
+            quiet_period=None, journal=None, resume=None, retry_failed=None,
+            with_templates=[], incremental_render=False, time_budget=None)
+        logged = [call.args[0] for call in mock_echo.call_args_list]
+        self.assertTrue(any(line.endswith("updating away")
+                            for line in logged))
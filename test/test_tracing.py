@@ -0,0 +1,166 @@
+"""
+Test tracing.py
+"""
+
+import json
+import os.path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import patch
+
+from filesync.tracing import Tracer, traced
+
+
+class FakeRepo:  # pylint: disable=too-few-public-methods
+    """
+    Something with trace attributes to decorate
+    """
+
+    trace_attributes = {"repo": "fake_repo", "template": "fake_template"}
+
+    @traced("work")
+    def work(self, fail=False):
+        """
+        Do some traced work
+        """
+
+        if fail:
+            raise ValueError("nope")
+        return "done"
+
+
+class TestTracer(TestCase):
+    """
+    Test Tracer
+    """
+
+    def setUp(self):
+        self.tracer = Tracer()
+
+    def test_span_nesting(self):
+        """
+        Test Tracer.span() nests spans and inherits repo and template
+        """
+
+        with self.tracer.span("update", repo="one", template="tpl") as outer:
+            with self.tracer.span("clone", extra=1) as inner:
+                self.assertIs(self.tracer.current, inner)
+            self.assertIs(self.tracer.current, outer)
+        self.assertIsNone(self.tracer.current)
+
+        self.assertEqual([s.name for s in self.tracer.spans],
+                         ["clone", "update"])
+        self.assertIs(inner.parent, outer)
+        self.assertEqual(inner.attributes,
+                         {"repo": "one", "template": "tpl", "extra": 1})
+        self.assertTrue(outer.is_repo_root)
+        self.assertFalse(inner.is_repo_root)
+        self.assertGreaterEqual(outer.duration, inner.duration)
+
+    def test_span_error(self):
+        """
+        Test Tracer.span() records errors and re-raises them
+        """
+
+        with self.assertRaises(ValueError):
+            with self.tracer.span("clone"):
+                raise ValueError("nope")
+        self.assertEqual(self.tracer.spans[0].error, "ValueError: nope")
+
+    def test_span_listeners(self):
+        """
+        Test Tracer.span() tells listeners about finished spans
+        """
+
+        finished = []
+        self.tracer.listeners.append(finished.append)
+        with self.tracer.span("clone") as span:
+            pass
+        self.assertEqual(finished, [span])
+
+    def test_summary(self):
+        """
+        Test Tracer.summary() totals repos and phases
+        """
+
+        with self.tracer.span("update", repo="slow"):
+            with self.tracer.span("clone"):
+                pass
+        with self.tracer.span("update", repo="fast"):
+            pass
+        self.tracer.spans[0].duration = 1.0
+        self.tracer.spans[1].duration = 3.0
+        self.tracer.spans[2].duration = 0.5
+
+        summary = self.tracer.summary()
+        self.assertEqual(summary["slowest_repos"], [
+            {"repo": "slow", "duration": 3.0},
+            {"repo": "fast", "duration": 0.5},
+        ])
+        self.assertEqual(summary["phases"][0], {
+            "name": "update", "count": 2, "total": 3.5, "mean": 1.75,
+            "max": 3.0,
+        })
+
+    def test_otlp(self):
+        """
+        Test Tracer.otlp() links children to their parents
+        """
+
+        with self.tracer.span("update", repo="one"):
+            with self.tracer.span("clone"):
+                pass
+        spans = self.tracer.otlp()["resourceSpans"][0]["scopeSpans"][0][
+            "spans"]
+        clone, update = spans
+        self.assertEqual(clone["parentSpanId"], update["spanId"])
+        self.assertNotIn("parentSpanId", update)
+        self.assertEqual(clone["traceId"], self.tracer.trace_id)
+        self.assertIn({"key": "repo", "value": {"stringValue": "one"}},
+                      clone["attributes"])
+
+    @patch("urllib.request.urlopen")
+    def test_send_otlp_failure(self, mock_urlopen):
+        """
+        Test Tracer.send_otlp() doesn't raise when the collector is down
+        """
+
+        mock_urlopen.side_effect = OSError("connection refused")
+        self.tracer.send_otlp("http://localhost:4318/v1/traces")
+        mock_urlopen.assert_called()
+
+    def test_write_report(self):
+        """
+        Test Tracer.write_report()
+        """
+
+        with self.tracer.span("update", repo="one"):
+            pass
+        with TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "timings.json")
+            self.tracer.write_report(path, {"git": {"commands": 2}})
+            with open(path) as fin:
+                report = json.load(fin)
+        self.assertEqual(report["spans"][0]["name"], "update")
+        self.assertEqual(report["git"], {"commands": 2})
+        self.assertEqual(report["summary"]["slowest_repos"][0]["repo"], "one")
+
+
+class TestTraced(TestCase):
+    """
+    Test traced()
+    """
+
+    @patch("filesync.tracing.tracer", new_callable=Tracer)
+    def test_traced(self, mock_tracer):
+        """
+        Test traced() wraps a method in a span with the object's attributes
+        """
+
+        self.assertEqual(FakeRepo().work(), "done")
+        with self.assertRaises(ValueError):
+            FakeRepo().work(fail=True)
+        self.assertEqual(len(mock_tracer.spans), 2)
+        self.assertEqual(mock_tracer.spans[0].attributes,
+                         FakeRepo.trace_attributes)
+        self.assertIsNotNone(mock_tracer.spans[1].error)
@@ -0,0 +1,309 @@
+"""
+Test webhook.py
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import os.path
+import threading
+from os import environ
+from tempfile import TemporaryDirectory
+from time import sleep
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from github import GithubException
+
+from filesync.filesync import FileSync
+from filesync.webhook import (
+    PAYLOAD_COMMITS,
+    TEMPLATE_JOB,
+    JobQueue,
+    WebhookReceiver,
+    verify_signature,
+)
+
+SECRET = "It's a Secret to Everybody"
+
+
+def sign(body, secret=SECRET):
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def push(full_name, files=(), ref="refs/heads/main", **repo):
+    owner, name = full_name.split("/")
+    return {
+        "ref": ref,
+        "repository": {"full_name": full_name, "name": name,
+                       "owner": {"login": owner}, "default_branch": "main",
+                       **repo},
+        "commits": [{"added": [], "modified": list(files), "removed": []}],
+    }
+
+
+class TestVerifySignature(TestCase):
+    """
+    Test verify_signature()
+    """
+
+    def test_verify_signature(self):
+        """
+        Test verify_signature() with good, bad and missing signatures
+        """
+
+        body = b'{"zen": "Keep it logically awesome."}'
+        self.assertTrue(verify_signature(SECRET, body, sign(body)))
+        self.assertFalse(verify_signature(SECRET, body, sign(body, "nope")))
+        self.assertFalse(verify_signature(SECRET, body, None))
+
+
+class TestJobQueue(TestCase):
+    """
+    Test JobQueue
+    """
+
+    def test_put(self):
+        """
+        Test JobQueue.put() drops waiting duplicates and stops when full
+        """
+
+        queue = JobQueue(2)
+        self.assertEqual(queue.put(("repo", "a")), "queued")
+        self.assertEqual(queue.put(("repo", "a")), "duplicate")
+        self.assertEqual(queue.put(("repo", "b")), "queued")
+        self.assertEqual(queue.put(("repo", "c")), "full")
+        self.assertEqual(queue.get(), ("repo", "a"))
+        self.assertEqual(queue.put(("repo", "a")), "queued")
+
+
+class TestWebhookReceiver(TestCase):
+    """
+    Test WebhookReceiver
+    """
+
+    def setUp(self):
+        self.filesync = MagicMock()
+        template = self.filesync.template
+        template.github.full_name = "org/template"
+        template.base_branch = "main"
+        template.config.repos = {"org/listed": {"answers-file": "answers.yml"}}
+        template.config.answers_file = ".copier-answers.yml"
+        template.config.old_answers_files = None
+        template.config.autoscan = True
+        template.config.org = "org"
+        self.filesync.is_excluded.return_value = False
+        self.receiver = WebhookReceiver(self.filesync, SECRET, "127.0.0.1", 0,
+                                        queue_size=2, quiet_period=5)
+
+    def test_event_template(self):
+        """
+        Test WebhookReceiver.event() with pushes to the template
+        """
+
+        job, _ = self.receiver.event("push", push("org/template"))
+        self.assertEqual(job, TEMPLATE_JOB)
+        job, _ = self.receiver.event(
+            "push", push("org/template", ref="refs/heads/feature"))
+        self.assertIsNone(job)
+
+    def test_event_answers_file(self):
+        """
+        Test WebhookReceiver.event() with pushes that change answers files
+        """
+
+        job, _ = self.receiver.event(
+            "push", push("org/listed", ["answers.yml"]))
+        self.assertEqual(job, ("repo", "org/listed"))
+        job, _ = self.receiver.event(
+            "push", push("org/scanned", [".copier-answers.yml"]))
+        self.assertEqual(job, ("repo", "scanned"))
+
+    def test_event_many_commits(self):
+        """
+        Test WebhookReceiver.event() compares the push's ends when the
+        payload may not list all of its commits
+        """
+
+        payload = dict(push("org/listed", ["README.md"]), before="a1",
+                       after="b2")
+        payload["commits"] *= PAYLOAD_COMMITS
+        compare = self.filesync.github.get_repo().compare
+        compare.return_value.files = [
+            MagicMock(filename="answers.yml", previous_filename=None)]
+        job, _ = self.receiver.event("push", payload)
+        self.assertEqual(job, ("repo", "org/listed"))
+        compare.assert_called_with("a1", "b2")
+
+        compare.return_value.files = [
+            MagicMock(filename="README.md", previous_filename=None)]
+        job, _ = self.receiver.event("push", payload)
+        self.assertIsNone(job)
+
+        compare.side_effect = GithubException(404, {}, {})
+        job, _ = self.receiver.event("push", payload)
+        self.assertEqual(job, ("repo", "org/listed"))
+
+    def test_event_ignored(self):
+        """
+        Test WebhookReceiver.event() with events that don't need a run
+        """
+
+        events = [
+            ("ping", {"zen": "Design for failure."}),
+            ("pull_request", {"action": "opened"}),
+            ("push", push("org/listed", ["README.md"])),
+            ("push", push("org/listed", ["answers.yml"],
+                          ref="refs/heads/feature")),
+            ("push", push("other/repo", [".copier-answers.yml"])),
+            ("push", push("org/fork", [".copier-answers.yml"], fork=True)),
+        ]
+        for name, payload in events:
+            job, reason = self.receiver.event(name, payload)
+            self.assertIsNone(job, reason)
+
+    def test_handle(self):
+        """
+        Test WebhookReceiver.handle() statuses
+        """
+
+        body = json.dumps(push("org/template")).encode()
+        self.assertEqual(self.receiver.handle("push", body, "sha256=0")[0],
+                         401)
+        self.assertEqual(self.receiver.handle("push", b"{", sign(b"{"))[0],
+                         400)
+        self.assertEqual(self.receiver.handle("push", body, sign(body)),
+                         (202, "queued"))
+        self.assertEqual(self.receiver.handle("push", body, sign(body)),
+                         (202, "duplicate"))
+
+        for repo in ["a", "b"]:
+            body = json.dumps(push(f"org/{repo}",
+                                   [".copier-answers.yml"])).encode()
+            status, _ = self.receiver.handle("push", body, sign(body))
+        self.assertEqual(status, 503)
+
+    def test_run_job(self):
+        """
+        Test WebhookReceiver.run_job() for the template and for a repo
+        """
+
+        self.receiver.run_job(TEMPLATE_JOB)
+        self.filesync.new_run().update.assert_called_with(quiet_period=5)
+        self.filesync.refresh_template.assert_called_once()
+
+        self.filesync.new_run().update.side_effect = SystemExit(1)
+        self.receiver.run_job(("repo", "org/listed"))
+        self.filesync.new_run().update.assert_called_with(
+            single_repo="org/listed", answers_changed=True)
+        self.filesync.refresh_template.assert_called_once()
+
+    def test_serve(self):
+        """
+        Test a signed delivery over HTTP gets queued
+        """
+
+        self.receiver.work = MagicMock()
+        thread = threading.Thread(target=self.receiver.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.receiver.shutdown)
+        while self.receiver.server is None:
+            sleep(0.01)
+        port = self.receiver.server.server_address[1]
+
+        def deliver(body, signature):
+            request = Request(f"http://127.0.0.1:{port}/", data=body,
+                              headers={"X-GitHub-Event": "push",
+                                       "X-Hub-Signature-256": signature})
+            with urlopen(request) as response:
+                return response.status
+
+        body = json.dumps(push("org/listed", ["answers.yml"])).encode()
+        self.assertEqual(deliver(body, sign(body)), 202)
+        self.assertEqual(self.receiver.queue.get(), ("repo", "org/listed"))
+        with self.assertRaises(HTTPError) as error:
+            deliver(body, "sha256=0")
+        self.assertEqual(error.exception.code, 401)
+
+
+class TestAnswersPush(TestCase):
+    """
+    Test a push that changes a repo's answers file gets the repo rendered
+    """
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        environ["FAKE_TOKEN"] = "FAKE123"
+        self.filesync = FileSync(token_variable_name="FAKE_TOKEN",
+                                 template="org/template",
+                                 clone_root=os.path.join(tmp_dir.name,
+                                                         "clones"),
+                                 state_dir=os.path.join(tmp_dir.name,
+                                                        "state"))
+        template = self.filesync.template = MagicMock(
+            head="abc123def", checked_out_head="abc123def",
+            base_branch="main", vcs_ref=None, companion_files=[])
+        template.name = "template"
+        template.github.full_name = "org/template"
+        template.at_ref.return_value = template
+        template.config.repos = {"org/listed": {}}
+        template.config.answers_file = ".copier-answers.yml"
+        template.config.old_answers_files = None
+        template.config.get.side_effect = {
+            "answers_file": ".copier-answers.yml", "branch_prefix": "filesync",
+            "branch_separator": "-", "dry_run": False, "hooks": {},
+            "reuse_pr": False}.get
+
+        def start(run, _):
+            run.logger = MagicMock()
+            run.template = template
+            run.github = MagicMock()
+            run.github.get_organization().get_repo().get_branches \
+                .return_value = []
+
+        def clone(repo):
+            # the repo is already at the template head
+            os.makedirs(repo.clone_path, exist_ok=True)
+            with open(repo.answers_file_path, "w") as fout:
+                fout.write("_commit: abc123def\n_src_path: gh:org/template\n"
+                           "_template_version: abc123def\nlang: rust\n")
+
+        for target, kwargs in [
+                ("filesync.filesync.FileSync.start", {"new": start}),
+                ("filesync.filesync.FileSync.stop", {}),
+                ("filesync.repo.repository.Repository.clone", {"new": clone}),
+                ("filesync.repo.repository.Repository."
+                 "switch_to_update_branch", {}),
+                ("filesync.repo.repository.Repository.build_manifest",
+                 {"return_value": None}),
+                ("filesync.repo.repository.Repository.confirm_changes",
+                 {"return_value": False})]:
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        copier_patcher = patch(
+            "filesync.repo.repository.Repository.run_copier")
+        self.mock_copier = copier_patcher.start()
+        self.addCleanup(copier_patcher.stop)
+        self.receiver = WebhookReceiver(self.filesync, SECRET, "127.0.0.1", 0)
+
+    def test_answers_push(self):
+        """
+        Test a repo already at the template head is rendered again once its
+        answers change, where a plain update would skip it
+        """
+
+        self.filesync.new_run().update(single_repo="org/listed")
+        self.mock_copier.assert_not_called()
+
+        body = json.dumps(push("org/listed", [".copier-answers.yml"])).encode()
+        self.assertEqual(self.receiver.handle("push", body, sign(body)),
+                         (202, "queued"))
+        self.receiver.run_job(self.receiver.queue.get())
+        self.mock_copier.assert_called_once()